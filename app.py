@@ -1,34 +1,417 @@
 # Импортирование необходимых модулей
 import os
-from uuid import uuid4
 from dotenv import load_dotenv, find_dotenv
-from flask import Flask, render_template, request, redirect, flash, json
+
+load_dotenv(find_dotenv())
+
+# Режим работы сервера: threading (по умолчанию, сервер разработки), eventlet или gevent (зелёные потоки)
+# В режимах eventlet и gevent стандартная библиотека заменяется до импорта остальных модулей
+ASYNC_MODE = os.getenv('ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+import re
+import random
+import sys
+import csv
+import bisect
+import threading
+import functools
+import time
+from queue import Queue
+from contextlib import contextmanager
+from collections import deque, Counter
+import hashlib
+import hmac
+import zlib
+from io import StringIO
+from flask import Flask, render_template, request, redirect, flash, json, g, send_from_directory, url_for, session, \
+    has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_sqlalchemy.session import Session
+from sqlalchemy import and_, func, tuple_, event, text, select, insert, update, delete, bindparam, DDL, \
+    literal_column, false, Select, union_all, exists
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from flask_login import LoginManager, UserMixin, login_required, login_user, logout_user, current_user
-from flask_socketio import SocketIO
-from datetime import date
+from flask_socketio import SocketIO, emit, join_room
+from werkzeug.exceptions import HTTPException
+from socketio import PubSubManager, packet
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from markupsafe import Markup
+import orjson
+import click
+
+import cpu_tasks
+
+
+# Очередь сообщений socket.io в памяти процесса (SOCKETIO_MESSAGE_QUEUE=memory://) для тестов без Redis
+class MemoryManager(PubSubManager):
+    name = 'memory'
+    channels = {}
+
+    def _publish(self, data):
+        for queue in MemoryManager.channels.get(self.channel, []):
+            queue.put(data)
+
+    def _listen(self):
+        queue = Queue()
+        MemoryManager.channels.setdefault(self.channel, []).append(queue)
+        while True:
+            yield queue.get()
 
-load_dotenv(find_dotenv())
 
 # Создание экземпляра app
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')
 
 # Создание экземпляра socketio
-socketio = SocketIO(app)
-
-# Настройки приложения и подключения к базе данных
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DB_URI')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Несколько процессов сервера обмениваются событиями через очередь сообщений (например, redis://localhost:6379/0)
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+# Транспорты socket.io. Только websocket — для нескольких процессов gunicorn без балансировщика с привязкой клиента
+# к процессу: запросы long-polling одной сессии могут попасть в разные процессы
+SOCKETIO_TRANSPORTS = [name.strip() for name in (os.getenv('SOCKETIO_TRANSPORTS') or 'polling,websocket').split(',')
+                       if name.strip()]
+socketio_options = {
+    'async_mode': ASYNC_MODE,
+    'transports': SOCKETIO_TRANSPORTS,
+    'ping_interval': int(os.getenv('SOCKETIO_PING_INTERVAL', 25)),
+    'ping_timeout': int(os.getenv('SOCKETIO_PING_TIMEOUT', 20)),
+    'max_http_buffer_size': int(os.getenv('SOCKETIO_MAX_BUFFER_SIZE', 1000000)),
+}
+if SOCKETIO_MESSAGE_QUEUE == 'memory://':
+    socketio_options['client_manager'] = MemoryManager()
+else:
+    socketio_options['message_queue'] = SOCKETIO_MESSAGE_QUEUE
+socketio = SocketIO(app, **socketio_options)
+
+# Максимальное число соединений socket.io на один процесс (0 — без ограничения)
+MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', 0))
+connections = {'count': 0}
+
+# Реплики основной БД для чтения (адреса через запятую). Запросы SELECT обработчиков, отмеченных read_only,
+# выполняются на одной из реплик, остальные запросы — в основной БД
+DB_REPLICA_URIS = [uri.strip() for uri in os.getenv('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+REPLICA_BINDS = ['replica%d' % i for i in range(len(DB_REPLICA_URIS))]
+# После изменения данных пользователя его списки DB_REPLICA_STICKY секунд читаются из основной БД,
+# чтобы он увидел свои изменения, пока реплики их не получили (значение должно превышать отставание реплик)
+DB_REPLICA_STICKY = float(os.getenv('DB_REPLICA_STICKY', 5))
+# Пользователь -> время, до которого его чтения выполняются в основной БД
+primary_until = {}
+
+
+# Данные пользователя изменились: его чтения DB_REPLICA_STICKY секунд выполняются в основной БД.
+# Отметки действуют в пределах процесса
+def user_changed(id_user):
+    if not REPLICA_BINDS or id_user is None:
+        return
+    now = time.monotonic()
+    # Удаление истёкших отметок, чтобы словарь не рос бесконечно
+    if len(primary_until) > 10000:
+        for key in [key for key, until in primary_until.items() if until < now]:
+            primary_until.pop(key, None)
+    primary_until[int(id_user)] = now + DB_REPLICA_STICKY
+
+
+# Пользователь текущего запроса или события socket.io по сессии (без запроса к БД)
+def session_user():
+    return session.get('_user_id') if has_request_context() else None
+
+
+# Сессия SQLAlchemy, выбирающая основную БД или реплику для каждого запроса
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and REPLICA_BINDS:
+            if not isinstance(clause, Select):
+                # Запись: остальные запросы обработчика и чтения пользователя выполняются в основной БД
+                self.info['wrote'] = True
+                user_changed(session_user())
+            elif self.info.get('read_only') and not self.info.get('wrote') and not self.info.get('primary'):
+                id_user = session_user()
+                if id_user is None or primary_until.get(int(id_user), 0) < time.monotonic():
+                    # Все запросы обработчика выполняются на одной реплике
+                    return self._db.engines[self.info.setdefault('replica', random.choice(REPLICA_BINDS))]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+# Подключение приложения к базе данных. Настройки БД читаются и пул соединений создаётся при запуске процесса,
+# а не при импорте модуля: импорт не требует DB_URI и не загружает драйвер СУБД.
+# Вызывается один раз точкой входа процесса: сервером (gunicorn 'app:create_app()', python app.py), командами
+# flask приложения и скриптами; повторный вызов возвращает уже подключённое приложение
+def create_app():
+    if 'sqlalchemy' in app.extensions:
+        return app
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DB_URI')
+    app.config['SQLALCHEMY_BINDS'] = dict(zip(REPLICA_BINDS, DB_REPLICA_URIS))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Пул соединений: проверка соединения перед выдачей из пула включена по умолчанию; размер пула, число
+    # соединений сверх него, ожидание свободного соединения (с) и пересоздание соединений старше заданного
+    # времени (с) задаются для СУБД с пулом QueuePool (PostgreSQL, файл SQLite)
+    engine_options = {'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1'}
+    for option, variable in (('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW'),
+                             ('pool_timeout', 'DB_POOL_TIMEOUT'), ('pool_recycle', 'DB_POOL_RECYCLE')):
+        if os.getenv(variable):
+            engine_options[option] = int(os.getenv(variable))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    db.init_app(app)
+    return app
+
+
+# Миграции схемы базы данных (flask db upgrade). Flask-Migrate и Alembic импортируются только командами flask db,
+# а не при каждом импорте приложения рабочими процессами, фоновыми задачами и скриптами
+def init_migrate():
+    create_app()
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    return app.extensions['migrate']
+
+
+# Группа команд flask db, загружающая команды Flask-Migrate при первом обращении
+class MigrateCommands(click.Group):
+    def migrate_commands(self):
+        init_migrate()
+        from flask_migrate.cli import db as commands
+        return commands
+
+    def list_commands(self, ctx):
+        return self.migrate_commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self.migrate_commands().get_command(ctx, name)
+
+
+app.cli.add_command(MigrateCommands('db', help="Миграции базы данных (Flask-Migrate)."))
 
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER')
+# Максимальный размер загружаемого файла, байт
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+# Передача файлов веб-сервером по заголовку X-Sendfile вместо чтения файла приложением
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
+# Срок кэширования неизменяемых файлов (изображения по хешу, статика с версией в адресе), с
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
 # Создание экземпляра login_manager
 login_manager = LoginManager(app)
 
+# Метод хеширования паролей; пароли с хешем другого метода перехешируются при входе
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+
+# Комнаты socket.io для адресных уведомлений
+CATALOG_ROOM = 'catalog'
+ADMIN_ROOM = 'admin'
+USER_ROOM_PREFIX = 'user_'
+
+
+# Комната пользователя
+def user_room(id_user):
+    return USER_ROOM_PREFIX + str(id_user)
+
+
+# Проверка, что событие socket.io прислал вошедший администратор; у анонимного пользователя нет роли
+def is_admin():
+    return current_user.is_authenticated and current_user.role == "администратор"
+
+
+# Отправка события 'connect' только клиентам из затронутых комнат.
+# Пользователи, получившие уведомление, перечитывают свои списки из основной БД
+def notify(*rooms):
+    for room in rooms:
+        if room.startswith(USER_ROOM_PREFIX):
+            user_changed(room[len(USER_ROOM_PREFIX):])
+    socketio.emit('connect', to=list(set(rooms)))
+
+
+# Обработчик только читает данные: его запросы SELECT выполняются на реплике, если она настроена
+def read_only(handler):
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        db.session.info['read_only'] = True
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            db.session.info.pop('read_only', None)
+    return wrapper
+
+
+# Чтение из основной БД внутри обработчика read_only: для данных, которые кэшируются в памяти процесса
+# или проверяются перед записью
+@contextmanager
+def primary_reads():
+    previous = db.session.info.get('primary')
+    db.session.info['primary'] = True
+    try:
+        yield
+    finally:
+        db.session.info['primary'] = previous
+
+
+# Сброс кэшей в памяти процессов сервера. Процесс, изменивший данные, сбрасывает свой кэш сразу, а остальным
+# процессам рассылает событие INVALIDATE_EVENT через очередь сообщений socket.io (SOCKETIO_MESSAGE_QUEUE);
+# процессы перехватывают это событие и не передают его клиентам
+INVALIDATE_EVENT = 'app_invalidate'
+# Название кэша -> функция сброса кэша в памяти процесса
+invalidation_handlers = {}
+invalidation_listener = {'started': False}
+invalidation_lock = threading.Lock()
+
+
+# Регистрация функции сброса кэша name; функция не обращается к БД, так как вызывается и в потоке очереди сообщений
+def invalidation(name):
+    def decorator(handler):
+        invalidation_handlers[name] = handler
+        return handler
+    return decorator
+
+
+# Сброс кэша name в этом процессе и в остальных процессах сервера. Вызывается после фиксации транзакции,
+# иначе другой процесс может прочитать из БД и снова закэшировать старые данные
+def broadcast_invalidation(name, *args):
+    invalidation_handlers[name](*args)
+    if isinstance(socketio.server.manager, PubSubManager):
+        socketio.server.manager.emit(INVALIDATE_EVENT, [name, list(args)], namespace='/')
+
+
+# Обработка сообщений очереди: сброс кэша по сообщению другого процесса вместо отправки события клиентам
+def receive_invalidations(handle_emit):
+    manager = socketio.server.manager
+
+    def wrapper(message):
+        if message.get('event') != INVALIDATE_EVENT:
+            handle_emit(message)
+        elif message.get('host_id') != manager.host_id:
+            name, args = message['data']
+            handler = invalidation_handlers.get(name)
+            if handler is not None:
+                handler(*args)
+    return wrapper
+
+
+if isinstance(socketio.server.manager, PubSubManager):
+    socketio.server.manager._handle_emit = receive_invalidations(socketio.server.manager._handle_emit)
+
+
+# Подписка на очередь сообщений при первом запросе к процессу. socket.io подписывается только при первом
+# подключении клиента, а кэши заполняются и HTTP-запросами (страница /catalog)
+@app.before_request
+def start_invalidation_listener():
+    if invalidation_listener['started']:
+        return
+    with invalidation_lock:
+        if invalidation_listener['started']:
+            return
+        invalidation_listener['started'] = True
+        server = socketio.server
+        if server.manager_initialized:
+            return
+        server.manager_initialized = True
+        # Поток режима threading не должен задерживать завершение процесса
+        if ASYNC_MODE == 'threading' and isinstance(server.manager, PubSubManager):
+            threading.Thread(target=server.manager._thread, name='invalidations', daemon=True).start()
+        else:
+            server.manager.initialize()
+
+
+# Кэш сериализованных страниц каталога, общий для всех клиентов процесса.
+# epoch отличает версии разных процессов и перезапусков
+catalog_cache = {'epoch': os.urandom(4).hex(), 'version': 0, 'bookings': 0, 'pages': {}}
+CATALOG_CACHE_SIZE = 256
+
+# Размер страницы каталога и длина описания предмета в карточке
+CATALOG_PAGE_SIZE = 24
+DESCRIPTION_PREVIEW = 200
+# Ключ кэша первой страницы каталога без фильтров
+CATALOG_FIRST_PAGE = ('page', None, None, None, "new", None, None, None)
+# Клиент socket.io этого процесса -> период (free_from, free_to) фильтра свободных дат его страницы каталога
+catalog_date_filters = {}
+
+
+# Сброс кэша каталога в памяти процесса
+@invalidation('catalog')
+def clear_catalog_cache():
+    catalog_cache['version'] += 1
+    catalog_cache['pages'] = {}
+
+
+# Сброс кэша каталога во всех процессах при изменении списка активных объявлений
+def invalidate_catalog():
+    broadcast_invalidation('catalog')
+
+
+# Изменилась занятость объявлений в периоде [start, finish). Список активных объявлений тот же, поэтому сбрасываются
+# только страницы с фильтром свободных дат, пересекающимся с периодом, и перечитывают каталог только клиенты процесса
+# с таким фильтром, а не вся комната каталога
+@invalidation('bookings')
+def clear_booked_pages(start, finish):
+    start, finish = datetime.fromisoformat(start), datetime.fromisoformat(finish)
+    catalog_cache['bookings'] += 1
+    catalog_cache['pages'] = {key: page for key, page in catalog_cache['pages'].items()
+                              if not key[6] or not (key[6] < finish and start < key[7])}
+    for sid, (free_from, free_to) in list(catalog_date_filters.items()):
+        if free_from < finish and start < free_to:
+            socketio.emit('connect', to=sid, ignore_queue=True)
+
+
+# Заявка заняла или освободила свой период в каталоге во всех процессах
+def bookings_changed(rent_in):
+    if rent_in.date_rent_start and rent_in.date_rent_finish:
+        broadcast_invalidation('bookings', rent_in.date_rent_start.isoformat(), rent_in.date_rent_finish.isoformat())
+
+
+# Версия каталога, с которой клиент получил страницу: по ней клиент после подключения узнаёт, изменился ли каталог
+def catalog_version():
+    return "%s-%d" % (catalog_cache['epoch'], catalog_cache['version'])
+
+
+# Получение данных из кэша каталога или их построение функцией build
+def cached_catalog(key, build):
+    catalog_json = catalog_cache['pages'].get(key)
+    if catalog_json is None:
+        version = catalog_cache['version'], catalog_cache['bookings']
+        with primary_reads():
+            catalog_json = build()
+        # Сохранение в кэш, если каталог и бронирования не изменились за время запроса
+        if (catalog_cache['version'], catalog_cache['bookings']) == version:
+            if len(catalog_cache['pages']) >= CATALOG_CACHE_SIZE:
+                catalog_cache['pages'] = {}
+            catalog_cache['pages'][key] = catalog_json
+    return catalog_json
+
+
+# Статусы хранятся в БД как SMALLINT, а в приложении остаются строками
+RENT_OUT_STATUSES = ("активно", "неактивно", "удалено")
+RENT_IN_STATUSES = ("подана", "одобрена", "в аренде", "аренда завершена", "заявка истекла")
+COMPLAINT_STATUSES = ("рассматривается", "жалоба закрыта")
+
+
+# Тип столбца статуса: номер статуса в БД и его название в приложении
+class Status(db.TypeDecorator):
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def __init__(self, values):
+        super().__init__()
+        self.values = values
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self.values.index(value) + 1
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.values[value - 1]
+
 
 # Создание моделей базы данных
 # Пользователь
@@ -43,10 +426,89 @@ class User(db.Model, UserMixin):
     hash_password = db.Column(db.String(500), nullable=True)
 
 
+# Кэш авторизованных пользователей: id пользователя -> (время истечения, данные пользователя).
+# Изменения пользователя через приложение сбрасывают кэш во всех процессах; изменения в обход приложения
+# (например, смена роли SQL-запросом) действуют не позже чем через USER_CACHE_TTL секунд
+user_cache = {}
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 30))
+USER_CACHE_SIZE = 10000
+# Счётчики обращений к кэшу; попадание экономит один запрос к БД
+user_cache_stats = {'hits': 0, 'misses': 0}
+
+
+# Данные пользователя для проверки входа и роли без обращения к БД (без хеша пароля)
+class Principal(UserMixin):
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.dob = user.dob
+        self.role = user.role
+        self.phone = user.phone
+        self.email = user.email
+
+
+# Сохранение пользователя в кэш
+def cache_user(user):
+    if len(user_cache) >= USER_CACHE_SIZE:
+        user_cache.clear()
+    principal = Principal(user)
+    user_cache[user.id] = (time.monotonic() + USER_CACHE_TTL, principal)
+    return principal
+
+
+# Удаление пользователей из кэша процесса
+@invalidation('users')
+def invalidate_users(user_ids):
+    for id_user in user_ids:
+        user_cache.pop(id_user, None)
+
+
+# Удаление пользователя из кэша процесса (выход из системы)
+def invalidate_user(id_user):
+    invalidate_users([id_user])
+
+
+# Изменение профиля или роли: пользователь удаляется из кэша этого процесса сразу, а из кэшей остальных
+# процессов — после фиксации транзакции
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def handle_user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+    db.inspect(target).session.info.setdefault('changed_users', set()).add(target.id)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def broadcast_user_changes(session):
+    user_ids = session.info.pop('changed_users', None)
+    if user_ids:
+        broadcast_invalidation('users', sorted(user_ids))
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def discard_user_changes(session, previous_transaction):
+    session.info.pop('changed_users', None)
+
+
 # Определение функции user_loader экземпляра login_manager
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    try:
+        id_user = int(user_id)
+    except ValueError:
+        return None
+    entry = user_cache.get(id_user)
+    if entry is not None and entry[0] > time.monotonic():
+        user_cache_stats['hits'] += 1
+        g.db_roundtrips_saved = g.get('db_roundtrips_saved', 0) + 1
+        return entry[1]
+    user_cache_stats['misses'] += 1
+    # Пользователь кэшируется в процессе, поэтому читается из основной БД, а не из отстающей реплики
+    with primary_reads():
+        user = db.session.get(User, id_user)
+    if user is None:
+        invalidate_user(id_user)
+        return None
+    return cache_user(user)
 
 
 # Предмет
@@ -63,40 +525,1190 @@ class Item(db.Model):
 # Объявление аренды
 class RentOut(db.Model):
     __tablename__ = 'rent_out'
+    # Индексы под фильтры каталога (частичные по активным объявлениям, в порядке ключей страниц каталога)
+    # и страниц пользователя
+    __table_args__ = (
+        db.Index('ix_rent_out_active', 'id_rent_out', postgresql_where=text("status = 1"),
+                 sqlite_where=text("status = 1")),
+        db.Index('ix_rent_out_active_price', 'rent_price', 'id_rent_out', postgresql_where=text("status = 1"),
+                 sqlite_where=text("status = 1")),
+        db.Index('ix_rent_out_active_category', 'category', 'id_rent_out', postgresql_where=text("status = 1"),
+                 sqlite_where=text("status = 1")),
+        db.Index('ix_rent_out_active_category_price', 'category', 'rent_price', 'id_rent_out',
+                 postgresql_where=text("status = 1"), sqlite_where=text("status = 1")),
+        db.Index('ix_rent_out_user_status', 'id_user', 'status'),
+    )
     id_rent_out = db.Column(db.Integer, primary_key=True)
-    status = db.Column(db.String(9), nullable=True)
+    status = db.Column(Status(RENT_OUT_STATUSES), nullable=True)
     id_user = db.Column(db.Integer, db.ForeignKey("user.id"))
     id_item = db.Column(db.Integer, db.ForeignKey("item.id_item"))
+    # Категория и цена предмета: копируются при создании объявления, чтобы фильтры и сортировка страниц каталога
+    # обслуживались индексами объявлений
+    category = db.Column(db.String(100), nullable=True)
+    rent_price = db.Column(db.Numeric, nullable=True)
 
 
 # Заявка на аренду
 class RentIn(db.Model):
     __tablename__ = 'rent_in'
+    # Индексы под заявки арендатора (outgoing, irent) и заявки по объявлениям арендодателя (incoming, notirent),
+    # под выборку фоновых задач по статусу и началу или концу периода аренды
+    __table_args__ = (
+        db.Index('ix_rent_in_user_status', 'id_user', 'status'),
+        db.Index('ix_rent_in_rent_out_status', 'id_rent_out', 'status'),
+        db.Index('ix_rent_in_status_start', 'status', 'date_rent_start'),
+        db.Index('ix_rent_in_status_finish', 'status', 'date_rent_finish'),
+    )
     id_rent_in = db.Column(db.Integer, primary_key=True)
-    status = db.Column(db.String(20), nullable=True)
+    status = db.Column(Status(RENT_IN_STATUSES), nullable=True)
     date_rent_start = db.Column(db.DateTime, nullable=True)
     date_rent_finish = db.Column(db.DateTime, nullable=True)
     note = db.Column(db.Text)
+    # Предмет не возвращён после окончания периода аренды (отмечается фоновой задачей mark_overdue)
+    overdue = db.Column(db.Boolean, nullable=False, default=False, server_default=false())
+    id_user = db.Column(db.Integer, db.ForeignKey("user.id"))
+    id_rent_out = db.Column(db.Integer, db.ForeignKey("rent_out.id_rent_out"))
+
+
+# Архив истории заявок: завершённые аренды и истёкшие заявки, перенесённые из rent_in фоновой задачей
+# archive_history, чтобы таблица rent_in и её индексы содержали только действующие заявки и недавнюю историю.
+# В PostgreSQL таблица секционирована по месяцам окончания аренды (секции создаются задачей при переносе),
+# поэтому выборка истории за период читает только секции этого периода.
+# Строки архива не изменяются, владелец объявления хранится в строке для выборки истории владельца по индексу
+class RentInArchive(db.Model):
+    __tablename__ = 'rent_in_archive'
+    # Индексы под страницы истории арендатора и владельца по убыванию окончания аренды
+    __table_args__ = (
+        db.Index('ix_rent_in_archive_user_finish', 'id_user', 'date_rent_finish', 'id_rent_in'),
+        db.Index('ix_rent_in_archive_owner_finish', 'id_owner', 'date_rent_finish', 'id_rent_in'),
+        {'postgresql_partition_by': 'RANGE (date_rent_finish)'},
+    )
+    # Ключ секционированной таблицы включает столбец секционирования
+    id_rent_in = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    date_rent_finish = db.Column(db.DateTime, primary_key=True)
+    status = db.Column(Status(RENT_IN_STATUSES), nullable=True)
+    date_rent_start = db.Column(db.DateTime, nullable=True)
+    note = db.Column(db.Text)
+    overdue = db.Column(db.Boolean, nullable=False, default=False, server_default=false())
     id_user = db.Column(db.Integer, db.ForeignKey("user.id"))
     id_rent_out = db.Column(db.Integer, db.ForeignKey("rent_out.id_rent_out"))
+    id_owner = db.Column(db.Integer, db.ForeignKey("user.id"))
 
 
 # Корзина
 class Bag(db.Model):
     __tablename__ = 'bag'
+    # Объявление входит в избранное пользователя один раз; индекс также обслуживает выборку избранного пользователя
+    __table_args__ = (
+        db.Index('uq_bag_user_rent_out', 'id_user', 'id_rent_out', unique=True),
+    )
     id_bag = db.Column(db.Integer, primary_key=True)
     id_user = db.Column(db.Integer, db.ForeignKey("user.id"))
-    id_rent_out = db.Column(db.Integer, db.ForeignKey("rent_out.id_rent_out"))
+    id_rent_out = db.Column(db.Integer, db.ForeignKey("rent_out.id_rent_out"), index=True)
+
+
+# Кэш избранного: id пользователя -> (время истечения, множество id объявлений). Каталог отмечает избранные
+# объявления проверкой вхождения в множество без запросов к БД. Кэш действует в пределах процесса: изменения
+# избранного, сделанные другими процессами, становятся видны не позже чем через FAVORITES_CACHE_TTL секунд
+favorites_cache = {}
+FAVORITES_CACHE_TTL = int(os.getenv('FAVORITES_CACHE_TTL', 60))
+FAVORITES_CACHE_SIZE = 10000
+
+
+# Множество объявлений в избранном пользователя
+def favorites(id_user):
+    entry = favorites_cache.get(id_user)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    # Избранное кэшируется в процессе, поэтому читается из основной БД, а не из отстающей реплики
+    with primary_reads():
+        ids = frozenset(db.session.scalars(select(Bag.id_rent_out).where(Bag.id_user == id_user)))
+    if len(favorites_cache) >= FAVORITES_CACHE_SIZE:
+        favorites_cache.clear()
+    favorites_cache[id_user] = (time.monotonic() + FAVORITES_CACHE_TTL, ids)
+    return ids
+
+
+# Сброс избранного пользователей в памяти процесса
+@invalidation('favorites')
+def clear_favorites_cache(user_ids):
+    for id_user in user_ids:
+        favorites_cache.pop(id_user, None)
+
+
+# Сброс избранного пользователей во всех процессах после изменения их избранного (после удаления объявлений —
+# всех затронутых сразу)
+def invalidate_favorites(user_ids):
+    user_ids = set(user_ids)
+    if user_ids:
+        broadcast_invalidation('favorites', sorted(user_ids))
 
 
 # Жалоба
 class Complaint(db.Model):
     __tablename__ = 'complaint'
+    # Индекс под очередь жалоб модератора: жалобы со статусом по убыванию номера
+    __table_args__ = (
+        db.Index('ix_complaint_status', 'status', 'id_complaint'),
+    )
     id_complaint = db.Column(db.Integer, primary_key=True)
-    id_rent_in = db.Column(db.Integer, db.ForeignKey("rent_in.id_rent_in"))
-    id_user = db.Column(db.Integer, db.ForeignKey("user.id"))
+    id_rent_in = db.Column(db.Integer, db.ForeignKey("rent_in.id_rent_in"), index=True)
+    id_user = db.Column(db.Integer, db.ForeignKey("user.id"), index=True)
     description = db.Column(db.Text, nullable=True)
-    status = db.Column(db.String(20), nullable=True)
+    status = db.Column(Status(COMPLAINT_STATUSES), nullable=True)
+
+
+# Сводные данные панели модератора. Обновляются в транзакции перехода заявки или жалобы (update_stats),
+# поэтому панель читает готовые значения по индексу вместо соединения всех заявок и жалоб.
+# Пересчёт с нуля: flask --app app rebuild-stats
+# Заявки в этих статусах считаются состоявшимися арендами
+COUNTED_RENT_STATUSES = ("одобрена", "в аренде", "аренда завершена")
+
+
+# Открытые жалобы на пользователя — владельца объявления, по аренде которого подана жалоба
+class UserStat(db.Model):
+    __tablename__ = 'user_stat'
+    id_user = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    open_complaints = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+# Число аренд и жалоб по объявлению
+class RentOutStat(db.Model):
+    __tablename__ = 'rent_out_stat'
+    id_rent_out = db.Column(db.Integer, db.ForeignKey("rent_out.id_rent_out"), primary_key=True)
+    rentals = db.Column(db.Integer, nullable=False, default=0)
+    complaints = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+# Число аренд и оценка выручки (цена за сутки × длительность аренды) по дню начала аренды и категории
+class CategoryDayStat(db.Model):
+    __tablename__ = 'category_day_stat'
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(100), primary_key=True)
+    rentals = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+
+# Оценка выручки аренды
+def rental_revenue(price, start, finish):
+    days = Decimal((finish - start).total_seconds()) / 86400
+    return (Decimal(price or 0) * days).quantize(Decimal('0.01'))
+
+
+# Прибавление deltas к счётчикам строки model с ключом key; строка создаётся при первом изменении
+def bump(connection, model, key, **deltas):
+    statement = insert_on_conflict(connection.dialect, model).values(**key, **deltas)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=list(key), set_={name: getattr(model, name) + statement.excluded[name] for name in deltas}))
+
+
+# INSERT с предложением ON CONFLICT для диалекта БД (PostgreSQL или SQLite)
+def insert_on_conflict(dialect, model):
+    return (postgresql.insert if dialect.name == 'postgresql' else sqlite.insert)(model)
+
+
+# Изменения статуса заявок и жалоб в сессии: (объект, старый статус, новый статус), None — нет записи.
+# Старый статус известен, если он был прочитан до изменения (обработчики проверяют статус перед переходом)
+def status_changes(session):
+    for obj in session.new:
+        if isinstance(obj, (RentIn, Complaint)):
+            yield obj, None, obj.status
+    for obj in session.dirty:
+        if isinstance(obj, (RentIn, Complaint)):
+            history = db.inspect(obj).attrs.status.history
+            if history.deleted and history.added:
+                yield obj, history.deleted[0], history.added[0]
+    for obj in session.deleted:
+        if isinstance(obj, (RentIn, Complaint)):
+            yield obj, db.inspect(obj).dict.get('status'), None
+
+
+# Обновление сводных данных в той же транзакции, что и записанные изменения заявок и жалоб
+@event.listens_for(RoutingSession, 'after_flush')
+def update_stats(session, flush_context):
+    rentals, complaints = [], []
+    for obj, old, new in status_changes(session):
+        if isinstance(obj, RentIn):
+            delta = (new in COUNTED_RENT_STATUSES) - (old in COUNTED_RENT_STATUSES)
+            if delta:
+                rentals.append((obj, delta))
+        else:
+            complaints.append((obj, old, new))
+    if not rentals and not complaints:
+        return
+    connection = session.connection()
+    if rentals:
+        listings = {a.id_rent_out: a for a in connection.execute(
+            select(RentOut.id_rent_out, Item.category, Item.rent_price).join(Item, RentOut.id_item == Item.id_item)
+            .where(RentOut.id_rent_out.in_({rent_in.id_rent_out for rent_in, delta in rentals})))}
+        for rent_in, delta in rentals:
+            listing = listings.get(rent_in.id_rent_out)
+            if listing is None:
+                continue
+            bump(connection, RentOutStat, {'id_rent_out': listing.id_rent_out}, rentals=delta)
+            key = {'day': rent_in.date_rent_start.date(), 'category': listing.category or ''}
+            bump(connection, CategoryDayStat, key, rentals=delta,
+                 revenue=delta * rental_revenue(listing.rent_price, rent_in.date_rent_start, rent_in.date_rent_finish))
+    if complaints:
+        rent_ins = {a.id_rent_in: a for a in connection.execute(
+            select(RentIn.id_rent_in, RentOut.id_rent_out, RentOut.id_user)
+            .join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out)
+            .where(RentIn.id_rent_in.in_({complaint.id_rent_in for complaint, old, new in complaints})))}
+        for complaint, old, new in complaints:
+            rent_in = rent_ins.get(complaint.id_rent_in)
+            if rent_in is None:
+                continue
+            if old is None or new is None:
+                bump(connection, RentOutStat, {'id_rent_out': rent_in.id_rent_out},
+                     complaints=1 if old is None else -1)
+            opened = (new == "рассматривается") - (old == "рассматривается")
+            if opened:
+                bump(connection, UserStat, {'id_user': rent_in.id_user}, open_complaints=opened)
+
+
+# Пересчёт сводных данных по всем заявкам и жалобам (после импорта данных в обход приложения)
+def rebuild_stats():
+    for model in (UserStat, RentOutStat, CategoryDayStat):
+        db.session.execute(delete(model))
+    # Состоявшиеся аренды из rent_in и архива
+    counted = union_all(*(
+        select(model.id_rent_out, model.date_rent_start, model.date_rent_finish)
+        .where(model.status.in_(COUNTED_RENT_STATUSES)) for model in (RentIn, RentInArchive))).subquery()
+    rentals = dict(db.session.execute(
+        select(counted.c.id_rent_out, func.count()).group_by(counted.c.id_rent_out)).all())
+    complaints = dict(db.session.execute(
+        select(RentIn.id_rent_out, func.count()).select_from(Complaint)
+        .join(RentIn, Complaint.id_rent_in == RentIn.id_rent_in).group_by(RentIn.id_rent_out)).all())
+    if rentals or complaints:
+        db.session.execute(insert(RentOutStat), [
+            {'id_rent_out': id_rent_out, 'rentals': rentals.get(id_rent_out, 0),
+             'complaints': complaints.get(id_rent_out, 0)}
+            for id_rent_out in sorted(rentals.keys() | complaints.keys())])
+    open_complaints = db.session.execute(
+        select(RentOut.id_user, func.count()).select_from(Complaint)
+        .join(RentIn, Complaint.id_rent_in == RentIn.id_rent_in)
+        .join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out)
+        .where(Complaint.status == "рассматривается").group_by(RentOut.id_user)).all()
+    if open_complaints:
+        db.session.execute(insert(UserStat), [{'id_user': id_user, 'open_complaints': count}
+                                              for id_user, count in open_complaints])
+    days = {}
+    for start, finish, category, price in db.session.execute(
+            select(counted.c.date_rent_start, counted.c.date_rent_finish, Item.category, Item.rent_price)
+            .join(RentOut, counted.c.id_rent_out == RentOut.id_rent_out)
+            .join(Item, RentOut.id_item == Item.id_item)):
+        stat = days.setdefault((start.date(), category or ''), [0, Decimal(0)])
+        stat[0] += 1
+        stat[1] += rental_revenue(price, start, finish)
+    if days:
+        db.session.execute(insert(CategoryDayStat), [
+            {'day': day, 'category': category, 'rentals': rentals, 'revenue': revenue}
+            for (day, category), (rentals, revenue) in sorted(days.items())])
+    db.session.commit()
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    create_app()
+    rebuild_stats()
+
+
+# Полнотекстовый поиск по названию и описанию предмета
+# В PostgreSQL поисковый вектор хранится в вычисляемом столбце item.search_vector с GIN-индексом
+event.listen(Item.__table__, 'after_create', DDL(
+    "ALTER TABLE item ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'B')) STORED"
+).execute_if(dialect='postgresql'))
+event.listen(Item.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_item_search_vector ON item USING GIN (search_vector)"
+).execute_if(dialect='postgresql'))
+
+SEARCH_PAGE_SIZE = 24
+# Вес слова из названия предмета относительно слова из описания
+SEARCH_NAME_WEIGHT = 4
+# Максимальное число слов, подставляемых вместо префикса последнего слова запроса
+SEARCH_PREFIX_EXPANSION = 64
+
+
+# Разбиение текста на слова в нижнем регистре
+def tokenize(text):
+    return re.findall(r'\w+', (text or "").lower().replace("ё", "е"))
+
+
+# Инвертированный индекс в памяти процесса для СУБД без полнотекстового поиска (например, SQLite)
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}
+        self.tokens = []
+        self.loaded = False
+        # Предметы, созданные после построения индекса, которые ещё не прочитаны из БД
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    # Добавление предмета в индекс
+    def add(self, id_item, name, description):
+        weights = {}
+        for token in tokenize(name):
+            weights[token] = weights.get(token, 0) + SEARCH_NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] = weights.get(token, 0) + 1
+        with self.lock:
+            for token, weight in weights.items():
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = {}
+                    bisect.insort(self.tokens, token)
+                postings[id_item] = weight
+
+    # Построение индекса по всем предметам из БД при первом поиске и добавление новых предметов при следующих
+    def load(self):
+        if self.loaded:
+            with self.lock:
+                ids, self.pending = self.pending, set()
+            if not ids:
+                return
+            query = db.session.query(Item.id_item, Item.name, Item.description).filter(Item.id_item.in_(ids))
+        else:
+            query = db.session.query(Item.id_item, Item.name, Item.description)
+        with primary_reads():
+            rows = query.all()
+        for id_item, name, description in rows:
+            self.add(id_item, name, description)
+        self.loaded = True
+
+    # Предметы, созданные любым процессом, добавляются в построенный индекс при следующем поиске
+    def refresh(self, ids):
+        if self.loaded:
+            with self.lock:
+                self.pending.update(ids)
+
+    # Слова индекса, начинающиеся с префикса
+    def expand(self, prefix):
+        start = bisect.bisect_left(self.tokens, prefix)
+        expanded = []
+        for token in self.tokens[start:start + SEARCH_PREFIX_EXPANSION]:
+            if not token.startswith(prefix):
+                break
+            expanded.append(token)
+        return expanded
+
+    # Оценки предметов, содержащих все слова запроса; последнее слово ищется по префиксу
+    def search(self, query):
+        terms = tokenize(query)
+        scores = None
+        with self.lock:
+            for n, term in enumerate(terms):
+                matched = {}
+                for token in self.expand(term) if n == len(terms) - 1 else [term]:
+                    for id_item, weight in self.postings.get(token, {}).items():
+                        matched[id_item] = max(matched.get(id_item, 0), weight)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {id_item: score + matched[id_item] for id_item, score in scores.items()
+                              if id_item in matched}
+                if not scores:
+                    break
+        return scores or {}
+
+
+search_index = SearchIndex()
+
+
+# Новые предметы добавляются в индекс поиска процесса при следующем поиске
+@invalidation('search')
+def refresh_search_index(ids):
+    search_index.refresh(ids)
+
+
+# Поиск активных объявлений с ранжированием по релевантности
+def search_catalog(query, page):
+    catalog = VIEWS['catalog'].statement
+    terms = tokenize(query)
+    if not terms:
+        return [], False
+    offset = page * SEARCH_PAGE_SIZE
+    if db.engine.dialect.name == 'postgresql':
+        # Все слова запроса обязательны, последнее ищется по префиксу для подсказок при вводе
+        ts_query = func.to_tsquery('russian', " & ".join(terms[:-1] + [terms[-1] + ":*"]))
+        search_vector = literal_column('item.search_vector')
+        rank = func.ts_rank(search_vector, ts_query)
+        rows = db.session.execute(catalog.where(search_vector.op('@@')(ts_query))
+                                  .order_by(rank.desc(), RentOut.id_rent_out.desc())
+                                  .offset(offset).limit(SEARCH_PAGE_SIZE + 1)).all()
+    else:
+        search_index.load()
+        scores = search_index.search(query)
+        if not scores:
+            return [], False
+        rows = db.session.execute(catalog.where(RentOut.id_item.in_(scores.keys()))).all()
+        rows.sort(key=lambda a: (scores[a.id_item], a.id_rent_out), reverse=True)
+        rows = rows[offset:offset + SEARCH_PAGE_SIZE + 1]
+    return rows[:SEARCH_PAGE_SIZE], len(rows) > SEARCH_PAGE_SIZE
+
+
+# Рекомендации объявлений (recommend.py). Индекс строится по активным объявлениям в пуле вычислений в фоне после
+# первого запроса к процессу и перестраивается в фоне, когда он старше RECOMMEND_REFRESH секунд; обработчики событий
+# индекс не строят. С RECOMMEND_INDEX_FILE процессы приложения читают индекс из файла, который записывает команда
+# flask --app app build-recommendations (например, по расписанию cron)
+RECOMMEND_REFRESH = float(os.getenv('RECOMMEND_REFRESH', 600))
+RECOMMEND_INDEX_FILE = os.getenv('RECOMMEND_INDEX_FILE')
+# Число объявлений в каждом списке рекомендаций
+RECOMMEND_LIMIT = 8
+# Число последних заявок и избранных объявлений пользователя, по которым подбираются его рекомендации
+RECOMMEND_HISTORY = 50
+
+
+# Данные для построения индекса: активные объявления, слова их названий, описаний и категория,
+# пары (пользователь, объявление) из состоявшихся аренд (в том числе архивных) и избранного
+def recommendation_source():
+    with primary_reads():
+        listings = db.session.execute(
+            select(RentOut.id_rent_out, Item.name, Item.category, Item.description)
+            .join(Item, RentOut.id_item == Item.id_item).where(RentOut.status == "активно")).all()
+        baskets = db.session.execute(
+            select(RentIn.id_user, RentIn.id_rent_out).where(RentIn.status.in_(COUNTED_RENT_STATUSES))
+            .union_all(select(RentInArchive.id_user, RentInArchive.id_rent_out)
+                       .where(RentInArchive.status.in_(COUNTED_RENT_STATUSES)),
+                       select(Bag.id_user, Bag.id_rent_out))).all()
+    documents = [tokenize(a.name) * SEARCH_NAME_WEIGHT + tokenize(a.description) + ["категория:%s" % a.category]
+                 for a in listings]
+    return [a.id_rent_out for a in listings], documents, [tuple(a) for a in baskets]
+
+
+# NumPy (recommend.py) импортируется при первом построении или чтении индекса
+def build_recommendations():
+    import recommend
+    return recommend.Recommendations(run_cpu(recommend.build, *recommendation_source()))
+
+
+# Пустой индекс, пока первый индекс процесса строится: рекомендаций нет
+class NoRecommendations:
+    def similar_to(self, id_rent_out, k):
+        return []
+
+    def also_rented(self, id_rent_out, k):
+        return []
+
+    def suggest(self, history, k):
+        return []
+
+
+class RecommendationIndex:
+    def __init__(self):
+        self.current = None
+        self.loaded_at = 0
+        # Время изменения прочитанного файла индекса
+        self.version = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    # Новый индекс из файла RECOMMEND_INDEX_FILE, если файл изменился, иначе построение по БД
+    def refresh(self):
+        version = os.stat(RECOMMEND_INDEX_FILE).st_mtime \
+            if RECOMMEND_INDEX_FILE and os.path.exists(RECOMMEND_INDEX_FILE) else None
+        if version is None:
+            self.current = build_recommendations()
+        elif version != self.version:
+            import recommend
+            self.current = recommend.Recommendations.load(RECOMMEND_INDEX_FILE)
+            self.version = version
+        self.loaded_at = time.monotonic()
+
+    def refresh_in_background(self):
+        try:
+            with app.app_context():
+                self.refresh()
+        except Exception:
+            app.logger.exception("Не удалось обновить индекс рекомендаций")
+        finally:
+            self.refreshing = False
+
+    # Построение в фоне, если индекса ещё нет или он старше RECOMMEND_REFRESH и построение не запущено
+    def refresh_if_stale(self):
+        if self.current is not None and time.monotonic() - self.loaded_at <= RECOMMEND_REFRESH:
+            return
+        with self.lock:
+            start, self.refreshing = not self.refreshing, True
+        if start:
+            socketio.start_background_task(self.refresh_in_background)
+
+    # Текущий индекс; устаревший индекс используется, пока новый строится в фоне, а до первого индекса — пустой
+    def get(self):
+        self.refresh_if_stale()
+        return self.current or NoRecommendations()
+
+
+recommendations = RecommendationIndex()
+
+
+# Построение индекса рекомендаций в фоне при первом запросе к процессу, до первых событий similar и recommend
+@app.before_request
+def start_recommendations():
+    if recommendations.current is None:
+        recommendations.refresh_if_stale()
+
+
+# Построение индекса рекомендаций в файл path (по умолчанию RECOMMEND_INDEX_FILE)
+@app.cli.command('build-recommendations')
+@click.argument('path', required=False)
+def build_recommendations_command(path):
+    create_app()
+    path = path or RECOMMEND_INDEX_FILE
+    if not path:
+        raise click.UsageError("Укажите файл индекса или переменную окружения RECOMMEND_INDEX_FILE")
+    start = time.perf_counter()
+    index = build_recommendations()
+    index.save(path)
+    click.echo("%s: %d объявлений, %.1f с" % (path, len(index.listings), time.perf_counter() - start))
+
+
+# Календарь занятости объявлений
+# Забронированным считается период заявки в статусе «одобрена» или «в аренде»
+BOOKED_STATUSES = ("одобрена", "в аренде")
+# В PostgreSQL пересечение забронированных периодов одного объявления запрещено ограничением-исключением,
+# его GiST-индекс также используется при поиске свободных объявлений. Заявки без дат периода не занимают
+event.listen(RentIn.__table__, 'after_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS btree_gist"
+).execute_if(dialect='postgresql'))
+event.listen(RentIn.__table__, 'after_create', DDL(
+    "ALTER TABLE rent_in ADD CONSTRAINT rent_in_no_overlap EXCLUDE USING gist "
+    "(id_rent_out WITH =, tsrange(date_rent_start, date_rent_finish) WITH &&) "
+    "WHERE (status IN (2, 3) AND date_rent_start IS NOT NULL AND date_rent_finish IS NOT NULL)"
+).execute_if(dialect='postgresql'))
+
+
+# Условие пересечения периода заявки с полуинтервалом [start, finish)
+def rent_in_overlaps(start, finish):
+    if db.engine.dialect.name == 'postgresql':
+        return func.tsrange(RentIn.date_rent_start, RentIn.date_rent_finish).op('&&')(func.tsrange(start, finish))
+    return and_(RentIn.date_rent_start < finish, RentIn.date_rent_finish > start)
+
+
+# Занятые периоды объявлений в памяти процесса для СУБД без ограничений-исключений (например, SQLite).
+# Периоды одного объявления не пересекаются, поэтому хранятся отсортированными по началу,
+# и проверка пересечения выполняется двоичным поиском за O(log n)
+class BookingCalendar:
+    def __init__(self):
+        self.periods = {}
+        self.lock = threading.Lock()
+
+    # Загрузка забронированных периодов объявления из БД при первом обращении
+    def load(self, id_rent_out):
+        periods = self.periods.get(id_rent_out)
+        if periods is None:
+            with primary_reads():
+                rows = db.session.query(RentIn.date_rent_start, RentIn.date_rent_finish, RentIn.id_rent_in) \
+                    .filter(RentIn.id_rent_out == id_rent_out, RentIn.status.in_(BOOKED_STATUSES)) \
+                    .order_by(RentIn.date_rent_start).all()
+            periods = self.periods[id_rent_out] = [tuple(a) for a in rows]
+        return periods
+
+    # Проверка пересечения [start, finish) с забронированными периодами
+    def conflicts(self, id_rent_out, start, finish):
+        periods = self.load(id_rent_out)
+        # Пересечься может только последний период, начавшийся раньше finish
+        i = bisect.bisect_left(periods, (finish,))
+        return i > 0 and periods[i - 1][1] > start
+
+    def add(self, id_rent_out, start, finish, id_rent_in):
+        if id_rent_out in self.periods:
+            bisect.insort(self.periods[id_rent_out], (start, finish, id_rent_in))
+
+    def remove(self, id_rent_out, id_rent_in):
+        periods = self.periods.get(id_rent_out)
+        if periods is not None:
+            self.periods[id_rent_out] = [a for a in periods if a[2] != id_rent_in]
+
+    def drop(self, id_rent_out):
+        self.periods.pop(id_rent_out, None)
+
+
+booking_calendar = BookingCalendar()
+
+
+# Бронирование периода заявки (перевод в статус «одобрена»); False, если период уже занят
+def book(rent_in):
+    if db.engine.dialect.name == 'postgresql':
+        rent_in.status = "одобрена"
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        return True
+    with booking_calendar.lock:
+        if booking_calendar.conflicts(rent_in.id_rent_out, rent_in.date_rent_start, rent_in.date_rent_finish):
+            return False
+        rent_in.status = "одобрена"
+        db.session.commit()
+        booking_calendar.add(rent_in.id_rent_out, rent_in.date_rent_start, rent_in.date_rent_finish,
+                             rent_in.id_rent_in)
+    return True
+
+
+# Проверка, свободно ли объявление в период [start, finish)
+def is_free(id_rent_out, start, finish):
+    if db.engine.dialect.name != 'postgresql':
+        with booking_calendar.lock:
+            return not booking_calendar.conflicts(id_rent_out, start, finish)
+    return not db.session.query(RentIn.query.filter(
+        RentIn.id_rent_out == id_rent_out, RentIn.status.in_(BOOKED_STATUSES),
+        rent_in_overlaps(start, finish)).exists()).scalar()
+
+
+# Преобразование даты и времени из запроса клиента
+def parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Вычислительная работа (хеширование паролей, проверка и обработка изображений) выполняется вне потока,
+# обрабатывающего события, чтобы всплеск входов не задерживал ответы остальным клиентам.
+# В режиме threading — пул из CPU_WORKERS процессов. В режимах eventlet и gevent пул процессов concurrent.futures
+# не работает с заменёнными модулями threading и select, поэтому задачи выполняются в пуле системных потоков
+# eventlet/gevent: hashlib и Pillow отпускают GIL на время вычислений. CPU_WORKERS=0 — в потоке запроса
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', os.cpu_count() or 1))
+# Не больше CPU_QUEUE_SIZE задач одновременно; запрос ждёт места не дольше CPU_QUEUE_TIMEOUT секунд
+CPU_QUEUE_SIZE = int(os.getenv('CPU_QUEUE_SIZE', 4 * max(CPU_WORKERS, 1)))
+CPU_QUEUE_TIMEOUT = float(os.getenv('CPU_QUEUE_TIMEOUT', 5))
+
+cpu_slots = threading.BoundedSemaphore(CPU_QUEUE_SIZE)
+cpu_pool = {'executor': None}
+cpu_pool_lock = threading.Lock()
+
+
+# Пул процессов создаётся при первой задаче, поэтому команды и скрипты без вычислений не импортируют multiprocessing.
+# Рабочие процессы запускаются заново (spawn), а не копируются из процесса сервера с его потоками и соединениями
+def cpu_executor():
+    if cpu_pool['executor'] is None:
+        with cpu_pool_lock:
+            if cpu_pool['executor'] is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                cpu_pool['executor'] = ProcessPoolExecutor(max_workers=CPU_WORKERS,
+                                                           mp_context=multiprocessing.get_context('spawn'))
+    return cpu_pool['executor']
+
+
+# Все места для вычислительных задач заняты дольше CPU_QUEUE_TIMEOUT
+class Overloaded(Exception):
+    pass
+
+
+# Выполнение fn(*args) в пуле процессов или системных потоков
+def run_cpu(fn, *args):
+    if not CPU_WORKERS:
+        return fn(*args)
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    if ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return cpu_executor().submit(fn, *args).result()
+
+
+# Занятие места для вычислительной задачи; Overloaded, если места не освободилось за timeout
+def acquire_cpu_slot(timeout=CPU_QUEUE_TIMEOUT):
+    if not cpu_slots.acquire(timeout=timeout):
+        raise Overloaded()
+
+
+# Выполнение вычислительной задачи с ожиданием результата; Overloaded, если места не освободилось за timeout
+def cpu_call(fn, *args, timeout=CPU_QUEUE_TIMEOUT):
+    acquire_cpu_slot(timeout)
+    try:
+        return run_cpu(fn, *args)
+    finally:
+        cpu_slots.release()
+
+
+# Хеш пароля настроенным методом
+def hash_password(password):
+    return cpu_call(cpu_tasks.hash_password, password, PASSWORD_HASH_METHOD)
+
+
+# Метод и параметры хеша, который создаёт PASSWORD_HASH_METHOD: werkzeug дополняет краткое название параметрами
+# по умолчанию (scrypt -> scrypt:32768:8:1), поэтому префикс берётся из хеша пустого пароля при первой проверке
+password_hash_prefix = {'value': None}
+
+
+# Хеш создан другим методом или с другими параметрами, чем PASSWORD_HASH_METHOD; Overloaded при первой проверке,
+# если пул вычислений занят
+def needs_rehash(pwhash):
+    if password_hash_prefix['value'] is None:
+        password_hash_prefix['value'] = hash_password("").split("$", 1)[0]
+    return pwhash.split("$", 1)[0] != password_hash_prefix['value']
+
+
+# Ограничение частоты запросов: не больше limit запросов с одного ключа (IP-адреса) за period секунд
+class RateLimiter:
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.hits = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        if not self.limit:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            # Удаление ключей без запросов за последний период, чтобы словарь не рос бесконечно
+            if len(self.hits) > 10000:
+                self.hits = {k: v for k, v in self.hits.items() if v and v[-1] > now - self.period}
+            hits = self.hits.setdefault(key, deque())
+            while hits and hits[0] <= now - self.period:
+                hits.popleft()
+            if len(hits) >= self.limit:
+                return False
+            hits.append(now)
+        return True
+
+
+# Ограничение частоты «ведром токенов»: ключ тратит токен на запрос, токены восполняются со скоростью rate
+# в секунду до burst. Кратковременный всплеск до burst запросов проходит, постоянный поток — не чаще rate в секунду
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        # Ключ -> (число токенов, время их подсчёта)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            # Удаление полных вёдер: без записи ключ получает те же burst токенов
+            if len(self.buckets) > 10000:
+                self.buckets = {k: v for k, v in self.buckets.items()
+                                if v[0] + (now - v[1]) * self.rate < self.burst}
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def forget(self, key):
+        with self.lock:
+            self.buckets.pop(key, None)
+
+
+# Попытки входа и регистрации с одного IP-адреса (0 — без ограничения).
+# За обратным прокси адрес клиента должен передаваться в request.remote_addr (например, через ProxyFix)
+auth_limiter = RateLimiter(int(os.getenv('AUTH_RATE_LIMIT', 10)), float(os.getenv('AUTH_RATE_PERIOD', 60)))
+
+
+# Обработка изображений предметов
+# Файлы хранятся по хешу содержимого: UPLOAD_FOLDER/<2 символа хеша>/<хеш>/<вариант>.webp,
+# поэтому одинаковые изображения сохраняются один раз, а в Item.image_url записывается только хеш
+# Варианты изображения: максимальные ширина и высота
+IMAGE_VARIANTS = {'thumb': (300, 250), 'detail': (1200, 1200)}
+IMAGE_QUALITY = 80
+
+
+# Проверка загруженного файла: возвращает хеш содержимого или вызывает исключение
+def validate_image(data):
+    return cpu_call(cpu_tasks.validate_image, data)
+
+
+# Каталог вариантов изображения
+def image_dir(content_hash):
+    return os.path.join(UPLOAD_FOLDER, content_hash[:2], content_hash)
+
+
+# Адрес варианта изображения; старые записи содержат путь к исходному файлу в UPLOAD_FOLDER
+def image_variant(image_url, variant):
+    if not image_url:
+        return image_url
+    if "/" in image_url or "." in image_url:
+        return "/media/" + os.path.basename(image_url)
+    return "/".join(("/media", image_url[:2], image_url, variant + ".webp"))
+
+
+# Создание вариантов изображения в фоне и уведомление каталога и владельца после её завершения (и при ошибке,
+# чтобы страницы не ждали изображения). Задача использует место, занятое acquire_cpu_slot до записи объявления,
+# и освобождает его
+def submit_image(content_hash, data, id_user):
+    def job():
+        try:
+            run_cpu(cpu_tasks.process_image, image_dir(content_hash), data, IMAGE_VARIANTS, IMAGE_QUALITY)
+        finally:
+            cpu_slots.release()
+            notify(CATALOG_ROOM, user_room(id_user))
+    socketio.start_background_task(job)
+
+
+# Общий слой выборки и сериализации списков
+# Сериализация в JSON: дата и время в ISO 8601, Decimal — строкой
+def orjson_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+
+def dumps(data):
+    return orjson.dumps(data, default=orjson_default).decode()
+
+
+# Представление списка: запрос выбирает только нужные столбцы и строится один раз при запуске,
+# поэтому SQLAlchemy берёт скомпилированный запрос из кэша, а строки не превращаются в объекты ORM
+class View:
+    def __init__(self, statement, key=None):
+        self.statement = statement
+        self.keys = tuple(statement.selected_columns.keys())
+        # Запрос одной строки списка по ключу для рассылки изменений
+        if key is not None:
+            self.by_key = statement.where(key == bindparam('key'))
+
+    def rows(self, **params):
+        return db.session.execute(self.statement, params).all()
+
+    def items(self, rows):
+        items = [dict(zip(self.keys, row)) for row in rows]
+        if 'image_url' in self.keys:
+            for item in items:
+                item['image_url'] = image_variant(item['image_url'], 'thumb')
+        return items
+
+    def serialize(self, rows):
+        return dumps(self.items(rows))
+
+    # Строка списка с ключом key или None, если её нет в списке
+    def item(self, **params):
+        rows = db.session.execute(self.by_key, params).all()
+        return self.items(rows)[0] if rows else None
+
+    def json(self, **params):
+        return self.serialize(self.rows(**params))
+
+
+# Столбцы объявления и предмета
+ITEM_COLUMNS = (RentOut.id_rent_out, RentOut.id_item, Item.name, Item.category, Item.description,
+                Item.rent_price, Item.image_url)
+# Столбцы карточки каталога: описание сокращено до DESCRIPTION_PREVIEW символов
+CATALOG_COLUMNS = tuple(func.substr(Item.description, 1, DESCRIPTION_PREVIEW).label('description')
+                        if column is Item.description else column for column in ITEM_COLUMNS)
+# Столбцы заявки
+RENT_IN_COLUMNS = (RentIn.id_rent_in, RentIn.date_rent_start, RentIn.date_rent_finish, RentIn.note, RentIn.status,
+                   RentIn.overdue)
+# Контакты второй стороны аренды
+CONTACT_COLUMNS = (User.username, User.phone, User.email)
+# Столбцы жалобы
+COMPLAINT_COLUMNS = (Complaint.id_complaint, Complaint.status.label('status_complaint'),
+                     Complaint.description.label('description_complaint'))
+
+ID_USER = bindparam('id_user')
+
+
+# Заявки с объявлением и предметом; contact — столбец с id пользователя, чьи контакты нужны
+def rent_in_view(contact, *criteria):
+    columns = RENT_IN_COLUMNS + ITEM_COLUMNS + (CONTACT_COLUMNS if contact is not None else ())
+    statement = select(*columns).select_from(RentIn) \
+        .join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
+        .join(Item, RentOut.id_item == Item.id_item)
+    if contact is not None:
+        statement = statement.join(User, contact == User.id)
+    return View(statement.where(*criteria).order_by(RentIn.id_rent_in.desc()), RentIn.id_rent_in)
+
+
+# Жалобы с заявкой, объявлением и предметом
+def complaint_statement(columns):
+    return select(*(COMPLAINT_COLUMNS + RENT_IN_COLUMNS + ITEM_COLUMNS + columns)).select_from(Complaint) \
+        .join(RentIn, Complaint.id_rent_in == RentIn.id_rent_in) \
+        .join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
+        .join(Item, RentOut.id_item == Item.id_item) \
+        .join(User, Complaint.id_user == User.id)
+
+
+def complaint_view(columns, *criteria):
+    return View(complaint_statement(columns).where(*criteria).order_by(RentIn.id_rent_in.desc()))
+
+
+# Очередь жалоб модератора: страница жалоб со статусом status и номером меньше cursor
+COMPLAINT_PAGE_SIZE = 24
+# Курсор первой страницы
+FIRST_PAGE_CURSOR = 2 ** 31 - 1
+
+
+ACTIVE_RENT_STATUSES = ("одобрена", "в аренде")
+# В истории арендатора есть и его истёкшие заявки
+RENTER_HISTORY_STATUSES = ("аренда завершена", "заявка истекла")
+
+VIEWS = {
+    # Активные объявления каталога; фильтры, порядок и размер страницы добавляют страница каталога и поиск
+    'catalog': View(select(*CATALOG_COLUMNS).join(Item, RentOut.id_item == Item.id_item)
+                    .where(RentOut.status == "активно")),
+    # Рекомендованные объявления: активные и принадлежащие другим пользователям
+    'recommended': View(select(*ITEM_COLUMNS).join(Item, RentOut.id_item == Item.id_item)
+                        .where(RentOut.id_rent_out.in_(bindparam('ids', expanding=True)),
+                               RentOut.status == "активно", RentOut.id_user != ID_USER)),
+    'deleted': View(select(*ITEM_COLUMNS).join(Item, RentOut.id_item == Item.id_item)
+                    .where(RentOut.status == "удалено").order_by(RentOut.id_rent_out.desc())),
+    'my_rent_out': View(select(*ITEM_COLUMNS).join(Item, RentOut.id_item == Item.id_item)
+                        .where(RentOut.id_user == ID_USER, RentOut.status != "удалено")
+                        .order_by(RentOut.id_rent_out.desc())),
+    # Временно неактивные избранные объявления не показываются
+    'bag': View(select(Bag.id_bag, *ITEM_COLUMNS).select_from(Bag)
+                .join(RentOut, Bag.id_rent_out == RentOut.id_rent_out)
+                .join(Item, RentOut.id_item == Item.id_item)
+                .where(Bag.id_user == ID_USER, RentOut.status == "активно").order_by(Bag.id_bag.desc()), Bag.id_bag),
+    'outgoing': rent_in_view(None, RentIn.id_user == ID_USER, RentIn.status == "подана"),
+    'incoming': rent_in_view(RentIn.id_user, RentOut.id_user == ID_USER, RentIn.status == "подана"),
+    'notirent': rent_in_view(RentIn.id_user, RentOut.id_user == ID_USER, RentIn.status.in_(ACTIVE_RENT_STATUSES)),
+    'irent': rent_in_view(RentOut.id_user, RentIn.id_user == ID_USER, RentIn.status.in_(ACTIVE_RENT_STATUSES)),
+    # Завершённые аренды в rent_in: строки для рассылки изменений, страницы истории с архивом — HISTORY_PAGES
+    'irent_history': rent_in_view(RentOut.id_user, RentIn.id_user == ID_USER,
+                                  RentIn.status.in_(RENTER_HISTORY_STATUSES)),
+    'notirent_history': rent_in_view(RentIn.id_user, RentOut.id_user == ID_USER,
+                                     RentIn.status == "аренда завершена"),
+    'complaint': View(complaint_statement(CONTACT_COLUMNS)
+                      .where(Complaint.status == bindparam('status'), Complaint.id_complaint < bindparam('cursor'))
+                      .order_by(Complaint.id_complaint.desc()).limit(COMPLAINT_PAGE_SIZE + 1)),
+    'my_complaint': complaint_view((), Complaint.id_user == ID_USER),
+}
+
+# Страница истории аренд по убыванию окончания аренды и номера заявки
+HISTORY_PAGE_SIZE = 24
+# Границы диапазона дат без фильтра; курсор первой страницы — (LAST_DATE, FIRST_PAGE_CURSOR)
+FIRST_DATE = datetime(1970, 1, 1)
+LAST_DATE = datetime(9999, 1, 1)
+
+
+# Часть страницы истории из rent_in или архива: строки пользователя со статусом из statuses, окончанием аренды
+# в [date_from, date_to) и позицией (окончание аренды, номер заявки) меньше курсора. renter — история арендатора
+# (контакты владельца), иначе — история владельца (контакты арендатора)
+def history_part(model, renter, statuses):
+    owner = RentOut.id_user if model is RentIn else model.id_owner
+    id_user, contact = (model.id_user, owner) if renter else (owner, model.id_user)
+    columns = (model.id_rent_in, model.date_rent_start, model.date_rent_finish, model.note, model.status,
+               model.overdue)
+    return select(*(columns + ITEM_COLUMNS + CONTACT_COLUMNS)).select_from(model) \
+        .join(RentOut, model.id_rent_out == RentOut.id_rent_out) \
+        .join(Item, RentOut.id_item == Item.id_item) \
+        .join(User, contact == User.id) \
+        .where(id_user == ID_USER, model.status.in_(statuses),
+               model.date_rent_finish >= bindparam('date_from', type_=db.DateTime),
+               model.date_rent_finish < bindparam('date_to', type_=db.DateTime),
+               tuple_(model.date_rent_finish, model.id_rent_in) <
+               tuple_(bindparam('cursor_date', type_=db.DateTime), bindparam('cursor_id', type_=db.Integer))) \
+        .order_by(model.date_rent_finish.desc(), model.id_rent_in.desc()).limit(HISTORY_PAGE_SIZE + 1)
+
+
+# Страница истории из недавней истории в rent_in и архива: каждая часть читает не больше страницы по индексу
+def history_view(renter, statuses):
+    parts = union_all(*(select(*history_part(model, renter, statuses).subquery().c)
+                        for model in (RentIn, RentInArchive))).subquery()
+    return View(select(*parts.c).order_by(parts.c.date_rent_finish.desc(), parts.c.id_rent_in.desc())
+                .limit(HISTORY_PAGE_SIZE + 1))
+
+
+HISTORY_PAGES = {
+    'irent_history': history_view(True, RENTER_HISTORY_STATUSES),
+    'notirent_history': history_view(False, ("аренда завершена",)),
+}
+
+
+# Журнал изменений списков пользователей. Вместо пересылки всего списка клиенту отправляется изменение
+# одной строки (добавлена, изменена, удалена) с номером версии списка; клиент, переподключившийся со старой
+# версией, получает изменения после неё из журнала. Журнал хранится в памяти процесса, epoch отличает
+# версии разных процессов и перезапусков: клиент с чужой версией получает весь список.
+# replay=False — изменения из журнала не отдаются переподключившимся клиентам: при нескольких процессах журнал
+# процесса не содержит изменений, сделанных другими процессами (в том числе между первой отрисовкой страницы
+# и подключением socket.io к другому процессу), поэтому клиент всегда получает весь список, а изменения
+# по-прежнему рассылаются подключённым клиентам
+class ChangeLog:
+    def __init__(self, size, replay=True):
+        self.size = size
+        self.replay = replay
+        self.epoch = os.urandom(4).hex()
+        self.versions = {}
+        self.changes = {}
+        self.lock = threading.Lock()
+
+    def version(self, view, id_user):
+        return self.versions.get((view, id_user), 0)
+
+    def record(self, view, id_user, op, key, row=None):
+        with self.lock:
+            version = self.versions[(view, id_user)] = self.version(view, id_user) + 1
+            change = {'view': view, 'epoch': self.epoch, 'version': version, 'op': op, 'key': key, 'row': row}
+            self.changes.setdefault((view, id_user), deque(maxlen=self.size)).append(change)
+        return change
+
+    # Изменения списка после версии клиента или None, если их уже нет в журнале
+    def since(self, view, id_user, epoch, version):
+        if not self.replay or epoch != self.epoch or not isinstance(version, int):
+            return None
+        with self.lock:
+            if version > self.version(view, id_user):
+                return None
+            changes = self.changes.get((view, id_user), ())
+            if changes and changes[0]['version'] > version + 1:
+                return None
+            return [change for change in changes if change['version'] > version]
+
+
+CHANGE_LOG_SIZE = 100
+# Несколько процессов сервера: задана очередь сообщений или WEB_CONCURRENCY больше 1
+MULTIPLE_WORKERS = bool(SOCKETIO_MESSAGE_QUEUE) or int(os.getenv('WEB_CONCURRENCY', 1)) > 1
+change_log = ChangeLog(CHANGE_LOG_SIZE, replay=not MULTIPLE_WORKERS)
+
+
+# Отправка списка запросившему клиенту: изменения после версии клиента data или весь список с текущей версией.
+# load — получение строк списка, если нужен весь список
+def emit_view(view, data=None, load=None):
+    id_user = current_user.id
+    state = json.loads(data) if data else {}
+    changes = change_log.since(view, id_user, state.get('epoch'), state.get('version'))
+    if changes is not None:
+        emit('delta', dumps(changes))
+        return
+    emit(view, view_json(view, load))
+
+
+# Весь список view текущего пользователя с текущей версией: ответ на reload_<view> и данные первой отрисовки страницы
+def view_json(view, load=None):
+    id_user = current_user.id
+    # Версия берётся до запроса: изменение, попавшее и в список, и в журнал, клиент применит повторно без вреда
+    version = change_log.version(view, id_user)
+    rows = load() if load is not None else VIEWS[view].rows(id_user=id_user)
+    return dumps({'epoch': change_log.epoch, 'version': version, 'items': VIEWS[view].items(rows)})
+
+
+# Запись изменений в журнал и отправка их пользователю
+def publish(id_user, changes):
+    if changes:
+        user_changed(id_user)
+        socketio.emit('delta', dumps([change_log.record(id_user=id_user, **change) for change in changes]),
+                      to=user_room(id_user))
+
+
+# Изменение строки key в списке view: строка заново читается из БД
+def changed(view, id_user, key, op='updated'):
+    row = VIEWS[view].item(id_user=id_user, key=key)
+    if row is None:
+        return {'view': view, 'op': 'removed', 'key': key}
+    return {'view': view, 'op': op, 'key': key, 'row': row}
+
+
+# Списки заявок арендатора и владельца объявления по статусу заявки
+RENTER_VIEWS = {"подана": 'outgoing', "одобрена": 'irent', "в аренде": 'irent', "аренда завершена": 'irent_history',
+                "заявка истекла": 'irent_history'}
+OWNER_VIEWS = {"подана": 'incoming', "одобрена": 'notirent', "в аренде": 'notirent',
+               "аренда завершена": 'notirent_history'}
+
+
+# Рассылка изменения заявки: при смене статуса строка переходит из одного списка в другой.
+# old_status — статус до изменения (None для новой заявки), deleted — заявка удалена
+def publish_rent_in(rent_in, id_owner, old_status, deleted=False):
+    new_status = None if deleted else rent_in.status
+    for views, id_user in ((RENTER_VIEWS, rent_in.id_user), (OWNER_VIEWS, id_owner)):
+        old, new = views.get(old_status), views.get(new_status)
+        changes = []
+        if old is not None and old != new:
+            changes.append({'view': old, 'op': 'removed', 'key': rent_in.id_rent_in})
+        if new is not None:
+            changes.append(changed(new, id_user, rent_in.id_rent_in, 'updated' if old == new else 'added'))
+        publish(id_user, changes)
+
+
+# Запись объявлений. Связанные строки создаются и изменяются в одной транзакции: идентификаторы новых строк
+# возвращает flush (INSERT ... RETURNING, для пачки строк — одним запросом), а избранное удалённых объявлений
+# удаляется одним DELETE по множеству объявлений
+# Создание объявлений владельца id_user для предметов items без фиксации транзакции; возвращает номера предметов,
+# прочитанные до фиксации (после неё обращение к атрибутам перечитывает каждую строку отдельным запросом)
+def create_listings(id_user, items):
+    # Большой импорт записывается пачками строк одного INSERT — это не N+1
+    with bulk_queries():
+        db.session.add_all(items)
+        db.session.flush()
+        rent_outs = [RentOut(status="активно", id_item=item.id_item, id_user=id_user, category=item.category,
+                             rent_price=item.rent_price) for item in items]
+        db.session.add_all(rent_outs)
+        db.session.flush()
+    return [item.id_item for item in items]
+
+
+# Обновление поиска и каталога во всех процессах после фиксации новых объявлений
+def listings_created(id_items):
+    broadcast_invalidation('search', id_items)
+    invalidate_catalog()
+
+
+# Удаление объявлений вместе с их избранным; возвращает удалённые объявления и их владельцев
+def remove_listings(ids):
+    bags = db.session.execute(delete(Bag).where(Bag.id_rent_out.in_(ids))
+                              .returning(Bag.id_bag, Bag.id_user)).all()
+    removed = db.session.execute(update(RentOut).where(RentOut.id_rent_out.in_(ids), RentOut.status != "удалено")
+                                 .values(status="удалено").returning(RentOut.id_rent_out, RentOut.id_user)).all()
+    db.session.commit()
+    for a in removed:
+        booking_calendar.drop(a.id_rent_out)
+    invalidate_catalog()
+    # Объявления пропадают из избранного у всех пользователей
+    invalidate_favorites(b.id_user for b in bags)
+    changes = {}
+    for b in bags:
+        changes.setdefault(b.id_user, []).append({'view': 'bag', 'op': 'removed', 'key': b.id_bag})
+    for id_user, user_changes in changes.items():
+        publish(id_user, user_changes)
+    return removed
+
+
+# Возвращение удалённых объявлений в каталог; возвращает восстановленные объявления и их владельцев
+def restore_listings(ids):
+    restored = db.session.execute(update(RentOut).where(RentOut.id_rent_out.in_(ids), RentOut.status == "удалено")
+                                  .values(status="активно").returning(RentOut.id_rent_out, RentOut.id_user)).all()
+    db.session.commit()
+    invalidate_catalog()
+    return restored
+
+
+# Объявления из CSV: столбцы name, category, description, rent_price, разделитель — запятая или точка с запятой
+CSV_COLUMNS = ('name', 'category', 'description', 'rent_price')
+CSV_IMPORT_LIMIT = 1000
+
+
+# Чтение предметов из CSV; ValueError с номером строки, если файл содержит ошибку
+def parse_items_csv(data):
+    text = data.decode('utf-8-sig')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(StringIO(text), dialect=dialect)
+    missing = [column for column in CSV_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        raise ValueError("В файле нет столбцов: %s." % ", ".join(missing))
+    items = []
+    for row in reader:
+        line = reader.line_num
+        if len(items) >= CSV_IMPORT_LIMIT:
+            raise ValueError("В файле больше %d объявлений." % CSV_IMPORT_LIMIT)
+        # В строке короче заголовка недостающие поля равны None
+        empty = [column for column in CSV_COLUMNS if row[column] is None]
+        if empty:
+            raise ValueError("Строка %d: нет значений в столбцах: %s." % (line, ", ".join(empty)))
+        name, category, description = (row[column].strip() for column in ('name', 'category', 'description'))
+        if not name or not category or not description:
+            raise ValueError("Строка %d: не заполнены название, категория или описание." % line)
+        if len(name) > 100 or len(category) > 100:
+            raise ValueError("Строка %d: название и категория должны быть не длиннее 100 символов." % line)
+        rent_price = parse_price(row['rent_price'].strip())
+        if rent_price is None or not rent_price.is_finite() or rent_price < 0:
+            raise ValueError("Строка %d: неверная стоимость аренды." % line)
+        items.append(Item(name=name, category=category, description=description, rent_price=rent_price,
+                          image_url=""))
+    if not items:
+        raise ValueError("В файле нет объявлений.")
+    return items
 
 
 # Обработчики адресов
@@ -110,6 +1722,9 @@ def home():
 @app.route("/registration", methods=("POST", "GET"))
 def registration():
     if request.method == "POST":
+        if not auth_limiter.allow(request.remote_addr):
+            flash("Слишком много попыток. Повторите попытку позже.")
+            return render_template("registration.html"), 429
         # Получение данных из формы
         username = request.form["username"]
         dob = request.form["dob"]
@@ -134,9 +1749,13 @@ def registration():
         elif password != confirm:
             flash("Пароли не совпадают.")
         else:
+            try:
+                hash = hash_password(password)
+            except Overloaded:
+                flash("Сервер перегружен. Повторите попытку позже.")
+                return render_template("registration.html"), 503
             try:
                 # Создание экземпляра класса User и добавление его в бд
-                hash = generate_password_hash(password)
                 user = User(
                     username=username,
                     dob=dob,
@@ -161,8 +1780,7 @@ def registration():
 @login_required
 def profile():
     # Проверка роли пользователя
-    user_login = User.query.get(current_user.id)
-    if user_login.role == "клиент":
+    if current_user.role == "клиент":
         return redirect("/profile_client")
     else:
         return redirect("/profile_admin")
@@ -173,10 +1791,9 @@ def profile():
 @login_required
 def profile_client():
     # Проверка роли пользователя
-    user = User.query.get(current_user.id)
-    if user.role != "клиент":
+    if current_user.role != "клиент":
         return redirect("/profile")
-    return render_template("profile_client.html", user=user)
+    return render_template("profile_client.html", user=current_user)
 
 
 # Страница профиля администратора
@@ -184,16 +1801,18 @@ def profile_client():
 @login_required
 def profile_admin():
     # Определение роли пользователя
-    admin = User.query.get(current_user.id)
-    if admin.role != "администратор":
+    if current_user.role != "администратор":
         return redirect("/profile")
-    return render_template("profile_admin.html", admin=admin)
+    return render_template("profile_admin.html", admin=current_user)
 
 
 # Страница входа в систему
 @app.route("/login", methods=("POST", "GET"))
 def login():
     if request.method == "POST":
+        if not auth_limiter.allow(request.remote_addr):
+            flash("Слишком много попыток входа. Повторите попытку позже.")
+            return render_template("login.html"), 429
         # Получение данных из формы
         email = request.form["email"]
         password = request.form["password"]
@@ -205,9 +1824,21 @@ def login():
         else:
             # Получение из бд пользователя по полю email
             user = User.query.filter_by(email=email).first()
+            try:
+                valid = user is not None and cpu_call(cpu_tasks.check_password, user.hash_password, password)
+            except Overloaded:
+                flash("Сервер перегружен. Повторите попытку позже.")
+                return render_template("login.html"), 503
             # Если данные верны, то пользователь будет авторизован и перенаправлен на запрашиваемую страницу
-            if user and check_password_hash(user.hash_password, password):
-                login_user(user)
+            if valid:
+                # Хеш старым методом заменяется хешем текущего метода; при перегрузке — при следующем входе
+                try:
+                    if needs_rehash(user.hash_password):
+                        user.hash_password = hash_password(password)
+                        db.session.commit()
+                except Overloaded:
+                    pass
+                login_user(cache_user(user))
                 next_page = request.args.get("next")
                 return redirect(next_page)
             else:
@@ -220,14 +1851,24 @@ def login():
 @app.route("/logout")
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     return redirect("/")
 
 
+# Страницы списков встраивают первую страницу данных (тот же JSON, что присылает обработчик reload_*),
+# поэтому список показывается без ожидания соединения socket.io; после подключения клиент по версии данных
+# получает только изменения
 # Каталог
 @app.route("/catalog")
+@read_only
 def catalog():
-    return render_template("catalog.html")
+    # Версия берётся до чтения страницы: если каталог изменится, клиент после подключения перечитает страницу
+    version = catalog_version()
+    page = cached_catalog(CATALOG_FIRST_PAGE, lambda: build_catalog_page(None, None, None, "new", None))
+    # Избранное пользователя передаётся отдельно от общей для всех страницы каталога
+    ids = sorted(favorites(current_user.id)) if current_user.is_authenticated else []
+    return render_template("catalog.html", initial=page, catalog_version=version, favorites=ids)
 
 
 # Страница модерации объявлений
@@ -244,6 +1885,15 @@ def complaint():
     return render_template("complaint.html")
 
 
+# Панель модератора
+@app.route("/dashboard")
+@login_required
+def dashboard():
+    if current_user.role != "администратор":
+        return redirect("/profile")
+    return render_template("dashboard.html")
+
+
 # Страница объявлений пользователя
 @app.route("/my_rent_out")
 @login_required
@@ -254,8 +1904,9 @@ def my_rent_out():
 # Страница избранных предметов
 @app.route("/bag")
 @login_required
+@read_only
 def bag():
-    return render_template("bag.html")
+    return render_template("bag.html", initial=view_json('bag'))
 
 
 # Страница создания нового объявления
@@ -269,30 +1920,67 @@ def add_rent_out():
             description = request.form['description']
             rent_price = request.form['rent_price']
             file = request.files['file']
-            file.filename = str(uuid4()) + '.png'
-            save_path = os.path.join(UPLOAD_FOLDER, file.filename)
-            file.save(save_path)
-
-            # Создание предмета с полученными данными и запись в бд
-            item = Item(name=name, category=category, description=description, rent_price=rent_price,
-                        image_url=save_path)
-            db.session.add(item)
-            db.session.commit()
+            data = file.read()
+            try:
+                content_hash = validate_image(data)
+            except Overloaded:
+                flash("Сервер перегружен. Повторите попытку позже.")
+                return render_template("add_rent_out.html"), 503
+            except Exception:
+                flash("Файл не является изображением в формате JPEG, PNG, WEBP, GIF или BMP.")
+                return render_template("add_rent_out.html")
+            # Место для создания вариантов изображения занимается до записи объявления: при перегрузке объявление
+            # не записывается
+            try:
+                acquire_cpu_slot()
+            except Overloaded:
+                flash("Сервер перегружен. Повторите попытку позже.")
+                return render_template("add_rent_out.html"), 503
 
-            # Получение id только что добавленного предмета
-            new_item = db.session.query(Item).order_by(Item.id_item.desc()).first()
-            # Создание объявления и добавление в бд
-            rent_out = RentOut(status="активно", id_item=new_item.id_item, id_user=current_user.id)
-            db.session.add(rent_out)
-            db.session.commit()
+            # Создание предмета и объявления с полученными данными и запись в бд одной транзакцией
+            try:
+                item = Item(name=name, category=category, description=description, rent_price=rent_price,
+                            image_url=content_hash)
+                id_items = create_listings(current_user.id, [item])
+                db.session.commit()
+            except (SQLAlchemyError, ValueError):
+                db.session.rollback()
+                cpu_slots.release()
+                flash("Возникла ошибка. Не удалось добавить объявление. Попробуйте ещё раз.")
+                return render_template("add_rent_out.html")
+            listings_created(id_items)
+            submit_image(content_hash, data, current_user.id)
             flash("Объявление успешно добавлено.", category="success")
-        except:
-            db.session.rollback()
-            flash("Возникла ошибка. Не удалось добавить объявление. Попробуйте ещё раз.")
+        except KeyError:
+            flash("Заполните все поля и выберите файл изображения.")
 
     return render_template("add_rent_out.html")
 
 
+# Импорт объявлений из CSV: все строки файла записываются одной транзакцией или не записываются вовсе
+@app.route("/import_rent_out", methods=("POST",))
+@login_required
+def import_rent_out():
+    try:
+        items = parse_items_csv(request.files['file'].read())
+    except UnicodeDecodeError:
+        flash("Файл должен быть в кодировке UTF-8.")
+        return render_template("add_rent_out.html")
+    except ValueError as error:
+        flash(str(error))
+        return render_template("add_rent_out.html")
+    try:
+        id_items = create_listings(current_user.id, items)
+        db.session.commit()
+    except (SQLAlchemyError, ValueError):
+        db.session.rollback()
+        flash("Возникла ошибка. Не удалось импортировать объявления. Попробуйте ещё раз.")
+        return render_template("add_rent_out.html")
+    listings_created(id_items)
+    flash("Импортировано объявлений: %d." % len(items), category="success")
+    return render_template("add_rent_out.html")
+
+
 # Страница создания новой заявки
 @app.route("/add_rent_in/<int:id_rent_out>")
 @login_required
@@ -310,43 +1998,49 @@ def add_complaint(id_rent_in):
 # Страница входящих заявок
 @app.route("/incoming")
 @login_required
+@read_only
 def incoming():
-    return render_template("incoming.html")
+    return render_template("incoming.html", initial=view_json('incoming'))
 
 
 # Страница исходящих заявок
 @app.route("/outgoing")
 @login_required
+@read_only
 def outgoing():
-    return render_template("outgoing.html")
+    return render_template("outgoing.html", initial=view_json('outgoing'))
 
 
 # Страница с действующими арендами пользователя
 @app.route("/irent")
 @login_required
+@read_only
 def irent():
-    return render_template("irent.html")
+    return render_template("irent.html", initial=view_json('irent'))
 
 
 # Страница с действующими сдачами в аренду пользователя
 @app.route("/notirent")
 @login_required
+@read_only
 def notirent():
-    return render_template("notirent.html")
+    return render_template("notirent.html", initial=view_json('notirent'))
 
 
 # История моих аренд
 @app.route("/irent_histori")
 @login_required
+@read_only
 def irent_histori():
-    return render_template("irent_histori.html")
+    return render_template("irent_histori.html", initial=history_json('irent_history', {}))
 
 
 # История сдачи в аренду
 @app.route("/notirent_histori")
 @login_required
+@read_only
 def notirent_histori():
-    return render_template("notirent_histori.html")
+    return render_template("notirent_histori.html", initial=history_json('notirent_history', {}))
 
 
 # Страница жалоб пользователя
@@ -356,6 +2050,56 @@ def my_complaint():
     return render_template("my_complaint.html")
 
 
+# Загруженные изображения
+# Имена файлов определяются их содержимым, поэтому ответ кэшируется браузером без повторной проверки.
+# send_from_directory отвечает 304 на условные запросы (ETag, If-Modified-Since), поддерживает Range
+# и передаёт файл через wsgi.file_wrapper (sendfile в gunicorn) или X-Sendfile
+@app.route("/media/<path:filename>")
+def media(filename):
+    response = send_from_directory(UPLOAD_FOLDER, filename, conditional=True, etag=True,
+                                   max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# Хеши содержимого статических файлов для адресов с версией
+static_versions = {}
+
+
+# Адрес статического файла с версией: при изменении файла меняется адрес, поэтому его можно кэшировать навсегда
+@app.template_global()
+def static_url(filename):
+    version = static_versions.get(filename)
+    if version is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            version = static_versions[filename] = hashlib.md5(f.read()).hexdigest()[:12]
+    return url_for('static', filename=filename, v=version)
+
+
+# Параметры подключения клиента socket.io на страницах
+@app.template_global()
+def socket_options():
+    return {'transports': SOCKETIO_TRANSPORTS}
+
+
+# JSON, встроенный в страницу в <script type="application/json">: «<» экранируется, чтобы данные не закрыли тег
+@app.template_filter('inline_json')
+def inline_json(data_json):
+    return Markup(data_json.replace('<', '\\u003c'))
+
+
+# Долгое кэширование статических файлов, запрошенных по адресу с версией
+@app.after_request
+def cache_static(response):
+    if request.endpoint == 'static' and 'v' in request.args and response.status_code in (200, 206, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
 # Перенаправление для гостя
 @app.after_request
 def redirect_to_signin(response):
@@ -364,26 +2108,606 @@ def redirect_to_signin(response):
     return response
 
 
+# Число запросов к БД, сэкономленных кэшем пользователей за время обработки запроса
+@app.after_request
+def add_roundtrips_saved_header(response):
+    response.headers['X-DB-Roundtrips-Saved'] = str(g.get('db_roundtrips_saved', 0))
+    return response
+
+
+# Метрики обработчиков в формате Prometheus (/metrics): время обработки, запросы к БД, объём отправленных данных
+# и число получателей событий для каждого маршрута и события socket.io.
+# Значения хранятся в памяти процесса: при нескольких процессах gunicorn каждый отдаёт свои
+METRIC_HELP = {
+    'app_handler_seconds': ('histogram', "Время обработки запроса, события или фоновой задачи, с"),
+    'app_handler_errors_total': ('counter', "Число необработанных исключений"),
+    'app_db_queries_total': ('counter', "Число запросов к БД"),
+    'app_db_query_seconds_total': ('counter', "Время выполнения запросов к БД, с"),
+    'app_payload_bytes_total': ('counter', "Объём ответов HTTP и данных отправленных событий, байт"),
+    'app_emits_total': ('counter', "Число отправленных событий socket.io"),
+    'app_emit_recipients_total': ('counter', "Число получателей отправленных событий в этом процессе"),
+    'app_job_rows_total': ('counter', "Число строк, обработанных фоновой задачей"),
+    'app_n_plus_one_total': ('counter', "Число вызовов, повторивших один запрос к БД больше N_PLUS_ONE_LIMIT раз"),
+    'app_events_limited_total': ('counter', "Число событий socket.io, отклонённых ограничением частоты"),
+    'app_events_merged_total': ('counter', "Число повторных событий reload_*, объединённых с другим вызовом"),
+    'app_emits_dropped_total': ('counter', "Число событий, не отправленных клиенту с переполненной очередью"),
+    'app_socket_connections': ('gauge', "Число соединений socket.io процесса"),
+}
+# Границы корзин гистограммы времени обработки, с
+HANDLER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Вызов, повторивший один и тот же запрос больше N_PLUS_ONE_LIMIT раз, отмечается как N+1 (0 — без проверки)
+N_PLUS_ONE_LIMIT = int(os.getenv('N_PLUS_ONE_LIMIT', 10))
+
+
+class Metrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Метки -> число значений в каждой корзине (последняя — +Inf) и сумма значений
+        self.histograms = {}
+        # (название, метки) -> значение
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self.lock:
+            histogram = self.histograms.get(labels)
+            if histogram is None:
+                histogram = self.histograms[labels] = [0] * (len(self.buckets) + 2)
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+
+    def add(self, name, labels, value=1):
+        if value:
+            with self.lock:
+                self.counters[name, labels] = self.counters.get((name, labels), 0) + value
+
+    # Текстовый формат Prometheus; labels — значения меток kind и handler
+    def render(self, gauges):
+        with self.lock:
+            histograms = {labels: list(values) for labels, values in self.histograms.items()}
+            counters = dict(self.counters)
+        series = {name: [] for name in METRIC_HELP}
+        for labels, values in sorted(histograms.items()):
+            total = 0
+            for le, count in zip(self.buckets + ('+Inf',), values):
+                total += count
+                series['app_handler_seconds'].append(
+                    'app_handler_seconds_bucket{%s,le="%s"} %d' % (format_labels(labels), le, total))
+            series['app_handler_seconds'].append('app_handler_seconds_sum{%s} %r' % (format_labels(labels), values[-1]))
+            series['app_handler_seconds'].append('app_handler_seconds_count{%s} %d' % (format_labels(labels), total))
+        for (name, labels), value in sorted(counters.items()):
+            series[name].append('%s{%s} %r' % (name, format_labels(labels), value))
+        for name, value in gauges.items():
+            series[name].append('%s %r' % (name, value))
+        lines = []
+        for name, (kind, help_text) in METRIC_HELP.items():
+            lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, kind)] + series[name]
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    return 'kind="%s",handler="%s"' % tuple(
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels)
+
+
+metrics = Metrics(HANDLER_BUCKETS)
+
+
+# Замер одного вызова обработчика
+class Probe:
+    def __init__(self, kind, name):
+        self.labels = (kind, name)
+        self.start = time.perf_counter()
+        self.query_start = None
+        self.queries = 0
+        self.query_time = 0.0
+        # Текст запроса -> число выполнений, для поиска N+1
+        self.statements = Counter()
+        # Идёт пакетная запись (bulk_queries): её запросы не учитываются в поиске N+1
+        self.bulk = False
+        self.bytes = 0
+        self.emits = 0
+        self.recipients = 0
+
+
+# Текущий замер потока (зелёного потока в режимах eventlet и gevent)
+probes = threading.local()
+
+
+# Сэмплирующий профилировщик медленных вызовов (PROFILE_SLOW_MS > 0): системный поток каждые PROFILE_INTERVAL_MS
+# записывает стеки вызовов обработчиков, а стеки вызовов дольше PROFILE_SLOW_MS сохраняются в PROFILE_DIR
+# в свёрнутом формате (строка «кадр;кадр;... число»), который строят в flame graph flamegraph.pl или speedscope
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+
+# Функция модуля стандартной библиотеки без замены eventlet/gevent:
+# поток профилировщика должен быть системным, чтобы прерывать зелёные потоки
+def original(module, name):
+    if ASYNC_MODE == 'eventlet':
+        return getattr(eventlet.patcher.original(module), name)
+    if ASYNC_MODE == 'gevent':
+        return monkey.get_original(module, name)
+    return getattr(sys.modules[module], name)
+
+
+class Sampler:
+    def __init__(self, interval):
+        self.interval = interval
+        # Кадр обёртки обработчика -> число появлений каждого стека под ним
+        self.profiles = {}
+        self.started = False
+
+    def start(self, frame):
+        if not self.started:
+            self.started = True
+            original('_thread', 'start_new_thread')(self.run, ())
+        self.profiles[frame] = Counter()
+
+    def stop(self, frame):
+        return self.profiles.pop(frame, None)
+
+    def run(self):
+        sleep = original('time', 'sleep')
+        while True:
+            sleep(self.interval)
+            if not self.profiles:
+                continue
+            for frame in sys._current_frames().values():
+                names = []
+                while frame is not None:
+                    stacks = self.profiles.get(frame)
+                    if stacks is not None:
+                        stacks[';'.join(reversed(names))] += 1
+                        break
+                    code = frame.f_code
+                    names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+
+
+sampler = Sampler(PROFILE_INTERVAL_MS / 1000)
+
+
+# Запись стеков медленного вызова для flame graph
+def save_profile(labels, elapsed, stacks):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, '%s-%s-%s-%dms.folded' % (
+        datetime.now().strftime('%Y%m%d-%H%M%S-%f'), labels[0], labels[1], elapsed * 1000))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines('%s %d\n' % (stack or labels[1], count) for stack, count in stacks.items())
+    app.logger.warning("Медленный вызов %s %s: %.0f мс, профиль %s", *labels, elapsed * 1000, path)
+
+
+# Учёт вызова в метриках и поиск N+1
+def finish_probe(probe, elapsed):
+    labels = probe.labels
+    metrics.observe(labels, elapsed)
+    metrics.add('app_db_queries_total', labels, probe.queries)
+    metrics.add('app_db_query_seconds_total', labels, probe.query_time)
+    metrics.add('app_payload_bytes_total', labels, probe.bytes)
+    metrics.add('app_emits_total', labels, probe.emits)
+    metrics.add('app_emit_recipients_total', labels, probe.recipients)
+    if N_PLUS_ONE_LIMIT and probe.statements:
+        statement, count = probe.statements.most_common(1)[0]
+        if count > N_PLUS_ONE_LIMIT:
+            metrics.add('app_n_plus_one_total', labels)
+            app.logger.warning("N+1 в %s %s: запрос выполнен %d раз: %s", *labels, count, statement[:200])
+
+
+# Обёртка маршрута или обработчика события, замеряющая его вызовы
+def instrument(kind, name, handler):
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        probe = Probe(kind, name)
+        previous = getattr(probes, 'current', None)
+        probes.current = probe
+        frame = sys._getframe()
+        if PROFILE_SLOW_MS:
+            sampler.start(frame)
+        try:
+            return handler(*args, **kwargs)
+        except HTTPException:
+            raise
+        except Exception:
+            metrics.add('app_handler_errors_total', probe.labels)
+            raise
+        finally:
+            probes.current = previous
+            elapsed = time.perf_counter() - probe.start
+            stacks = sampler.stop(frame) if PROFILE_SLOW_MS else None
+            finish_probe(probe, elapsed)
+            if stacks and elapsed * 1000 >= PROFILE_SLOW_MS:
+                save_profile(probe.labels, elapsed, stacks)
+    return wrapper
+
+
+# Замер всех маршрутов и обработчиков событий socket.io; вызывается после их объявления
+def instrument_handlers():
+    for endpoint, view in app.view_functions.items():
+        app.view_functions[endpoint] = instrument('http', endpoint, view)
+    for handlers in socketio.server.handlers.values():
+        for event_name, handler in handlers.items():
+            handlers[event_name] = instrument('socket', event_name, handler)
+
+
+# Пакетная запись: один запрос, повторённый для пачек строк, не считается N+1
+@contextmanager
+def bulk_queries():
+    probe = getattr(probes, 'current', None)
+    if probe is None:
+        yield
+        return
+    previous = probe.bulk
+    probe.bulk = True
+    try:
+        yield
+    finally:
+        probe.bulk = previous
+
+
+# Число и время запросов к БД текущего вызова
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    probe = getattr(probes, 'current', None)
+    if probe is not None:
+        probe.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_query(conn, cursor, statement, parameters, context, executemany):
+    probe = getattr(probes, 'current', None)
+    if probe is not None and probe.query_start is not None:
+        probe.queries += 1
+        probe.query_time += time.perf_counter() - probe.query_start
+        if not probe.bulk:
+            probe.statements[statement] += 1
+        probe.query_start = None
+
+
+# Размер данных и число получателей событий, отправленных текущим вызовом
+def count_emits(server_emit):
+    @functools.wraps(server_emit)
+    def wrapper(event_name, data=None, to=None, namespace=None, **kwargs):
+        probe = getattr(probes, 'current', None)
+        if probe is not None:
+            rooms = socketio.server.manager.rooms.get(namespace or '/', {})
+            probe.emits += 1
+            probe.recipients += sum(len(rooms.get(room, ())) for room in
+                                    (to if isinstance(to, list) else [to or kwargs.get('room')]))
+            if isinstance(data, str):
+                probe.bytes += len(data.encode())
+            elif isinstance(data, bytes):
+                probe.bytes += len(data)
+        return server_emit(event_name, data, to=to, namespace=namespace, **kwargs)
+    return wrapper
+
+
+socketio.server.emit = count_emits(socketio.server.emit)
+
+
+# Размер ответа HTTP
+@app.after_request
+def count_response_bytes(response):
+    if request.endpoint is not None and response.content_length:
+        metrics.add('app_payload_bytes_total', ('http', request.endpoint), response.content_length)
+    return response
+
+
+# Метрики процесса для Prometheus. Доступны администратору, вошедшему в систему, и сборщику метрик с заголовком
+# «Authorization: Bearer <METRICS_TOKEN>»; остальным отвечает 404, как несуществующий маршрут
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+
+def metrics_allowed():
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            return True
+    return is_admin()
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if not metrics_allowed():
+        return "Not Found", 404
+    return metrics.render({'app_socket_connections': connections['count']}), 200, {
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# Ограничение частоты событий socket.io: у каждого соединения и у каждого пользователя (по всем его вкладкам)
+# своё ведро токенов; событие сверх лимита не передаётся обработчику, а клиенту отправляется 'rate_limited'
+# с названием и аргументами события, по которому страница перечитывает данные (в том числе действия, показанные
+# до ответа сервера) и сообщает о невыполненном действии. 'rate_limited' отправляется соединению не чаще раза
+# в RATE_LIMITED_NOTICE секунд, чтобы ответы на поток событий не нагружали сервер. 0 — без ограничения
+socket_limiter = TokenBucket(float(os.getenv('SOCKET_EVENT_RATE', 10)), float(os.getenv('SOCKET_EVENT_BURST', 30)))
+user_event_limiter = TokenBucket(float(os.getenv('SOCKET_USER_EVENT_RATE', 20)),
+                                 float(os.getenv('SOCKET_USER_EVENT_BURST', 60)))
+# Соединение socket.io -> id пользователя, вошедшего в систему
+connection_users = {}
+RATE_LIMITED_MESSAGE = "Слишком много действий. Повторите через несколько секунд."
+RATE_LIMITED_NOTICE = 1
+# Соединение -> время последней отправки 'rate_limited'
+rate_limited_notices = {}
+
+# Повторы события reload_* с теми же аргументами от одного соединения в течение RELOAD_DEBOUNCE секунд после
+# вызова обработчика объединяются в один вызов после окончания интервала (0 — без объединения)
+RELOAD_DEBOUNCE = float(os.getenv('RELOAD_DEBOUNCE_MS', 250)) / 1000
+# Соединение -> (событие, аргументы) -> [время последнего вызова, отложенный вызов назначен]
+reload_calls = {}
+reload_lock = threading.Lock()
+
+# Очередь неотправленных пакетов клиента ограничена EMIT_QUEUE_SIZE пакетами (0 — без ограничения).
+# При переполнении клиенту, который не успевает их получать, не отправляются изменения списков и уведомления:
+# вместо них в очередь один раз ставится 'connect', по которому клиент перечитывает списки со своей версии
+EMIT_QUEUE_SIZE = int(os.getenv('EMIT_QUEUE_SIZE', 100))
+RESYNC_EVENTS = {'delta', 'connect'}
+# Соединения engine.io, которым уже отправлен 'connect' после переполнения очереди
+lagging = set()
+
+
+# Вызов обработчика события, если соединение и пользователь не превысили лимит частоты
+def rate_limited(namespace, event_name, handler):
+    @functools.wraps(handler)
+    def wrapper(sid, *args):
+        id_user = connection_users.get(sid)
+        if not socket_limiter.allow(sid) or id_user is not None and not user_event_limiter.allow(id_user):
+            metrics.add('app_events_limited_total', ('socket', event_name))
+            now = time.monotonic()
+            if now - rate_limited_notices.get(sid, 0) < RATE_LIMITED_NOTICE:
+                return None
+            rate_limited_notices[sid] = now
+            socketio.server.emit('rate_limited', dumps({'event': event_name, 'args': list(args),
+                                                        'message': RATE_LIMITED_MESSAGE}),
+                                 to=sid, namespace=namespace, ignore_queue=True)
+            return None
+        return handler(sid, *args)
+    return wrapper
+
+
+# Объединение повторов события reload_*: первый вызов выполняется сразу, повторы в течение RELOAD_DEBOUNCE
+# заменяются одним вызовом в конце интервала, поэтому клиент получает данные не старше последнего запроса
+def debounced(event_name, handler):
+    def deferred(sid, key, args, delay):
+        socketio.sleep(delay)
+        with reload_lock:
+            calls = reload_calls.get(sid)
+            if calls is None:
+                return
+            calls[key] = [time.monotonic(), False]
+        handler(sid, *args)
+
+    @functools.wraps(handler)
+    def wrapper(sid, *args):
+        key = (event_name,) + args
+        try:
+            hash(key)
+        except TypeError:
+            return handler(sid, *args)
+        now = time.monotonic()
+        with reload_lock:
+            calls = reload_calls.setdefault(sid, {})
+            state = calls.get(key)
+            if state is None or (not state[1] and now - state[0] >= RELOAD_DEBOUNCE):
+                # Удаление записей с истёкшим интервалом: аргументы (версии списков) меняются от вызова к вызову
+                if len(calls) > 32:
+                    for k in [k for k, v in calls.items() if not v[1] and now - v[0] >= RELOAD_DEBOUNCE]:
+                        del calls[k]
+                calls[key] = [now, False]
+                delay = None
+            else:
+                delay = state[0] + RELOAD_DEBOUNCE - now if not state[1] else -1
+                state[1] = True
+        if delay is None:
+            return handler(sid, *args)
+        metrics.add('app_events_merged_total', ('socket', event_name))
+        if delay >= 0:
+            socketio.start_background_task(deferred, sid, key, args, delay)
+        return None
+    return wrapper
+
+
+# Ограничение частоты всех событий и объединение повторов reload_*; вызывается после instrument_handlers,
+# чтобы отклонённые и объединённые события не учитывались как вызовы обработчиков
+def limit_handlers():
+    for namespace, handlers in socketio.server.handlers.items():
+        for event_name, handler in handlers.items():
+            if event_name in ('connect', 'disconnect'):
+                continue
+            if RELOAD_DEBOUNCE and event_name.startswith('reload_'):
+                handler = debounced(event_name, handler)
+            handlers[event_name] = rate_limited(namespace, event_name, handler)
+
+
+# Отправка пакета клиенту с ограничением его очереди
+def bounded_send(send_packet):
+    @functools.wraps(send_packet)
+    def wrapper(eio_sid, pkt):
+        if EMIT_QUEUE_SIZE and pkt.packet_type == packet.EVENT and pkt.data and pkt.data[0] in RESYNC_EVENTS:
+            socket = socketio.server.eio.sockets.get(eio_sid)
+            if socket is None:
+                lagging.discard(eio_sid)
+            elif socket.queue.qsize() >= EMIT_QUEUE_SIZE:
+                metrics.add('app_emits_dropped_total', ('socket', pkt.data[0]))
+                if eio_sid not in lagging:
+                    lagging.add(eio_sid)
+                    send_packet(eio_sid, packet.Packet(packet.EVENT, data=['connect'], namespace=pkt.namespace))
+                return
+            else:
+                lagging.discard(eio_sid)
+        send_packet(eio_sid, pkt)
+    return wrapper
+
+
+socketio.server._send_packet = bounded_send(socketio.server._send_packet)
+
+
 # Обработчики событий socket.io
-# Обновление данных каталога
-@socketio.on('reload_catalog')
-def handle_reload_catalog():
-    # Получение данных об объявлении
-    catalog = db.session.query(RentOut, Item).join(Item, RentOut.id_item == Item.id_item) \
-        .filter(RentOut.status == "активно") \
-        .order_by(RentOut.id_rent_out.desc()).all()
-    catalog_list = [{'id_rent_out': a.RentOut.id_rent_out,
-                     'id_item': a.RentOut.id_item,
-                     'name': a.Item.name,
-                     'category': a.Item.category,
-                     'description': a.Item.description,
-                     'rent_price': a.Item.rent_price,
-                     'image_url': a.Item.image_url
-                     } for a in catalog]
-    # Упаковка данных в json
-    catalog_json = json.dumps(catalog_list)
-    # Отправка события 'catalog' с данными на клиент
-    socketio.emit('catalog', catalog_json)
+# Подключение клиента к комнате пользователя и комнате администраторов
+@socketio.on('connect')
+def handle_connect():
+    # Отказ в соединении при превышении лимита соединений процесса
+    if MAX_CONNECTIONS and connections['count'] >= MAX_CONNECTIONS:
+        return False
+    connections['count'] += 1
+    if current_user.is_authenticated:
+        connection_users[request.sid] = current_user.id
+        join_room(user_room(current_user.id))
+        if current_user.role == "администратор":
+            join_room(ADMIN_ROOM)
+
+
+# Отключение клиента
+@socketio.on('disconnect')
+def handle_disconnect():
+    connections['count'] -= 1
+    connection_users.pop(request.sid, None)
+    catalog_date_filters.pop(request.sid, None)
+    socket_limiter.forget(request.sid)
+    rate_limited_notices.pop(request.sid, None)
+    lagging.discard(socketio.server.manager.eio_sid_from_sid(request.sid, '/'))
+    with reload_lock:
+        reload_calls.pop(request.sid, None)
+
+
+# Преобразование цены из запроса клиента
+def parse_price(value):
+    if value in (None, ""):
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+# Получение страницы каталога с фильтрами и курсором по ключу (цена, id_rent_out). Фильтры и сортировка
+# обслуживаются частичными индексами активных объявлений, поэтому страница читает индекс с курсора, не сортируя
+# все подходящие объявления
+def build_catalog_page(category, price_min, price_max, sort, cursor, free_from=None, free_to=None):
+    view = VIEWS['catalog']
+    query = view.statement
+    if category:
+        query = query.where(RentOut.category == category)
+    if price_min is not None:
+        query = query.where(RentOut.rent_price >= price_min)
+    if price_max is not None:
+        query = query.where(RentOut.rent_price <= price_max)
+    # Только объявления без забронированных периодов, пересекающихся с [free_from, free_to)
+    if free_from and free_to:
+        query = query.where(~select(RentIn.id_rent_in).where(
+            RentIn.id_rent_out == RentOut.id_rent_out, RentIn.status.in_(BOOKED_STATUSES),
+            rent_in_overlaps(free_from, free_to)).exists())
+
+    # Сортировка и продолжение выборки после последней записи предыдущей страницы
+    if sort == "price_asc":
+        query = query.where(RentOut.rent_price.isnot(None))
+        if cursor:
+            query = query.where(tuple_(RentOut.rent_price, RentOut.id_rent_out) > tuple_(cursor[0], cursor[1]))
+        query = query.order_by(RentOut.rent_price.asc(), RentOut.id_rent_out.asc())
+    elif sort == "price_desc":
+        query = query.where(RentOut.rent_price.isnot(None))
+        if cursor:
+            query = query.where(tuple_(RentOut.rent_price, RentOut.id_rent_out) < tuple_(cursor[0], cursor[1]))
+        query = query.order_by(RentOut.rent_price.desc(), RentOut.id_rent_out.desc())
+    else:
+        if cursor:
+            query = query.where(RentOut.id_rent_out < cursor[1])
+        query = query.order_by(RentOut.id_rent_out.desc())
+
+    # Запрос на одну запись больше размера страницы, чтобы узнать, есть ли следующая
+    rows = db.session.execute(query.limit(CATALOG_PAGE_SIZE + 1)).all()
+    next_cursor = None
+    if len(rows) > CATALOG_PAGE_SIZE:
+        rows = rows[:CATALOG_PAGE_SIZE]
+        next_cursor = [str(rows[-1].rent_price), rows[-1].id_rent_out]
+    return dumps({'items': view.items(rows), 'cursor': cursor, 'next_cursor': next_cursor})
+
+
+# Страница каталога по фильтрам клиента
+@socketio.on('catalog_page')
+def handle_catalog_page(data):
+    join_room(CATALOG_ROOM)
+    # Распаковка json и проверка параметров
+    data_json = json.loads(data)
+    category = data_json.get('category') or None
+    price_min = parse_price(data_json.get('price_min'))
+    price_max = parse_price(data_json.get('price_max'))
+    sort = data_json.get('sort', "new")
+    cursor = data_json.get('cursor')
+    try:
+        cursor = (parse_price(cursor[0]), int(cursor[1])) if cursor else None
+    except (TypeError, ValueError, IndexError):
+        cursor = None
+    if cursor and sort != "new" and cursor[0] is None:
+        cursor = None
+    free_from = parse_datetime(data_json.get('free_from'))
+    free_to = parse_datetime(data_json.get('free_to'))
+    if not free_from or not free_to or free_from >= free_to:
+        free_from = free_to = None
+        catalog_date_filters.pop(request.sid, None)
+    else:
+        catalog_date_filters[request.sid] = (free_from, free_to)
+
+    # Клиент уже показывает страницу текущей версии каталога, встроенную в страницу /catalog
+    if data_json.get('version') == catalog_version():
+        return
+    key = ('page', category, price_min, price_max, sort, cursor, free_from, free_to)
+    page_json = cached_catalog(key, lambda: build_catalog_page(category, price_min, price_max, sort, cursor,
+                                                               free_from, free_to))
+    emit('catalog_page', page_json)
+
+
+# Полнотекстовый поиск по каталогу
+@socketio.on('search')
+@read_only
+def handle_search(data):
+    join_room(CATALOG_ROOM)
+    data_json = json.loads(data)
+    query = str(data_json.get('query', ""))[:100]
+    try:
+        page = max(int(data_json.get('page', 0)), 0)
+    except (TypeError, ValueError):
+        page = 0
+    rows, has_next = search_catalog(query, page)
+    emit('search', dumps({'query': query, 'page': page, 'items': VIEWS['catalog'].items(rows),
+                          'next_page': page + 1 if has_next else None}))
+
+
+# Строки объявлений по спискам рекомендаций lists без объявлений пользователя id_user (гость — 0):
+# в каждом списке не больше RECOMMEND_LIMIT объявлений в порядке рекомендации, все списки читаются одним запросом
+def recommended_items(id_user, *lists):
+    ids = sorted(set().union(*lists))
+    view = VIEWS['recommended']
+    rows = {a['id_rent_out']: a for a in view.items(view.rows(ids=ids, id_user=id_user))} if ids else {}
+    return [[rows[a] for a in ids if a in rows][:RECOMMEND_LIMIT] for ids in lists]
+
+
+# Похожие объявления и объявления, которые арендуют вместе с id_rent_out.
+# Из индекса берётся вдвое больше объявлений на случай, если часть из них сняли с публикации
+@socketio.on('similar')
+@read_only
+def handle_similar(id_rent_out):
+    index = recommendations.get()
+    id_user = current_user.id if current_user.is_authenticated else 0
+    similar, also = recommended_items(id_user, index.similar_to(id_rent_out, 2 * RECOMMEND_LIMIT),
+                                      index.also_rented(id_rent_out, 2 * RECOMMEND_LIMIT))
+    emit('similar', dumps({'id_rent_out': id_rent_out, 'similar': similar, 'also': also}))
+
+
+# Персональные рекомендации по последним заявкам и избранному пользователя
+@socketio.on('recommend')
+@read_only
+def handle_recommend():
+    history = []
+    id_user = current_user.id if current_user.is_authenticated else 0
+    if current_user.is_authenticated:
+        history = db.session.scalars(select(RentIn.id_rent_out).where(RentIn.id_user == id_user)
+                                     .order_by(RentIn.id_rent_in.desc()).limit(RECOMMEND_HISTORY)).all()
+        history += db.session.scalars(select(Bag.id_rent_out).where(Bag.id_user == id_user)
+                                      .order_by(Bag.id_bag.desc()).limit(RECOMMEND_HISTORY)).all()
+    suggested, = recommended_items(id_user, recommendations.get().suggest(history, 2 * RECOMMEND_LIMIT))
+    emit('recommend', dumps(suggested))
 
 
 # Добавление жалобы
@@ -401,73 +2725,66 @@ def add_complaint(data):
     db.session.add(complaint)
     db.session.commit()
 
-    # Отправка события 'connect' с сервера на клиент
-    socketio.emit('connect')
+    # Отправка события 'connect' автору жалобы и администраторам
+    notify(ADMIN_ROOM, user_room(id_user))
 
 
-# Обновление страницы с жалобами
+# Страница очереди жалоб: data — статус жалоб и курсор (номер последней жалобы предыдущей страницы)
 @socketio.on('reload_complaint')
-def handle_reload_complaint():
-    # Получение данных о всех жалобах из БД
-    complaint = db.session.query(Complaint, RentIn, RentOut, Item, User) \
-        .join(RentIn, Complaint.id_rent_in == RentIn.id_rent_in) \
-        .join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .join(User, Complaint.id_user == User.id) \
-        .order_by(RentIn.id_rent_in.desc()).all()
-    complaint_list = [{'id_rent_in': a.RentIn.id_rent_in,
-                       'id_rent_out': a.RentOut.id_rent_out,
-                       'id_item': a.RentOut.id_item,
-                       'id_complaint': a.Complaint.id_complaint,
-                       'username': a.User.username,
-                       'phone': a.User.phone,
-                       'email': a.User.email,
-                       'name': a.Item.name,
-                       'category': a.Item.category,
-                       'description': a.Item.description,
-                       'rent_price': a.Item.rent_price,
-                       'image_url': a.Item.image_url,
-                       'date_rent_start': a.RentIn.date_rent_start,
-                       'date_rent_finish': a.RentIn.date_rent_finish,
-                       'note': a.RentIn.note,
-                       'status': a.RentIn.status,
-                       'status_complaint': a.Complaint.status,
-                       'description_complaint': a.Complaint.description
-                       } for a in complaint]
-    # Упаковка в json и отправка на нужный адрес
-    complaint_json = json.dumps(complaint_list, default=str)
-    socketio.emit('complaint', complaint_json)
+def handle_reload_complaint(data=None):
+    if not is_admin():
+        return
+    params = json.loads(data) if data else {}
+    status = params.get('status') if params.get('status') in COMPLAINT_STATUSES else "рассматривается"
+    try:
+        cursor = int(params.get('cursor') or FIRST_PAGE_CURSOR)
+    except (TypeError, ValueError):
+        cursor = FIRST_PAGE_CURSOR
+    rows = VIEWS['complaint'].rows(status=status, cursor=cursor)
+    has_next = len(rows) > COMPLAINT_PAGE_SIZE
+    rows = rows[:COMPLAINT_PAGE_SIZE]
+    emit('complaint', dumps({'status': status, 'first': cursor == FIRST_PAGE_CURSOR,
+                             'cursor': rows[-1].id_complaint if has_next else None,
+                             'items': VIEWS['complaint'].items(rows)}))
+
+
+# Панель модератора: пользователи с наибольшим числом открытых жалоб, объявления с наибольшим числом жалоб
+# и доля жалоб среди их аренд, аренды и выручка по категориям за последние DASHBOARD_DAYS дней
+DASHBOARD_TOP = 10
+DASHBOARD_DAYS = 30
+
+
+@socketio.on('reload_dashboard')
+@read_only
+def handle_reload_dashboard():
+    if not is_admin():
+        return
+    users = db.session.execute(
+        select(User.id, User.username, User.email, UserStat.open_complaints)
+        .join(User, UserStat.id_user == User.id).where(UserStat.open_complaints > 0)
+        .order_by(UserStat.open_complaints.desc()).limit(DASHBOARD_TOP)).all()
+    listings = db.session.execute(
+        select(RentOutStat.id_rent_out, Item.name, RentOutStat.rentals, RentOutStat.complaints)
+        .join(RentOut, RentOutStat.id_rent_out == RentOut.id_rent_out).join(Item, RentOut.id_item == Item.id_item)
+        .where(RentOutStat.complaints > 0).order_by(RentOutStat.complaints.desc()).limit(DASHBOARD_TOP)).all()
+    days = db.session.execute(
+        select(CategoryDayStat.day, CategoryDayStat.category, CategoryDayStat.rentals, CategoryDayStat.revenue)
+        .where(CategoryDayStat.day >= date.today() - timedelta(days=DASHBOARD_DAYS))
+        .order_by(CategoryDayStat.day.desc(), CategoryDayStat.category)).all()
+    emit('dashboard', dumps({
+        'users': [a._asdict() for a in users],
+        'listings': [dict(a._asdict(), rate=round(a.complaints / a.rentals, 2) if a.rentals else None)
+                     for a in listings],
+        'days': [a._asdict() for a in days],
+    }))
 
 
 # Обновление страницы с жалобами пользователя
 @socketio.on('reload_my_complaint')
+@read_only
 def handle_reload_my_complaint():
     # Получение всех жалоб текущего пользователя из БД
-    complaint = db.session.query(Complaint, RentIn, RentOut, Item, User) \
-        .join(RentIn, Complaint.id_rent_in == RentIn.id_rent_in) \
-        .join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .join(User, Complaint.id_user == User.id) \
-        .filter(Complaint.id_user == current_user.id)\
-        .order_by(RentIn.id_rent_in.desc()).all()
-    complaint_list = [{'id_rent_in': a.RentIn.id_rent_in,
-                       'id_rent_out': a.RentOut.id_rent_out,
-                       'id_item': a.RentOut.id_item,
-                       'id_complaint': a.Complaint.id_complaint,
-                       'category': a.Item.category,
-                       'description': a.Item.description,
-                       'rent_price': a.Item.rent_price,
-                       'image_url': a.Item.image_url,
-                       'date_rent_start': a.RentIn.date_rent_start,
-                       'date_rent_finish': a.RentIn.date_rent_finish,
-                       'note': a.RentIn.note,
-                       'status': a.RentIn.status,
-                       'status_complaint': a.Complaint.status,
-                       'description_complaint': a.Complaint.description
-                       } for a in complaint]
-    # Упаковка и отправка по адресу
-    complaint_json = json.dumps(complaint_list, default=str)
-    socketio.emit('my_complaint', complaint_json)
+    emit('my_complaint', VIEWS['my_complaint'].json(id_user=current_user.id))
 
 
 # Обновление статуса жалобы
@@ -477,82 +2794,93 @@ def handle_resolved(id_complaint):
     if complaint.status == "рассматривается":
         complaint.status = "жалоба закрыта"
         db.session.commit()
-        socketio.emit('connect')
+        notify(ADMIN_ROOM, user_room(complaint.id_user))
 
 
 # Удаление объявление
 @socketio.on('del_rent_out')
 def handle_del_rent_out(id_rent_out):
-    rent_out = RentOut.query.get(id_rent_out)
-    bags = Bag.query.filter(Bag.id_rent_out == id_rent_out).all()
-    for b in bags:
-        db.session.delete(b)
-    db.session.commit()
-    rent_out.status = "удалено"
-    db.session.commit()
-    socketio.emit('connect')
+    removed = remove_listings([id_rent_out])
+    notify(CATALOG_ROOM, ADMIN_ROOM, user_room(current_user.id), *(user_room(a.id_user) for a in removed))
+
+
+# Удаление нескольких объявлений модератором
+@socketio.on('del_rent_out_many')
+def handle_del_rent_out_many(data):
+    if not is_admin():
+        return
+    removed = remove_listings([int(id_rent_out) for id_rent_out in json.loads(data)])
+    notify(CATALOG_ROOM, ADMIN_ROOM, *(user_room(a.id_user) for a in removed))
+
+
+# Восстановление нескольких удалённых объявлений модератором
+@socketio.on('restore_rent_out_many')
+def handle_restore_rent_out_many(data):
+    if not is_admin():
+        return
+    restored = restore_listings([int(id_rent_out) for id_rent_out in json.loads(data)])
+    notify(CATALOG_ROOM, ADMIN_ROOM, *(user_room(a.id_user) for a in restored))
+
+
+# Обновление списка удалённых объявлений на странице модерации
+@socketio.on('reload_deleted')
+def handle_reload_deleted():
+    if not is_admin():
+        return
+    emit('deleted', VIEWS['deleted'].json())
 
 
 # Обновление страницы с объявлениями текущего пользователя
 @socketio.on('reload_my_rent_out')
+@read_only
 def handle_reload_my_rent_out():
     # Получение всех действующих объявлений текущего пользователя из БД
-    catalog = db.session.query(RentOut, Item).join(Item, RentOut.id_item == Item.id_item) \
-        .filter(RentOut.id_user == current_user.id, RentOut.status != "удалено") \
-        .order_by(RentOut.id_rent_out.desc()).all()
-    catalog_list = [{'id_rent_out': a.RentOut.id_rent_out,
-                     'id_item': a.RentOut.id_item,
-                     'name': a.Item.name,
-                     'category': a.Item.category,
-                     'description': a.Item.description,
-                     'rent_price': a.Item.rent_price,
-                     'image_url': a.Item.image_url
-                     } for a in catalog]
-    # Упаковка и отправка по указанному адресу
-    catalog_json = json.dumps(catalog_list)
-    socketio.emit('my_rent_out', catalog_json)
-
-
-# Функция добавления объявления в избранные объявления
+    emit('my_rent_out', VIEWS['my_rent_out'].json(id_user=current_user.id))
+
+
+# Функция добавления объявления в избранные объявления; повторное добавление ничего не меняет
 @socketio.on('add_bag')
 def handle_add_bag(id_rent_out):
+    if not current_user.is_authenticated:
+        return
     id_user = current_user.id
-    id_rent_out = id_rent_out
-    bag = Bag(id_user=id_user, id_rent_out=id_rent_out)
-    db.session.add(bag)
+    id_bag = db.session.scalar(
+        insert_on_conflict(db.engine.dialect, Bag).values(id_user=id_user, id_rent_out=int(id_rent_out))
+        .on_conflict_do_nothing(index_elements=['id_user', 'id_rent_out']).returning(Bag.id_bag))
     db.session.commit()
-    socketio.emit('connect')
+    if id_bag is None:
+        return
+    invalidate_favorites([id_user])
+    publish(id_user, [changed('bag', id_user, id_bag, 'added')])
 
 
-# Функция удаления объявления из избранных объявлений
+# Функция удаления объявления из избранных объявлений текущего пользователя
 @socketio.on('del_bag')
 def handle_del_bag(id_bag):
-    bag = Bag.query.get(id_bag)
-    db.session.delete(bag)
+    id_user = current_user.id
+    bag = db.session.execute(delete(Bag).where(Bag.id_bag == id_bag, Bag.id_user == id_user)
+                             .returning(Bag.id_bag)).first()
     db.session.commit()
-    socketio.emit('connect')
+    if bag is None:
+        return
+    invalidate_favorites([id_user])
+    publish(id_user, [{'view': 'bag', 'op': 'removed', 'key': bag.id_bag}])
+
+
+# Объявления в избранном текущего пользователя для отметки в каталоге
+@socketio.on('reload_favorites')
+@read_only
+def handle_reload_favorites():
+    if current_user.is_authenticated:
+        emit('favorites', dumps(sorted(favorites(current_user.id))))
 
 
 # Обновление страницы с избранными объявлениями
 @socketio.on('reload_bag')
-def handle_reload_bag():
-    # Получение из БД всех активных объявлений из избранных
-    bag = db.session.query(Bag, RentOut, Item).join(RentOut, Bag.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .filter(Bag.id_user == current_user.id, RentOut.status == "активно") \
-        .order_by(Bag.id_bag.desc()).all()
-    bags = [{'id_bag': a.Bag.id_bag,
-             'id_rent_out': a.RentOut.id_rent_out,
-             'id_item': a.RentOut.id_item,
-             'name': a.Item.name,
-             'category': a.Item.category,
-             'description': a.Item.description,
-             'rent_price': a.Item.rent_price,
-             'image_url': a.Item.image_url
-             } for a in bag]
-    # Упаковка и отправка на указанный адрес
-    bags_json = json.dumps(bags)
-    socketio.emit('bag', bags_json)
+@read_only
+def handle_reload_bag(data=None):
+    # Изменения избранного после версии клиента или все активные объявления из избранного
+    emit_view('bag', data)
 
 
 # Создание заявки на аренду
@@ -561,38 +2889,71 @@ def handle_add_rent_in(data):
     #  Распаковка данных с клиента
     data_json = json.loads(data)
     status = 'подана'
-    date_rent_start = data_json['date_rent_start']
-    date_rent_finish = data_json['date_rent_finish']
+    date_rent_start = parse_datetime(data_json['date_rent_start'])
+    date_rent_finish = parse_datetime(data_json['date_rent_finish'])
     note = data_json['note']
     id_rent_out = data_json['id_rent_out']
     id_user = current_user.id
+    # Проверка периода аренды
+    if not date_rent_start or not date_rent_finish or date_rent_start >= date_rent_finish:
+        emit('add_rent_in_error', "Дата окончания аренды должна быть позже даты начала.")
+        return
+    # Объявление проверяется до записи заявки: на удалённое или снятое объявление заявка не создаётся
+    rent_out = RentOut.query.get(id_rent_out)
+    if rent_out is None or rent_out.status != "активно":
+        emit('add_rent_in_error', "Объявление не найдено или снято с публикации.")
+        return
+    if not is_free(id_rent_out, date_rent_start, date_rent_finish):
+        emit('add_rent_in_error', "Предмет уже забронирован на выбранный период.")
+        return
     # Создание экземпляра класса и запись в БД
     rent_in = RentIn(status=status, date_rent_start=date_rent_start, date_rent_finish=date_rent_finish, note=note,
                      id_rent_out=id_rent_out, id_user=id_user)
     db.session.add(rent_in)
     db.session.commit()
 
-    socketio.emit('connect')
+    emit('add_rent_in_success')
+    publish_rent_in(rent_in, rent_out.id_user, None)
+
+
+# Забронированные периоды объявления, которые ещё не закончились
+@socketio.on('availability')
+@read_only
+def handle_availability(id_rent_out):
+    busy = db.session.query(RentIn.date_rent_start, RentIn.date_rent_finish) \
+        .filter(RentIn.id_rent_out == id_rent_out, RentIn.status.in_(BOOKED_STATUSES),
+                RentIn.date_rent_finish > datetime.now()) \
+        .order_by(RentIn.date_rent_start).all()
+    emit('availability', json.dumps([{'date_rent_start': a.date_rent_start.isoformat(timespec='minutes'),
+                                      'date_rent_finish': a.date_rent_finish.isoformat(timespec='minutes')
+                                      } for a in busy]))
 
 
 # Функция удаления заявки
 @socketio.on('del_rent_in')
 def handle_del_rent_in(id_rent_in):
     rent_in = RentIn.query.get(id_rent_in)
+    rent_out = RentOut.query.get(rent_in.id_rent_out)
+    status = rent_in.status
     db.session.delete(rent_in)
     db.session.commit()
-    socketio.emit('connect')
+    booking_calendar.remove(rent_in.id_rent_out, rent_in.id_rent_in)
+    publish_rent_in(rent_in, rent_out.id_user, status, deleted=True)
 
 
 # Функция одобрения заявки
 @socketio.on('approve')
 def handle_approve(id_rent_in, id_rent_out):
     rent_in = RentIn.query.get(id_rent_in)
-    rent_out = RentOut.query.get(id_rent_out)
-    rent_out.status = "неактивно"
-    rent_in.status = "одобрена"
-    db.session.commit()
-    socketio.emit('connect')
+    if rent_in.status != "подана":
+        return
+    rent_out = RentOut.query.get(rent_in.id_rent_out)
+    # Объявление остаётся в каталоге: одобренная заявка занимает только свой период
+    if not book(rent_in):
+        emit('approve_error', "Период заявки пересекается с уже одобренной арендой.")
+        return
+    bookings_changed(rent_in)
+    publish_rent_in(rent_in, rent_out.id_user, "подана")
 
 
 # Функция изменения статуса аренды при начале аренды
@@ -600,9 +2961,10 @@ def handle_approve(id_rent_in, id_rent_out):
 def handle_rent_start(id_rent_in):
     rent_in = RentIn.query.get(id_rent_in)
     if rent_in.status == "одобрена":
+        rent_out = RentOut.query.get(rent_in.id_rent_out)
         rent_in.status = "в аренде"
         db.session.commit()
-        socketio.emit('connect')
+        publish_rent_in(rent_in, rent_out.id_user, "одобрена")
 
 
 # Функция изменения статуса аренды при конце аренды
@@ -611,185 +2973,319 @@ def handle_rent_finish(id_rent_in, id_rent_out):
     rent_in = RentIn.query.get(id_rent_in)
     if rent_in.status == "в аренде":
         rent_out = RentOut.query.get(id_rent_out)
-        rent_out.status = "активно"
+        # Объявления, скрытые из каталога при одобрении до появления календаря, возвращаются в каталог
+        reactivated = rent_out.status == "неактивно"
+        if reactivated:
+            rent_out.status = "активно"
         rent_in.status = "аренда завершена"
         db.session.commit()
-        socketio.emit('connect')
+        booking_calendar.remove(rent_in.id_rent_out, rent_in.id_rent_in)
+        if reactivated:
+            invalidate_catalog()
+            notify(CATALOG_ROOM)
+        else:
+            bookings_changed(rent_in)
+        publish_rent_in(rent_in, rent_out.id_user, "в аренде")
+        # Вернувшееся в каталог объявление снова показывается в избранном
+        if reactivated:
+            for b in Bag.query.filter(Bag.id_rent_out == id_rent_out).all():
+                publish(b.id_user, [changed('bag', b.id_user, b.id_bag, 'added')])
 
 
 # Обновление данных на странице исходящих заявок текущего пользователя
 @socketio.on('reload_outgoing')
-def handle_reload_outgoing():
+@read_only
+def handle_reload_outgoing(data=None):
     # Получение всех действующих исходящих заявок пользователя из БД
-    outgoing = db.session.query(RentIn, RentOut, Item).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .filter(RentIn.id_user == current_user.id, RentIn.status == "подана") \
-        .order_by(RentIn.id_rent_in.desc()).all()
-    outgoings = [{'id_rent_in': a.RentIn.id_rent_in,
-                  'id_rent_out': a.RentOut.id_rent_out,
-                  'id_item': a.RentOut.id_item,
-                  'name': a.Item.name,
-                  'category': a.Item.category,
-                  'description': a.Item.description,
-                  'rent_price': a.Item.rent_price,
-                  'image_url': a.Item.image_url,
-                  'date_rent_start': a.RentIn.date_rent_start,
-                  'date_rent_finish': a.RentIn.date_rent_finish,
-                  'note': a.RentIn.note,
-                  'status': a.RentIn.status
-                  } for a in outgoing]
-    # Упаковка и отправка на указанный адрес
-    outgoings_json = json.dumps(outgoings)
-    socketio.emit('outgoing', outgoings_json)
+    emit_view('outgoing', data)
 
 
 # Обновление данных на странице входящих заявок текущего пользователя
 @socketio.on('reload_incoming')
-def handle_reload_incoming():
+@read_only
+def handle_reload_incoming(data=None):
     # Получение всех действующих входящих заявок пользователя из БД
-    incoming = db.session.query(RentIn, RentOut, Item, User).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .join(User, RentIn.id_user == User.id) \
-        .filter(RentOut.id_user == current_user.id, RentIn.status == "подана") \
-        .order_by(RentIn.id_rent_in.desc()).all()
-    incomings = [{'id_rent_in': a.RentIn.id_rent_in,
-                  'id_rent_out': a.RentOut.id_rent_out,
-                  'id_item': a.RentOut.id_item,
-                  'username': a.User.username,
-                  'phone': a.User.phone,
-                  'email': a.User.email,
-                  'name': a.Item.name,
-                  'category': a.Item.category,
-                  'description': a.Item.description,
-                  'rent_price': a.Item.rent_price,
-                  'image_url': a.Item.image_url,
-                  'date_rent_start': a.RentIn.date_rent_start,
-                  'date_rent_finish': a.RentIn.date_rent_finish,
-                  'note': a.RentIn.note,
-                  'status': a.RentIn.status
-                  } for a in incoming]
-    # Упаковка и отправка на указанный адрес
-    incomings_json = json.dumps(incomings)
-    socketio.emit('incoming', incomings_json)
+    emit_view('incoming', data)
 
 
 # Обновление данных страницы сданных предметов текущего пользователя
 @socketio.on('reload_notirent')
-def handle_reload_notirent():
+@read_only
+def handle_reload_notirent(data=None):
     # Получение из БД записей текущих сдач в аренду пользователя
-    notirent = db.session.query(RentIn, RentOut, Item, User).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .join(User, RentIn.id_user == User.id) \
-        .filter(RentOut.id_user == current_user.id, or_(RentIn.status == "одобрена", RentIn.status == "в аренде")) \
-        .order_by(RentIn.id_rent_in.desc()).all()
-    notirents = [{'id_rent_in': a.RentIn.id_rent_in,
-                  'id_rent_out': a.RentOut.id_rent_out,
-                  'id_item': a.RentOut.id_item,
-                  'username': a.User.username,
-                  'phone': a.User.phone,
-                  'email': a.User.email,
-                  'name': a.Item.name,
-                  'category': a.Item.category,
-                  'description': a.Item.description,
-                  'rent_price': a.Item.rent_price,
-                  'image_url': a.Item.image_url,
-                  'date_rent_start': a.RentIn.date_rent_start,
-                  'date_rent_finish': a.RentIn.date_rent_finish,
-                  'note': a.RentIn.note,
-                  'status': a.RentIn.status
-                  } for a in notirent]
-    # Упаковка и отправка на указанный адрес
-    notirents_json = json.dumps(notirents)
-    socketio.emit('notirent', notirents_json)
+    emit_view('notirent', data)
 
 
 # Обновление данных страницы взятых в аренду предметов текущим пользователем
 @socketio.on('reload_irent')
-def handle_reload_irent():
-    irent = db.session.query(RentIn, RentOut, Item, User).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .join(User, RentOut.id_user == User.id) \
-        .filter(RentIn.id_user == current_user.id, or_(RentIn.status == "одобрена", RentIn.status == "в аренде")) \
-        .order_by(RentIn.id_rent_in.desc()).all()
-    irents = [{'id_rent_in': a.RentIn.id_rent_in,
-               'id_rent_out': a.RentOut.id_rent_out,
-               'id_item': a.RentOut.id_item,
-               'username': a.User.username,
-               'phone': a.User.phone,
-               'email': a.User.email,
-               'name': a.Item.name,
-               'category': a.Item.category,
-               'description': a.Item.description,
-               'rent_price': a.Item.rent_price,
-               'image_url': a.Item.image_url,
-               'date_rent_start': a.RentIn.date_rent_start,
-               'date_rent_finish': a.RentIn.date_rent_finish,
-               'note': a.RentIn.note,
-               'status': a.RentIn.status
-               } for a in irent]
-    # Упаковка и отправка на указанный адрес
-    irents_json = json.dumps(irents)
-    socketio.emit('irent', irents_json)
+@read_only
+def handle_reload_irent(data=None):
+    # Получение из БД действующих аренд пользователя
+    emit_view('irent', data)
+
+
+# Преобразование даты из фильтра клиента
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Отправка страницы истории view: data — диапазон дат окончания аренды (date_from и date_to включительно)
+# и курсор (окончание аренды и номер последней заявки предыдущей страницы) или версия первой страницы без фильтров,
+# встроенной в страницу: тогда отправляются только изменения после неё
+def emit_history(view, data):
+    params = json.loads(data) if data else {}
+    changes = change_log.since(view, current_user.id, params.get('epoch'), params.get('version'))
+    if changes is not None:
+        emit('delta', dumps(changes))
+        return
+    emit(view, history_json(view, params))
+
+
+# Страница истории view текущего пользователя с версией списка
+def history_json(view, params):
+    date_from, date_to = parse_date(params.get('date_from')), parse_date(params.get('date_to'))
+    cursor = params.get('cursor')
+    try:
+        cursor_date, cursor_id = parse_datetime(cursor[0]), int(cursor[1])
+    except (TypeError, ValueError, IndexError, KeyError):
+        cursor_date, cursor_id = None, None
+    first = cursor_date is None
+    version = change_log.version(view, current_user.id)
+    rows = HISTORY_PAGES[view].rows(
+        id_user=current_user.id,
+        date_from=datetime.combine(date_from, datetime.min.time()) if date_from else FIRST_DATE,
+        date_to=datetime.combine(date_to + timedelta(days=1), datetime.min.time()) if date_to else LAST_DATE,
+        cursor_date=LAST_DATE if first else cursor_date, cursor_id=FIRST_PAGE_CURSOR if first else cursor_id)
+    has_next = len(rows) > HISTORY_PAGE_SIZE
+    rows = rows[:HISTORY_PAGE_SIZE]
+    return dumps({'epoch': change_log.epoch, 'version': version, 'date_from': date_from, 'date_to': date_to,
+                  'first': first, 'cursor': [rows[-1].date_rent_finish, rows[-1].id_rent_in] if has_next else None,
+                  'items': HISTORY_PAGES[view].items(rows)})
 
 
 # Обновление страницы истории взятия в аренду предметов текущим пользователем
 @socketio.on('reload_irent_history')
-def handle_reload_irent_history():
-    irent = db.session.query(RentIn, RentOut, Item, User).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .join(User, RentOut.id_user == User.id) \
-        .filter(RentIn.id_user == current_user.id, RentIn.status == "аренда завершена") \
-        .order_by(RentIn.id_rent_in.desc()).all()
-    irents = [{'id_rent_in': a.RentIn.id_rent_in,
-               'id_rent_out': a.RentOut.id_rent_out,
-               'id_item': a.RentOut.id_item,
-               'username': a.User.username,
-               'phone': a.User.phone,
-               'email': a.User.email,
-               'name': a.Item.name,
-               'category': a.Item.category,
-               'description': a.Item.description,
-               'rent_price': a.Item.rent_price,
-               'image_url': a.Item.image_url,
-               'date_rent_start': a.RentIn.date_rent_start,
-               'date_rent_finish': a.RentIn.date_rent_finish,
-               'note': a.RentIn.note,
-               'status': a.RentIn.status
-               } for a in irent]
-    # Упаковка и отправка на указанный адрес
-    irents_json = json.dumps(irents)
-    socketio.emit('irent_history', irents_json)
+@read_only
+def handle_reload_irent_history(data=None):
+    # Получение из БД страницы завершённых аренд пользователя
+    emit_history('irent_history', data)
 
 
 # Обновление страницы истории сдачи в аренду предметов текущим пользователем
 @socketio.on('reload_notirent_history')
-def handle_reload_notirent_history():
-    notirent = db.session.query(RentIn, RentOut, Item, User).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
-        .join(Item, RentOut.id_item == Item.id_item) \
-        .join(User, RentIn.id_user == User.id) \
-        .filter(RentOut.id_user == current_user.id, RentIn.status == "аренда завершена") \
-        .order_by(RentIn.id_rent_in.desc()).all()
-    notirents = [{'id_rent_in': a.RentIn.id_rent_in,
-                  'id_rent_out': a.RentOut.id_rent_out,
-                  'id_item': a.RentOut.id_item,
-                  'username': a.User.username,
-                  'phone': a.User.phone,
-                  'email': a.User.email,
-                  'name': a.Item.name,
-                  'category': a.Item.category,
-                  'description': a.Item.description,
-                  'rent_price': a.Item.rent_price,
-                  'image_url': a.Item.image_url,
-                  'date_rent_start': a.RentIn.date_rent_start,
-                  'date_rent_finish': a.RentIn.date_rent_finish,
-                  'note': a.RentIn.note,
-                  'status': a.RentIn.status
-                  } for a in notirent]
-    # Упаковка и отправка на указанный адрес
-    notirents_json = json.dumps(notirents)
-    socketio.emit('notirent_history', notirents_json)
+@read_only
+def handle_reload_notirent_history(data=None):
+    # Получение из БД страницы завершённых сдач в аренду пользователя
+    emit_history('notirent_history', data)
+
+
+# Фоновые задачи: переходы заявок по времени и очистка. Задача обрабатывает пачку не больше JOB_BATCH_SIZE строк
+# в отдельной транзакции, чтобы не держать блокировки горячих таблиц, и идемпотентна: строки выбираются по условию,
+# которое обработка перестаёт выполнять, поэтому повторный или параллельный запуск ничего не меняет дважды.
+# Задачи выполняются в процессе приложения каждые JOBS_INTERVAL секунд (0 — не выполняются)
+# или отдельным процессом: flask --app app run-jobs --loop
+JOBS_INTERVAL = float(os.getenv('JOBS_INTERVAL', 60))
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', 500))
+# Число пачек одной задачи за запуск; оставшиеся строки обрабатываются при следующем запуске
+JOB_MAX_BATCHES = int(os.getenv('JOB_MAX_BATCHES', 20))
+# Заявка «подана», не одобренная через это время после начала периода аренды, истекает
+RENT_REQUEST_GRACE = timedelta(hours=float(os.getenv('RENT_REQUEST_GRACE_HOURS', 24)))
+# Завершённые аренды и истёкшие заявки переносятся в архив через это время после окончания периода аренды
+ARCHIVE_AFTER = timedelta(days=float(os.getenv('ARCHIVE_AFTER_DAYS', 90)))
+
+# Задачи по названию: задача обрабатывает одну пачку не больше limit строк и возвращает число выбранных строк
+JOBS = {}
+
+
+def job(fn):
+    JOBS[fn.__name__] = fn
+    return fn
+
+
+# Истечение заявок «подана», не одобренных через RENT_REQUEST_GRACE после начала периода аренды
+@job
+def expire_requests(limit):
+    rows = db.session.execute(
+        select(RentIn.id_rent_in, RentOut.id_user).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out)
+        .where(RentIn.status == "подана", RentIn.date_rent_start < datetime.now() - RENT_REQUEST_GRACE)
+        .order_by(RentIn.date_rent_start).limit(limit)).all()
+    owners = dict(rows)
+    if not owners:
+        return 0
+    # Статус проверяется повторно: заявку могли одобрить после выборки
+    expired = db.session.execute(
+        update(RentIn).where(RentIn.id_rent_in.in_(list(owners)), RentIn.status == "подана")
+        .values(status="заявка истекла").returning(RentIn.id_rent_in, RentIn.id_user, RentIn.status)).all()
+    db.session.commit()
+    for rent_in in expired:
+        publish_rent_in(rent_in, owners[rent_in.id_rent_in], "подана")
+    return len(rows)
+
+
+# Отметка аренд, предмет которых не вернули после окончания периода аренды
+@job
+def mark_overdue(limit):
+    rows = db.session.execute(
+        select(RentIn.id_rent_in, RentOut.id_user).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out)
+        .where(RentIn.status == "в аренде", RentIn.date_rent_finish < datetime.now(), RentIn.overdue == false())
+        .order_by(RentIn.date_rent_finish).limit(limit)).all()
+    owners = dict(rows)
+    if not owners:
+        return 0
+    marked = db.session.execute(
+        update(RentIn).where(RentIn.id_rent_in.in_(list(owners)), RentIn.status == "в аренде",
+                             RentIn.overdue == false())
+        .values(overdue=True).returning(RentIn.id_rent_in, RentIn.id_user, RentIn.status)).all()
+    db.session.commit()
+    for rent_in in marked:
+        publish_rent_in(rent_in, owners[rent_in.id_rent_in], rent_in.status)
+    return len(rows)
+
+
+# Удаление избранного, оставшегося от удалённых объявлений (например, удалённых до того, как удаление объявления
+# стало очищать избранное)
+@job
+def purge_bags(limit):
+    ids = db.session.scalars(select(Bag.id_bag).join(RentOut, Bag.id_rent_out == RentOut.id_rent_out)
+                             .where(RentOut.status == "удалено").limit(limit)).all()
+    if not ids:
+        return 0
+    bags = db.session.execute(delete(Bag).where(Bag.id_bag.in_(ids)).returning(Bag.id_bag, Bag.id_user)).all()
+    db.session.commit()
+    invalidate_favorites(b.id_user for b in bags)
+    changes = {}
+    for b in bags:
+        changes.setdefault(b.id_user, []).append({'view': 'bag', 'op': 'removed', 'key': b.id_bag})
+    for id_user, user_changes in changes.items():
+        publish(id_user, user_changes)
+    return len(ids)
+
+
+# Месяцы, секции архива которых уже созданы этим процессом
+archive_partitions = set()
+
+
+# Создание в PostgreSQL секций архива для месяцев months (год, месяц)
+def create_archive_partitions(months):
+    for year, month in sorted(set(months) - archive_partitions):
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS rent_in_archive_%04d_%02d PARTITION OF rent_in_archive "
+            "FOR VALUES FROM ('%s') TO ('%s')" % (year, month, date(year, month, 1),
+                                                  date(year + month // 12, month % 12 + 1, 1))))
+
+
+# Перенос в архив завершённых аренд и истёкших заявок, окончившихся раньше ARCHIVE_AFTER. Заявки с жалобами
+# остаются в rent_in: на них ссылаются жалобы. Строки удаляются из rent_in и вставляются в архив в одной
+# транзакции; списки пользователей не меняются, поэтому изменения не рассылаются
+@job
+def archive_history(limit):
+    archived = and_(RentIn.status.in_(RENTER_HISTORY_STATUSES),
+                    RentIn.date_rent_finish < datetime.now() - ARCHIVE_AFTER,
+                    ~exists().where(Complaint.id_rent_in == RentIn.id_rent_in))
+    rows = db.session.execute(
+        select(RentIn.id_rent_in, RentOut.id_user).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out)
+        .where(archived).order_by(RentIn.date_rent_finish).limit(limit)).all()
+    owners = dict(rows)
+    if not owners:
+        return 0
+    moved = db.session.execute(
+        delete(RentIn).where(RentIn.id_rent_in.in_(list(owners)), archived)
+        .returning(RentIn.id_rent_in, RentIn.status, RentIn.date_rent_start, RentIn.date_rent_finish, RentIn.note,
+                   RentIn.overdue, RentIn.id_user, RentIn.id_rent_out)).all()
+    months = {(a.date_rent_finish.year, a.date_rent_finish.month) for a in moved}
+    if moved:
+        if db.engine.dialect.name == 'postgresql':
+            create_archive_partitions(months)
+        db.session.execute(insert(RentInArchive), [
+            dict(a._mapping, id_owner=owners[a.id_rent_in]) for a in moved])
+    db.session.commit()
+    archive_partitions.update(months)
+    return len(rows)
+
+
+# Выполнение задачи пачками, пока пачки заполнены, но не больше JOB_MAX_BATCHES пачек; возвращает число строк.
+# В PostgreSQL пачку выполняет один процесс: остальные процессы пропускают задачу, пока её держит блокировка
+def run_job(name):
+    total = 0
+    start = time.perf_counter()
+    for _ in range(JOB_MAX_BATCHES):
+        if db.engine.dialect.name == 'postgresql' and not db.session.scalar(
+                select(func.pg_try_advisory_xact_lock(zlib.crc32(name.encode())))):
+            db.session.rollback()
+            break
+        count = JOBS[name](JOB_BATCH_SIZE)
+        # Завершение транзакции пустой пачки снимает блокировку
+        db.session.commit()
+        total += count
+        if count < JOB_BATCH_SIZE:
+            break
+    metrics.observe(('job', name), time.perf_counter() - start)
+    metrics.add('app_job_rows_total', ('job', name), total)
+    return total
+
+
+# Выполнение всех задач; возвращает число обработанных строк каждой задачи
+def run_jobs():
+    counts = {}
+    for name in JOBS:
+        try:
+            counts[name] = run_job(name)
+        except Exception:
+            db.session.rollback()
+            metrics.add('app_handler_errors_total', ('job', name))
+            app.logger.exception("Ошибка фоновой задачи %s", name)
+    return counts
+
+
+def jobs_loop():
+    while True:
+        socketio.sleep(JOBS_INTERVAL)
+        with app.app_context():
+            run_jobs()
+
+
+scheduler = {'started': False}
+scheduler_lock = threading.Lock()
+
+
+# Запуск фоновых задач при первом запросе к процессу: в рабочих процессах сервера, но не в командах flask
+@app.before_request
+def start_scheduler():
+    if not JOBS_INTERVAL or scheduler['started']:
+        return
+    with scheduler_lock:
+        if scheduler['started']:
+            return
+        scheduler['started'] = True
+    # Поток режима threading не должен задерживать завершение процесса
+    if ASYNC_MODE == 'threading':
+        threading.Thread(target=jobs_loop, name='jobs', daemon=True).start()
+    else:
+        socketio.start_background_task(jobs_loop)
+
+
+@app.cli.command('run-jobs')
+@click.option('--loop', is_flag=True, help="Повторять каждые JOBS_INTERVAL секунд")
+def run_jobs_command(loop):
+    create_app()
+    while True:
+        for name, count in run_jobs().items():
+            if count or not loop:
+                click.echo("%s: %d" % (name, count))
+        if not loop:
+            break
+        time.sleep(JOBS_INTERVAL or 60)
+
+
+instrument_handlers()
+limit_handlers()
 
 
 # Обработчик запуска сервера
+# Для промышленного запуска используется gunicorn с настройками из gunicorn.conf.py
 if __name__ == '__main__':
-    socketio.run(app, allow_unsafe_werkzeug=True)
+    socketio.run(create_app(), host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 5000)),
+                 allow_unsafe_werkzeug=True)
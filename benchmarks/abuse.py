@@ -0,0 +1,144 @@
+# Задержки событий обычных клиентов, пока другие клиенты засыпают сервер событиями (reload_my_rent_out,
+# reload_complaint, reload_bag, add_bag) во много раз чаще лимита: без нагрузки, под нагрузкой с ограничением
+# частоты и объединением повторов reload_* и под той же нагрузкой без них. Нарушители — несколько вкладок
+# одного пользователя (ограничение пользователя) и отдельные пользователи (ограничение соединения).
+# Код возврата 1, если p50 обычных клиентов под нагрузкой с ограничениями больше, чем без нагрузки, в --max-ratio
+# раз. Клиенты замера работают в потоках одного процесса с сервером и делят с ним GIL: p99 включает разбор
+# клиентами замера пропущенных ответов нарушителей, поэтому он сравнивается только с замером без ограничений
+# Запуск: python benchmarks/abuse.py --clients 10 --abusers 8 --duration 5
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Ограничения включены, как на сервере по умолчанию (common.py выключает их для остальных замеров).
+# Клиенты работают в потоках, поэтому БД — файл SQLite, а не общее соединение с БД в памяти
+os.environ.setdefault('SOCKET_EVENT_RATE', '10')
+os.environ.setdefault('SOCKET_USER_EVENT_RATE', '20')
+os.environ.setdefault('RELOAD_DEBOUNCE_MS', '250')
+os.environ.setdefault('DB_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'abuse.db'))
+
+from common import app, db
+from sqlalchemy import update
+import app as application
+from app import User, metrics
+import suite
+
+ABUSE_EVENTS = ('reload_my_rent_out', 'reload_complaint', 'reload_bag', 'add_bag')
+
+
+# Обычный клиент: список избранного, страница каталога и исходящие заявки раз в interval секунд
+def well_behaved(browser, rng, interval, stop, latencies):
+    # Клиенты начинают в разное время, чтобы не отправлять события одновременно
+    stop.wait(rng.random() * interval)
+    while not stop.is_set():
+        for name, args in (('reload_bag', ()), ('reload_outgoing', ()),
+                           ('catalog_page', ('{"category": "%s"}' % rng.choice(suite.CATEGORIES),))):
+            start = time.perf_counter()
+            browser.socket.emit(name, *args)
+            latencies.append(time.perf_counter() - start)
+        browser.socket.get_received()
+        stop.wait(interval)
+
+
+# Нарушитель: события раз в interval секунд (во много раз чаще лимита) без ожидания ответа.
+# Клиенты замера работают в одном процессе с сервером, поэтому без паузы нарушители заняли бы GIL
+def abuser(browser, rng, listings, interval, stop, sent):
+    while not stop.is_set():
+        name = rng.choice(ABUSE_EVENTS)
+        if name == 'add_bag':
+            browser.socket.emit(name, rng.choice(listings))
+        else:
+            browser.socket.emit(name)
+        sent[0] += 1
+        if sent[0] % 100 == 0:
+            browser.socket.get_received()
+        stop.wait(interval)
+
+
+def rejected():
+    return sum(value for (name, labels), value in metrics.counters.items()
+               if name in ('app_events_limited_total', 'app_events_merged_total'))
+
+
+# Задержки событий обычных клиентов: медиана и 99-й перцентиль, мс
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies) * 1000, latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000
+
+
+# Один замер: обычные клиенты и (если переданы) нарушители в течение duration секунд
+def phase(name, clients, abusers, listings, args):
+    stop = threading.Event()
+    latencies = []
+    sent = [0]
+    before = rejected()
+    threads = [threading.Thread(target=well_behaved, args=(b, random.Random(n), args.interval, stop, latencies))
+               for n, b in enumerate(clients)]
+    threads += [threading.Thread(target=abuser, args=(b, random.Random(-n - 1), listings, args.abuse_interval,
+                                                      stop, sent)) for n, b in enumerate(abusers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Отложенные вызовы объединённых reload_* завершаются до следующего замера
+    time.sleep(application.RELOAD_DEBOUNCE * 2)
+    p50, p99 = percentiles(latencies)
+    print('%-20s %8d %10.3f %10.3f %12d %10d' % (name, len(latencies), p50, p99, sent[0], rejected() - before))
+    return p50, p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--rentals', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=10, help='число обычных клиентов')
+    parser.add_argument('--abusers', type=int, default=8, help='число соединений нарушителей')
+    parser.add_argument('--interval', type=float, default=0.5, help='пауза обычного клиента между запросами, с')
+    parser.add_argument('--abuse-interval', type=float, default=0.005, help='пауза нарушителя между событиями, с')
+    parser.add_argument('--duration', type=float, default=5, help='длительность каждого замера, с')
+    parser.add_argument('--max-ratio', type=float, default=2, help='допустимый рост задержек обычных клиентов')
+    parser.add_argument('--min-ms', type=float, default=2, help='рост задержки меньше этого не считается, мс')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    seed = argparse.Namespace(seed=args.seed, users=args.users, items=args.items, rentals=args.rentals,
+                              bags=args.rentals // 4, complaints=args.rentals // 10)
+    user_ids, owned = suite.seed(seed)
+    listings = [id_rent_out for ids in owned.values() for id_rent_out in ids]
+    # Половина нарушителей — вкладки администратора (reload_complaint читает очередь жалоб), остальные — отдельные
+    # пользователи
+    with app.app_context():
+        db.session.execute(update(User).where(User.id == user_ids[0]).values(role="администратор"))
+        db.session.commit()
+    tabs = args.abusers // 2
+    abusers = [suite.Browser(user_ids[0], "user0@example.com") for _ in range(tabs)]
+    abusers += [suite.Browser(user_ids[1 + n], "user%d@example.com" % (1 + n)) for n in range(args.abusers - tabs)]
+    first = 1 + args.abusers - tabs
+    clients = [suite.Browser(user_ids[first + n], "user%d@example.com" % (first + n)) for n in range(args.clients)]
+
+    print('%-20s %8s %10s %10s %12s %10s' % ('phase', 'events', 'p50 ms', 'p99 ms', 'abuse sent', 'rejected'))
+    # Первые вызовы строят кэши (каталог, индексы поиска) и не учитываются
+    phase('warmup', clients, abusers, listings, argparse.Namespace(**dict(vars(args), duration=1)))
+    quiet = phase('quiet', clients, [], listings, args)
+    limited = phase('abuse, limits', clients, abusers, listings, args)
+    application.socket_limiter.rate = 0
+    application.user_event_limiter.rate = 0
+    application.RELOAD_DEBOUNCE = 0
+    unlimited = phase('abuse, no limits', clients, abusers, listings, args)
+    print('p99 под нагрузкой: %.1f%% от p99 без ограничений' % (limited[1] / unlimited[1] * 100))
+    if limited[0] > quiet[0] * args.max_ratio and limited[0] - quiet[0] > args.min_ms:
+        print('p50 обычных клиентов под нагрузкой %.3f мс, без нагрузки %.3f мс' % (limited[0], quiet[0]))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
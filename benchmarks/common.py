@@ -0,0 +1,48 @@
+# Общие функции скриптов замеров: настройка окружения, пользователи и клиенты socket.io
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('DB_URI', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.gettempdir())
+# Замеры входят под несколькими пользователями с одного адреса и не измеряют стоимость хеширования пароля
+os.environ.setdefault('AUTH_RATE_LIMIT', '0')
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1')
+# Один клиент замера отправляет события быстрее живого пользователя: без ограничения частоты и объединения повторов
+os.environ.setdefault('SOCKET_EVENT_RATE', '0')
+os.environ.setdefault('SOCKET_USER_EVENT_RATE', '0')
+os.environ.setdefault('RELOAD_DEBOUNCE_MS', '0')
+# Фоновые задачи не запускаются сами, чтобы не менять данные во время замера
+os.environ.setdefault('JOBS_INTERVAL', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from app import create_app, socketio, db, User
+
+app = create_app()
+
+PASSWORD = "password"
+
+
+# Создание пользователя с дешёвым хешем пароля, чтобы не замедлять заполнение БД
+def create_user(email, role="клиент"):
+    user = User(username="user", role=role, email=email,
+                hash_password=generate_password_hash(PASSWORD, method=os.environ['PASSWORD_HASH_METHOD']))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+# HTTP-клиент; с email — после входа в систему под этим пользователем
+def login(email=None):
+    http = app.test_client()
+    if email:
+        http.post("/login?next=/", data={"email": email, "password": PASSWORD})
+    return http
+
+
+# Клиент socket.io; с email — после входа в систему под этим пользователем
+# Клиенты работают вне контекста приложения, чтобы у каждого события был собственный current_user
+def connect(email=None):
+    return socketio.test_client(app, flask_test_client=login(email))
@@ -0,0 +1,142 @@
+# Проверка планов запросов: фильтры обработчиков reload_* должны обслуживаться индексами
+# Запуск: python benchmarks/explain_queries.py (DB_URI=postgresql://... для проверки на PostgreSQL)
+# Код возврата 1, если хотя бы один запрос читает таблицу полным сканированием или запрос страницы с курсором
+# сортирует строки вместо чтения индекса в порядке ключа страницы
+import json
+import re
+import sys
+from datetime import datetime
+
+from common import app, db, create_user, connect
+from sqlalchemy import event
+from app import Item, RentOut, RentIn, Bag, Complaint, invalidate_catalog, recommendations, run_job
+
+# Горячие обработчики и их аргументы
+HANDLERS = [
+    ('catalog_page', (json.dumps({'category': "Инструменты", 'sort': "new", 'cursor': None}),)),
+    ('catalog_page', (json.dumps({'sort': "new", 'cursor': [None, 150]}),)),
+    ('catalog_page', (json.dumps({'sort': "price_asc", 'cursor': ["50", 60]}),)),
+    ('catalog_page', (json.dumps({'sort': "price_desc", 'price_min': "20", 'price_max': "150", 'cursor': None}),)),
+    ('catalog_page', (json.dumps({'category': "Спорт", 'sort': "price_asc", 'price_max': "100",
+                                  'cursor': ["50", 60]}),)),
+    ('catalog_page', (json.dumps({'category': "Электроника", 'sort': "price_desc", 'cursor': None}),)),
+    ('reload_my_rent_out', ()),
+    ('reload_bag', ()),
+    ('reload_outgoing', ()),
+    ('reload_incoming', ()),
+    ('reload_notirent', ()),
+    ('reload_irent', ()),
+    ('reload_irent_history', ()),
+    ('reload_irent_history', (json.dumps({'date_from': "2023-01-01", 'date_to': "2023-03-31",
+                                          'cursor': ["2023-03-01T00:00:00", 100]}),)),
+    ('reload_notirent_history', ()),
+    ('reload_notirent_history', (json.dumps({'date_from': "2023-01-01", 'cursor': ["2023-03-01T00:00:00", 100]}),)),
+    ('reload_my_complaint', ()),
+    ('reload_complaint', (json.dumps({'status': "рассматривается", 'cursor': 100}),)),
+    ('reload_dashboard', ()),
+    ('similar', (1,)),
+    ('recommend', ()),
+]
+
+# Страницы с курсором: строки читаются индексом в порядке ключа страницы, без сортировки всех подходящих строк
+KEYSET_HANDLERS = {'catalog_page'}
+CATEGORIES = ("Инструменты", "Спорт", "Электроника")
+
+statements = []
+
+
+def capture(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith("SELECT"):
+        statements.append((statement, parameters))
+
+
+# Заполнение БД объявлениями и заявками во всех статусах; завершённые аренды без жалоб переносятся в архив
+def seed(n_items=200):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        owner = create_user("owner@example.com")
+        renter = create_user("renter@example.com")
+        create_user("admin@example.com", role="администратор")
+        statuses = ("подана", "одобрена", "в аренде", "аренда завершена")
+        for n in range(n_items):
+            item = Item(name="Предмет %d" % n, category=CATEGORIES[n % len(CATEGORIES)], description="",
+                        rent_price=n, image_url="")
+            db.session.add(item)
+            db.session.flush()
+            rent_out = RentOut(status="активно" if n % 3 else "неактивно", id_item=item.id_item, id_user=owner.id,
+                               category=item.category, rent_price=item.rent_price)
+            db.session.add(rent_out)
+            db.session.flush()
+            rent_in = RentIn(status=statuses[n % 4], date_rent_start=datetime(2023, 6, 1),
+                             date_rent_finish=datetime(2023, 6, 2), note="", id_user=renter.id,
+                             id_rent_out=rent_out.id_rent_out)
+            db.session.add(rent_in)
+            db.session.add(Bag(id_user=renter.id, id_rent_out=rent_out.id_rent_out))
+            db.session.flush()
+            db.session.add(Complaint(id_rent_in=rent_in.id_rent_in, id_user=renter.id, description="",
+                                     status="рассматривается"))
+            db.session.add(RentIn(status="аренда завершена", date_rent_start=datetime(2023, 1 + n % 6, 1),
+                                  date_rent_finish=datetime(2023, 1 + n % 6, 2), note="", id_user=renter.id,
+                                  id_rent_out=rent_out.id_rent_out))
+        db.session.commit()
+        run_job('archive_history')
+
+
+# План запроса в виде списка строк
+def explain(conn, statement, parameters):
+    if conn.dialect.name == 'postgresql':
+        return [row[0] for row in conn.exec_driver_sql("EXPLAIN " + statement, parameters)]
+    return [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+# Полное сканирование таблицы без индекса (в SQLite чтение результата подзапроса anon_N — не сканирование таблицы)
+def is_full_scan(line):
+    if "Seq Scan" in line:
+        return True
+    line = line.strip()
+    return line.startswith("SCAN ") and "USING" not in line and not line.startswith("SCAN anon_")
+
+
+# Сортировка строк результата вместо чтения индекса в нужном порядке
+def is_sort(line):
+    return "TEMP B-TREE FOR ORDER BY" in line or re.match(r"\s*(->\s*)?(Incremental )?Sort\b", line) is not None
+
+
+def main():
+    seed()
+    owner = connect("owner@example.com")
+    renter = connect("renter@example.com")
+    admin = connect("admin@example.com")
+    with app.app_context():
+        # Индекс рекомендаций строится один раз по всем арендам, запросы построения не проверяются
+        recommendations.refresh()
+        event.listen(db.engine, 'before_cursor_execute', capture)
+
+    failed = False
+    for name, args in HANDLERS:
+        invalidate_catalog()
+        for client in (owner, renter, admin):
+            statements.clear()
+            client.emit(name, *args)
+            client.get_received()
+            with app.app_context(), db.engine.connect() as conn:
+                if conn.dialect.name == 'postgresql':
+                    # Проверяется, что индекс может обслужить запрос, независимо от размера таблиц
+                    conn.exec_driver_sql("SET enable_seqscan = off")
+                    conn.exec_driver_sql("SET enable_sort = off")
+                for statement, parameters in statements:
+                    plan = explain(conn, statement, parameters)
+                    scans = [line for line in plan if is_full_scan(line)]
+                    if name in KEYSET_HANDLERS:
+                        scans += [line for line in plan if is_sort(line)]
+                    print('%-24s %s' % (name, 'FULL SCAN' if any(map(is_full_scan, scans)) else
+                                        'SORT' if scans else 'ok'))
+                    for line in plan:
+                        print('    ' + line)
+                    failed = failed or bool(scans)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# Проверка сброса кэшей процесса (каталог, бронирования, поиск, избранное, пользователи) между процессами сервера через очередь
+# сообщений socket.io: процесс рассылает сообщение о сбросе после фиксации своего изменения и сбрасывает свои кэши
+# по сообщению другого процесса, не отправляя его клиентам. Второй процесс моделируется отдельным менеджером
+# очереди в памяти (memory://) на том же канале
+# Запуск: python benchmarks/invalidation.py
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+os.environ['SOCKETIO_MESSAGE_QUEUE'] = 'memory://'
+# Вход без пула вычислений: проверка не измеряет хеширование паролей
+os.environ.setdefault('CPU_WORKERS', '0')
+
+from common import app, db, socketio, create_user, login
+import app as application
+from app import MemoryManager, Item, User, search_index
+
+
+def wait(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def main():
+    other = MemoryManager()
+    published = []
+    threading.Thread(target=lambda: published.extend(other._listen()), daemon=True).start()
+    with app.app_context():
+        db.create_all()
+        create_user("user@example.com")
+    http = login("user@example.com")
+    http.get("/catalog")
+    failed = []
+
+    # Изменение в этом процессе: сообщение получают остальные процессы
+    application.invalidate_catalog()
+    if not wait(lambda: any(m.get('data') == ['catalog', []] for m in published)):
+        failed.append("сообщение о сбросе каталога не разослано")
+    # Смена роли: сообщение рассылается только после фиксации транзакции
+    with app.app_context():
+        user = User.query.filter_by(email="user@example.com").one()
+        id_user = user.id
+        user.role = "администратор"
+        db.session.flush()
+        if wait(lambda: any(m.get('data') == ['users', [[id_user]]] for m in published), timeout=0.2):
+            failed.append("сообщение о сбросе пользователя разослано до фиксации")
+        db.session.commit()
+    if not wait(lambda: any(m.get('data') == ['users', [[id_user]]] for m in published)):
+        failed.append("сообщение о сбросе пользователя не разослано")
+
+    # Изменения в другом процессе: кэши этого процесса сбрасываются, клиенты сообщений не получают
+    sent = []
+    send_packet = socketio.server._send_packet
+    socketio.server._send_packet = lambda eio_sid, pkt: (sent.append(pkt.data), send_packet(eio_sid, pkt))
+    http.get("/catalog")
+    if id_user not in application.user_cache:
+        failed.append("пользователь не закэширован")
+    version = application.catalog_cache['version']
+    application.favorites_cache[1] = (time.monotonic() + 60, frozenset())
+    # Страницы с фильтром свободных дат: период пересекается с забронированным и не пересекается с ним
+    booked = ('page', None, None, None, "new", None, datetime(2030, 1, 1), datetime(2030, 1, 3))
+    free = ('page', None, None, None, "new", None, datetime(2030, 2, 1), datetime(2030, 2, 3))
+    application.catalog_cache['pages'].update({booked: '{}', free: '{}'})
+    with app.app_context():
+        search_index.load()
+        item = Item(name="Перфоратор", category="Инструменты", description="", rent_price=1, image_url="")
+        db.session.add(item)
+        db.session.commit()
+        id_item = item.id_item
+    other.emit(application.INVALIDATE_EVENT, ['bookings', ['2030-01-02T10:00:00', '2030-01-04T10:00:00']],
+               namespace='/')
+    if not wait(lambda: booked not in application.catalog_cache['pages']):
+        failed.append("страница с забронированным периодом не сброшена")
+    if free not in application.catalog_cache['pages']:
+        failed.append("сброшена страница с непересекающимся периодом")
+    other.emit(application.INVALIDATE_EVENT, ['catalog', []], namespace='/')
+    other.emit(application.INVALIDATE_EVENT, ['favorites', [[1]]], namespace='/')
+    other.emit(application.INVALIDATE_EVENT, ['search', [[id_item]]], namespace='/')
+    other.emit(application.INVALIDATE_EVENT, ['users', [[id_user]]], namespace='/')
+    if not wait(lambda: application.catalog_cache['version'] > version):
+        failed.append("кэш каталога не сброшен")
+    if not wait(lambda: 1 not in application.favorites_cache):
+        failed.append("кэш избранного не сброшен")
+    if not wait(lambda: id_item in search_index.pending):
+        failed.append("новый предмет не добавлен в индекс поиска")
+    if not wait(lambda: id_user not in application.user_cache):
+        failed.append("кэш пользователя не сброшен")
+    with app.app_context():
+        search_index.load()
+    if id_item not in search_index.search("перфоратор"):
+        failed.append("новый предмет не найден поиском")
+    if sent:
+        failed.append("сообщения отправлены клиентам: %s" % sent)
+
+    for message in failed:
+        print(message)
+    print('ok' if not failed else 'failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
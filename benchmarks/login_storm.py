@@ -0,0 +1,112 @@
+# Задержка событий socket.io во время всплеска входов в систему: с проверкой пароля в пуле вычислений (CPU_WORKERS)
+# и в потоке обработки событий (CPU_WORKERS=0). Каждый вариант выполняется отдельным процессом в режиме eventlet,
+# как в gunicorn: входы отправляются зелёными потоками через тестовый клиент Flask, а клиент socket.io (тестовый
+# клиент Flask-SocketIO) каждые --interval секунд запрашивает первую страницу каталога. Задержка отсчитывается
+# от запланированного времени запроса, поэтому в неё входит и время, на которое проверка пароля остановила цикл
+# событий. Код возврата 1, если p99 с пулом вычислений не меньше p99 без него
+# Запуск: python benchmarks/login_storm.py --logins 40 --concurrency 8 --workers 2
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+
+# Задержки запросов каталога каждые interval секунд до установки stop, с
+def probe(client, interval, stop, latencies):
+    import eventlet
+    scheduled = time.perf_counter()
+    while not stop:
+        client.emit('catalog_page', '{}')
+        client.get_received()
+        now = time.perf_counter()
+        latencies.append(now - scheduled)
+        # Пропущенные за время остановки цикла событий запросы не отправляются пачкой
+        scheduled = max(scheduled + interval, now)
+        eventlet.sleep(scheduled - now)
+
+
+# Один вариант в дочернем процессе: задержки без нагрузки и во время входов, результат — строка JSON
+def measure(args):
+    import eventlet
+    from common import app, db, create_user, connect, PASSWORD
+
+    with app.app_context():
+        db.create_all()
+        create_user("storm@example.com")
+    client = connect()
+
+    def login(_):
+        response = app.test_client().post("/login?next=/", data={"email": "storm@example.com",
+                                                                  "password": PASSWORD})
+        return response.status_code
+
+    result = {}
+    for phase in ('idle', 'storm'):
+        stop = []
+        latencies = []
+        prober = eventlet.spawn(probe, client, args.interval, stop, latencies)
+        start = time.perf_counter()
+        if phase == 'idle':
+            eventlet.sleep(args.idle)
+        else:
+            # 302 — успешный вход, 503 — пул вычислений перегружен
+            result['statuses'] = Counter(eventlet.GreenPool(args.concurrency).imap(login, range(args.logins)))
+        result[phase + '_seconds'] = time.perf_counter() - start
+        stop.append(True)
+        prober.wait()
+        result[phase] = latencies
+    client.disconnect()
+    print(json.dumps(result))
+
+
+# Запуск варианта с cpu_workers процессами пула вычислений
+def run(args, cpu_workers):
+    env = dict(os.environ, ASYNC_MODE='eventlet', CPU_WORKERS=str(cpu_workers),
+               PASSWORD_HASH_METHOD=args.method, AUTH_RATE_LIMIT='0',
+               DB_URI='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'login_storm.db'))
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'] + sys.argv[1:], env=env,
+                            check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# Медиана и 99-й перцентиль, мс
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies) * 1000, latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000
+
+
+def main(args):
+    print('%-22s %8s %9s %9s %9s  %s' % ('variant', 'requests', 'p50 ms', 'p99 ms', 'logins/s', 'responses'))
+    p99 = {}
+    for name, cpu_workers in (('CPU_WORKERS=0', 0), ('CPU_WORKERS=%d' % args.workers, args.workers)):
+        result = run(args, cpu_workers)
+        for phase in ('idle', 'storm'):
+            p50, p99[name] = percentiles(result[phase])
+            rate = args.logins / result['storm_seconds'] if phase == 'storm' else 0
+            print('%-22s %8d %9.1f %9.1f %9.1f  %s' % (
+                name + ' ' + phase, len(result[phase]), p50, p99[name], rate,
+                result['statuses'] if phase == 'storm' else ''))
+    off, on = p99['CPU_WORKERS=0'], p99['CPU_WORKERS=%d' % args.workers]
+    print('p99 во время входов с пулом вычислений: %.0f%% от p99 без пула' % (on / off * 100))
+    return 0 if on < off else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='CPU_WORKERS варианта с пулом')
+    parser.add_argument('--method', default='pbkdf2:sha256:600000', help='метод хеширования паролей')
+    parser.add_argument('--interval', type=float, default=0.05, help='пауза между запросами каталога, с')
+    parser.add_argument('--idle', type=float, default=1, help='длительность замера без нагрузки, с')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.child:
+        measure(arguments)
+    else:
+        sys.exit(main(arguments))
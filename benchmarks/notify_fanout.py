@@ -0,0 +1,104 @@
+# Замер количества запросов к БД и объёма данных, отправленных клиентам, на одно изменяющее действие
+# в зависимости от числа подключённых клиентов
+# Запуск: python benchmarks/notify_fanout.py 1 10 100
+import sys
+
+from common import app, db, create_user, connect
+from sqlalchemy import event
+from app import Item, RentOut, booking_calendar
+
+# Страница, которую открыл клиент, и событие перезагрузки её данных
+CATALOG_PAGE = 'catalog_page'
+INCOMING_PAGE = 'reload_incoming'
+OUTGOING_PAGE = 'reload_outgoing'
+# Страница каталога с фильтром свободных дат: период пересекается с одобряемой заявкой и не пересекается с ней
+FREE_PAGE = 'catalog_page'
+OVERLAPPING = '{"free_from": "2023-06-01T12:00", "free_to": "2023-06-03T10:00"}'
+DISJOINT = '{"free_from": "2023-07-01T10:00", "free_to": "2023-07-03T10:00"}'
+
+queries = [0]
+
+
+def count_query(*args):
+    queries[0] += 1
+
+
+def open_page(client, page, *args):
+    client.emit(page, *args)
+    client.get_received()
+    return client, page, args
+
+
+# Размер данных событий в байтах
+def payload(received):
+    return sum(len(arg) for r in received for arg in r['args'] if isinstance(arg, str))
+
+
+# Клиенты, получившие событие 'connect', заново запрашивают данные своей страницы,
+# клиенты, получившие 'delta', применяют изменения без запроса
+def reload_notified(pages):
+    reloaded = patched = sent = 0
+    for client, page, args in pages:
+        received = client.get_received()
+        sent += payload(received)
+        if any(r['name'] == 'delta' for r in received):
+            patched += 1
+        if any(r['name'] == 'connect' for r in received):
+            client.emit(page, *args)
+            sent += payload(client.get_received())
+            reloaded += 1
+    return reloaded, patched, sent
+
+
+# Заполнение БД: владелец объявления, арендатор и одно активное объявление
+def seed():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # Календарь бронирований в памяти относится к прежней БД
+        booking_calendar.periods.clear()
+        create_user("owner@example.com")
+        create_user("renter@example.com")
+        item = Item(name="Дрель", category="Инструменты", description="", rent_price=100, image_url="")
+        db.session.add(item)
+        db.session.commit()
+        rent_out = RentOut(status="активно", id_item=item.id_item, id_user=1)
+        db.session.add(rent_out)
+        db.session.commit()
+        return rent_out.id_rent_out
+
+
+def run(n_clients):
+    id_rent_out = seed()
+    owner = connect("owner@example.com")
+    renter = connect("renter@example.com")
+    pages = [open_page(owner, INCOMING_PAGE), open_page(renter, OUTGOING_PAGE)]
+    pages += [open_page(connect(), CATALOG_PAGE, '{}') for _ in range(n_clients)]
+    pages += [open_page(connect(), FREE_PAGE, OVERLAPPING), open_page(connect(), FREE_PAGE, DISJOINT)]
+
+    mutations = [
+        ('add_bag', renter, (id_rent_out,)),
+        ('add_rent_in', renter, ('{"date_rent_start": "2023-06-01T10:00", "date_rent_finish": "2023-06-02T10:00", '
+                                 '"note": "", "id_rent_out": %d}' % id_rent_out,)),
+        ('approve', owner, (1, id_rent_out)),
+    ]
+    results = {}
+    for name, client, args in mutations:
+        queries[0] = 0
+        client.emit(name, *args)
+        reloaded, patched, sent = reload_notified(pages)
+        results[name] = (queries[0], reloaded, patched, sent)
+
+    for client, page, args in pages:
+        client.disconnect()
+    return results
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [1, 10, 100]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+    print('%8s %-12s %8s %10s %8s %8s' % ('clients', 'mutation', 'queries', 'reloaded', 'patched', 'bytes'))
+    for n in sizes:
+        for mutation, (n_queries, reloaded, patched, sent) in run(n).items():
+            print('%8d %-12s %8d %10d %8d %8d' % (n, mutation, n_queries, reloaded, patched, sent))
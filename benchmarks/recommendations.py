@@ -0,0 +1,131 @@
+# Замер индекса рекомендаций: время построения на синтетических данных, задержки запросов к индексу
+# и задержки событий similar и recommend на заполненной БД
+# Код возврата 1, если p99 запроса к индексу больше --budget-ms
+# Запуск: python benchmarks/recommendations.py --items 10000 --users 2500 --rentals 50000
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from common import app, socketio, login
+from app import recommendations, RECOMMEND_LIMIT
+import recommend
+import suite
+
+
+# Синтетические объявления: названия и описания из слов с распределением Ципфа, категория и аренды пользователей,
+# которые чаще выбирают объявления своей любимой категории
+def synthetic(args):
+    rng = np.random.default_rng(args.seed)
+    vocabulary = np.array(["слово%d" % i for i in range(args.vocabulary)])
+    categories = rng.integers(0, len(suite.CATEGORIES), args.items)
+    words = np.minimum(rng.zipf(1.3, (args.items, 25)) - 1, args.vocabulary - 1)
+    documents = [list(vocabulary[row[:3]]) * 4 + list(vocabulary[row[3:]]) + ["категория:%d" % c]
+                 for row, c in zip(words, categories)]
+    by_category = [np.flatnonzero(categories == c) for c in range(len(suite.CATEGORIES))]
+    favourite = rng.integers(0, len(suite.CATEGORIES), args.users)
+    users = rng.integers(0, args.users, args.rentals)
+    own = rng.random(args.rentals) < 0.7
+    rented = rng.integers(0, args.items, args.rentals)
+    for n in np.flatnonzero(own):
+        choices = by_category[favourite[users[n]]]
+        if len(choices):
+            rented[n] = choices[rng.integers(len(choices))]
+    return list(range(args.items)), documents, list(zip(users.tolist(), rented.tolist()))
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies) * 1000, latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000
+
+
+def report(name, latencies):
+    p50, p99 = percentiles(latencies)
+    print('%-24s %8d %10.3f %10.3f' % (name, len(latencies), p50, p99))
+    return p99
+
+
+# Задержки запросов к индексу в памяти
+def index_latencies(index, args):
+    rng = np.random.default_rng(args.seed)
+    ids = index.listings[rng.integers(0, len(index.listings), args.queries)].tolist()
+    histories = [index.listings[rng.integers(0, len(index.listings), args.history)].tolist()
+                 for _ in range(args.queries)]
+    queries = {
+        'similar_to': lambda n: index.similar_to(ids[n], 2 * RECOMMEND_LIMIT),
+        'also_rented': lambda n: index.also_rented(ids[n], 2 * RECOMMEND_LIMIT),
+        'suggest': lambda n: index.suggest(histories[n], 2 * RECOMMEND_LIMIT),
+    }
+    worst = 0
+    for name, query in queries.items():
+        latencies = []
+        for n in range(args.queries):
+            start = time.perf_counter()
+            query(n)
+            latencies.append(time.perf_counter() - start)
+        worst = max(worst, report(name, latencies))
+    return worst
+
+
+# Задержки событий similar и recommend на БД, заполненной набором замеров suite.py
+def handler_latencies(args):
+    seed = argparse.Namespace(seed=args.seed, users=args.db_users, items=args.db_items, rentals=args.db_rentals,
+                              bags=args.db_rentals // 4, complaints=0)
+    user_ids, owned = suite.seed(seed)
+    client = socketio.test_client(app, flask_test_client=login("user1@example.com"))
+    start = time.perf_counter()
+    with app.app_context():
+        recommendations.refresh()
+    print('index build on database:  %.3f s' % (time.perf_counter() - start))
+    ids = [id_rent_out for listings in owned.values() for id_rent_out in listings]
+    latencies = {'similar': [], 'recommend': []}
+    for n in range(args.queries):
+        for name, event_args in (('similar', (ids[n % len(ids)],)), ('recommend', ())):
+            start = time.perf_counter()
+            client.emit(name, *event_args)
+            latencies[name].append(time.perf_counter() - start)
+        client.get_received()
+    for name, values in latencies.items():
+        report(name, values)
+    client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=2500)
+    parser.add_argument('--rentals', type=int, default=50000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=50, help='объявлений в истории пользователя')
+    parser.add_argument('--repeat', type=int, default=3, help='число построений индекса')
+    parser.add_argument('--budget-ms', type=float, default=2, help='допустимая задержка p99 запроса к индексу, мс')
+    parser.add_argument('--db-items', type=int, default=2000)
+    parser.add_argument('--db-users', type=int, default=500)
+    parser.add_argument('--db-rentals', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    listings, documents, baskets = synthetic(args)
+    builds = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        arrays = recommend.build(listings, documents, baskets)
+        builds.append(time.perf_counter() - start)
+    index = recommend.Recommendations(arrays)
+    size = sum(getattr(index, name).nbytes for name in recommend.ARRAYS)
+    print('index build: %d items, %d rentals: %.3f s (best of %d), %.1f MB' % (
+        args.items, args.rentals, min(builds), args.repeat, size / 2 ** 20))
+    print('%-24s %8s %10s %10s' % ('query', 'n', 'p50 ms', 'p99 ms'))
+    worst = index_latencies(index, args)
+    handler_latencies(args)
+    if worst > args.budget_ms:
+        print('p99 запроса к индексу %.3f мс больше %.3f мс' % (worst, args.budget_ms))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# Проверка распределения запросов между основной БД и репликами на двух копиях файла SQLite:
+# списки читаются с реплик, записи идут в основную БД, а пользователь после своего изменения
+# DB_REPLICA_STICKY секунд читает свои списки из основной БД и видит изменение, которого на реплике ещё нет
+# Запуск: python benchmarks/replica_routing.py
+import json
+import os
+import shutil
+import tempfile
+import time
+
+directory = tempfile.mkdtemp()
+PRIMARY = os.path.join(directory, 'primary.db')
+REPLICAS = [os.path.join(directory, 'replica%d.db' % i) for i in range(2)]
+os.environ['DB_URI'] = 'sqlite:///' + PRIMARY
+os.environ['DB_REPLICA_URIS'] = ','.join('sqlite:///' + path for path in REPLICAS)
+os.environ['DB_REPLICA_STICKY'] = '0.5'
+
+from common import app, db, create_user, connect
+from sqlalchemy import event
+from app import Item, RentOut, RentIn, DB_REPLICA_STICKY
+from datetime import datetime
+
+# Число запросов к каждой БД по имени файла
+queries = {}
+
+
+def count_queries(name):
+    def count(*args):
+        queries[name] = queries.get(name, 0) + 1
+    return count
+
+
+def seed():
+    with app.app_context():
+        db.create_all()
+        create_user("owner@example.com")
+        create_user("renter@example.com")
+        items = [Item(name="Предмет %d" % i, category="Инструменты", description="", rent_price=100, image_url="")
+                 for i in range(3)]
+        db.session.add_all(items)
+        db.session.flush()
+        rent_outs = [RentOut(status="активно", id_item=item.id_item, id_user=1) for item in items]
+        db.session.add_all(rent_outs)
+        db.session.flush()
+        db.session.add(RentIn(status="подана", date_rent_start=datetime(2030, 1, 1, 10),
+                              date_rent_finish=datetime(2030, 1, 2, 10), note="", id_user=2,
+                              id_rent_out=rent_outs[0].id_rent_out))
+        db.session.commit()
+        ids = [a.id_rent_out for a in rent_outs]
+        db.engine.dispose()
+    # Реплики — копии основной БД на момент заполнения; дальнейшие изменения на них не попадают
+    for path in REPLICAS:
+        shutil.copyfile(PRIMARY, path)
+    with app.app_context():
+        for name, engine in db.engines.items():
+            event.listen(engine, 'before_cursor_execute', count_queries(name or 'primary'))
+    return ids
+
+
+# Событие клиента: число запросов к каждой БД и полученные события
+def step(client, name, *args):
+    queries.clear()
+    client.emit(name, *args)
+    received = client.get_received()
+    return dict(queries), received
+
+
+def items(received, name):
+    for r in received:
+        if r['name'] == name:
+            return json.loads(r['args'][0])['items']
+    return None
+
+
+# Все запросы выполнены в основной БД (primary=True) или на репликах
+def check(title, counts, primary):
+    print('%-48s %s' % (title, ', '.join('%s: %d' % (name, counts[name]) for name in sorted(counts))))
+    if primary:
+        assert set(counts) == {'primary'}, (title, counts)
+    else:
+        assert counts and set(counts) <= {'replica0', 'replica1'}, (title, counts)
+
+
+if __name__ == '__main__':
+    ids = seed()
+    owner = connect("owner@example.com")
+    renter = connect("renter@example.com")
+
+    counts, received = step(renter, 'reload_bag')
+    check("reload_bag: список с реплики", counts, primary=False)
+    assert items(received, 'bag') == []
+
+    counts, received = step(renter, 'add_bag', ids[1])
+    check("add_bag: запись в основную БД", counts, primary=True)
+
+    counts, received = step(renter, 'reload_bag')
+    check("reload_bag после своего изменения: основная БД", counts, primary=True)
+    assert [a['id_rent_out'] for a in items(received, 'bag')] == [ids[1]]
+
+    counts, received = step(owner, 'reload_incoming')
+    check("reload_incoming другого пользователя: реплика", counts, primary=False)
+
+    time.sleep(DB_REPLICA_STICKY)
+    counts, received = step(renter, 'reload_bag')
+    check("reload_bag через DB_REPLICA_STICKY: реплика", counts, primary=False)
+    # Реплика не получила изменение: поэтому сразу после записи пользователь читает из основной БД
+    assert items(received, 'bag') == []
+
+    owner.disconnect()
+    renter.disconnect()
+    shutil.rmtree(directory)
+    print("ok")
@@ -0,0 +1,83 @@
+# Замер скорости выборки и сериализации списка заявок: сущности ORM и json.dumps против проекции столбцов и orjson
+# Запуск: python benchmarks/serialize_rows.py 1000 10000
+import sys
+import time
+from datetime import datetime
+
+from common import app, db, create_user
+from flask import json
+from app import User, Item, RentOut, RentIn, VIEWS, image_variant
+
+
+# Заполнение БД: n заявок арендатора на объявления владельца
+def seed(n):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        owner = create_user("owner@example.com")
+        renter = create_user("renter@example.com")
+        items = [Item(name="Предмет %d" % i, category="Инструменты", description="Описание предмета %d" % i,
+                      rent_price=i, image_url="") for i in range(n)]
+        db.session.add_all(items)
+        db.session.flush()
+        rent_outs = [RentOut(status="активно", id_item=item.id_item, id_user=owner.id) for item in items]
+        db.session.add_all(rent_outs)
+        db.session.flush()
+        db.session.add_all([RentIn(status="одобрена", date_rent_start=datetime(2023, 6, 1, 10),
+                                   date_rent_finish=datetime(2023, 6, 2, 10), note="", id_user=renter.id,
+                                   id_rent_out=rent_out.id_rent_out) for rent_out in rent_outs])
+        db.session.commit()
+        return owner.id
+
+
+# Прежний способ: выборка сущностей целиком и сборка словарей вручную
+def orm_path(id_user):
+    notirent = db.session.query(RentIn, RentOut, Item, User).join(RentOut, RentIn.id_rent_out == RentOut.id_rent_out) \
+        .join(Item, RentOut.id_item == Item.id_item) \
+        .join(User, RentIn.id_user == User.id) \
+        .filter(RentOut.id_user == id_user, RentIn.status.in_(("одобрена", "в аренде"))) \
+        .order_by(RentIn.id_rent_in.desc()).all()
+    return json.dumps([{'id_rent_in': a.RentIn.id_rent_in,
+                        'id_rent_out': a.RentOut.id_rent_out,
+                        'id_item': a.RentOut.id_item,
+                        'username': a.User.username,
+                        'phone': a.User.phone,
+                        'email': a.User.email,
+                        'name': a.Item.name,
+                        'category': a.Item.category,
+                        'description': a.Item.description,
+                        'rent_price': a.Item.rent_price,
+                        'image_url': image_variant(a.Item.image_url, 'thumb'),
+                        'date_rent_start': a.RentIn.date_rent_start,
+                        'date_rent_finish': a.RentIn.date_rent_finish,
+                        'note': a.RentIn.note,
+                        'status': a.RentIn.status
+                        } for a in notirent], default=str)
+
+
+# Новый способ: проекция нужных столбцов и orjson
+def view_path(id_user):
+    return VIEWS['notirent'].json(id_user=id_user)
+
+
+# Строк в секунду для функции path при повторении repeat раз
+def measure(path, id_user, n, repeat=5):
+    best = None
+    for _ in range(repeat):
+        with app.app_context():
+            start = time.perf_counter()
+            path(id_user)
+            elapsed = time.perf_counter() - start
+            db.session.remove()
+        best = elapsed if best is None else min(best, elapsed)
+    return n / best
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000]
+    print('%8s %14s %14s %8s' % ('rows', 'orm rows/s', 'view rows/s', 'speedup'))
+    for n in sizes:
+        id_user = seed(n)
+        orm = measure(orm_path, id_user, n)
+        view = measure(view_path, id_user, n)
+        print('%8d %14.0f %14.0f %7.1fx' % (n, orm, view, view / orm))
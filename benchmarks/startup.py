@@ -0,0 +1,86 @@
+# Время импорта приложения и модуля вычислительных задач в новом интерпретаторе (python -X importtime):
+# столько ждёт каждый запускаемый процесс — рабочий процесс gunicorn, процесс пула вычислений, команда flask
+# (миграции, фоновые задачи). Для каждого модуля выводятся медиана времени импорта по --runs запускам и самые
+# долгие импорты, которые он выполняет напрямую.
+# Код возврата 1, если медиана импорта app больше --budget-ms или при импорте загружены модули, которые должны
+# импортироваться только при первом использовании (--lazy)
+# Импорт не читает настройки БД и не загружает драйвер СУБД (это делает create_app), поэтому DB_URI не нужен
+# Запуск: python benchmarks/startup.py --runs 5 --budget-ms 1500
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули, загружаемые при первом использовании: NumPy — индекс рекомендаций, Pillow — обработка изображений,
+# Flask-Migrate и Alembic — команды flask db, multiprocessing — пул вычислений, psycopg2 — create_app
+LAZY = ('numpy', 'PIL', 'flask_migrate', 'alembic', 'multiprocessing', 'psycopg2')
+
+
+# Импорт модуля в новом интерпретаторе: время процесса (с) и строки -X importtime
+# (собственное время, мкс; время с вложенными импортами, мкс; уровень вложенности; модуль)
+def import_once(module, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        sys.exit('\n'.join(line for line in result.stderr.splitlines() if not line.startswith('import time:')))
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(own), int(cumulative), (len(name) - len(name.lstrip())) // 2, name.strip()))
+    return elapsed, imports
+
+
+def measure(module, args, env):
+    runs = [import_once(module, env) for _ in range(args.runs)]
+    total = statistics.median(next(c for _, c, _, name in imports if name == module) for _, imports in runs) / 1000
+    process = statistics.median(elapsed for elapsed, _ in runs) * 1000
+    print('%s: import %.1f ms, process %.1f ms (median of %d)' % (module, total, process, len(runs)))
+    # Прямые импорты модуля из последнего запуска: -X importtime выводит вложенные импорты перед модулем,
+    # который их выполняет
+    imports = runs[-1][1]
+    end = next(n for n, (_, _, _, name) in enumerate(imports) if name == module)
+    level = imports[end][2]
+    start = end
+    while start > 0 and imports[start - 1][2] > level:
+        start -= 1
+    direct = sorted(((c, name) for _, c, lvl, name in imports[start:end] if lvl == level + 1), reverse=True)
+    for cumulative, name in direct[:args.top]:
+        print('    %-40s %8.1f ms' % (name, cumulative / 1000))
+    loaded = sorted({name.split('.')[0] for _, _, _, name in imports} & args.lazy)
+    if loaded:
+        print('    загружены при импорте: %s' % ', '.join(loaded))
+    return total, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='число самых долгих прямых импортов в отчёте')
+    parser.add_argument('--budget-ms', type=float, default=1500, help='допустимая медиана импорта app, мс')
+    parser.add_argument('--lazy', default=','.join(LAZY),
+                        help='модули через запятую, которые не должны загружаться при импорте')
+    args = parser.parse_args()
+    args.lazy = {name for name in args.lazy.split(',') if name}
+
+    env = dict(os.environ)
+    env.setdefault('SECRET_KEY', 'startup')
+    failed = False
+    for module in ('app', 'cpu_tasks'):
+        total, loaded = measure(module, args, env)
+        if loaded:
+            failed = True
+        if module == 'app' and total > args.budget_ms:
+            print('импорт app %.1f мс больше %.1f мс' % (total, args.budget_ms))
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
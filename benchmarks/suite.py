@@ -0,0 +1,318 @@
+# Набор замеров HTTP-маршрутов и событий socket.io на заполненной БД: пропускная способность, задержки p50 и p99
+# и число запросов к БД на операцию. Браузеры моделируются клиентами socket.io и HTTP, вошедшими под пользователями
+# из БД; операции выполняются по очереди разными клиентами, включая цепочку заявки
+# add_rent_in → approve → rent_start → rent_finish.
+# Результаты сохраняются в JSON (--output). С --baseline результаты сравниваются с сохранёнными, и скрипт
+# завершается с кодом 1, если операция медленнее базовой больше чем на --tolerance или выполняет больше запросов к БД
+# и при повторном замере. Задержки операции — медиана p50 и p99 по --repeats прогонам после разогрева
+# Запуск: python benchmarks/suite.py --output baseline.json
+#         python benchmarks/suite.py --baseline baseline.json
+# По умолчанию используется SQLite в памяти; для PostgreSQL: DB_URI=postgresql://... (таблицы БД пересоздаются)
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from common import app, db, socketio, login, PASSWORD
+from sqlalchemy import event, insert, select, func
+from werkzeug.security import generate_password_hash
+from app import User, Item, RentOut, RentIn, Bag, Complaint, booking_calendar, invalidate_catalog, recommendations, \
+    RENT_IN_STATUSES, COMPLAINT_STATUSES
+
+CATEGORIES = ("Одежда", "Инструменты", "Электроника", "Спорт и активный отдых", "Детские товары", "Другое")
+WORDS = ("дрель", "палатка", "велосипед", "коляска", "камера", "куртка", "перфоратор", "лыжи", "самокат", "ноутбук",
+         "удобный", "лёгкий", "новый", "прочный", "складной", "детский", "зимний", "аккумуляторный")
+# Операции с задержкой меньше этой считаются не изменившимися при любом относительном росте, мс
+MIN_REGRESSION_MS = 0.2
+
+statements = [0]
+
+
+def count_statement(*args):
+    statements[0] += 1
+
+
+def text(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+# Заполнение БД пакетными вставками; возвращает идентификаторы объявлений по владельцам
+def seed(args):
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        booking_calendar.periods.clear()
+        invalidate_catalog()
+        recommendations.current = None
+        pwhash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1')
+        db.session.execute(insert(User), [
+            {'username': "user%d" % i, 'dob': date(1990, 1, 1), 'role': "клиент", 'phone': "+7999%07d" % i,
+             'email': "user%d@example.com" % i, 'hash_password': pwhash} for i in range(args.users)])
+        db.session.execute(insert(Item), [
+            {'name': text(rng, 2).capitalize(), 'category': rng.choice(CATEGORIES), 'description': text(rng, 20),
+             'rent_price': rng.randint(100, 5000), 'image_url': ""} for _ in range(args.items)])
+        user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+        items = db.session.execute(select(Item.id_item, Item.category, Item.rent_price).order_by(Item.id_item)).all()
+        db.session.execute(insert(RentOut), [
+            {'status': rng.choices(("активно", "неактивно", "удалено"), (90, 5, 5))[0], 'id_item': a.id_item,
+             'id_user': rng.choice(user_ids), 'category': a.category, 'rent_price': a.rent_price} for a in items])
+        rent_outs = db.session.execute(select(RentOut.id_rent_out, RentOut.id_user, RentOut.status)).all()
+        # Периоды заявок одного объявления идут друг за другом и не пересекаются
+        periods = {}
+        rentals = []
+        for _ in range(args.rentals):
+            rent_out = rng.choice(rent_outs)
+            k = periods[rent_out.id_rent_out] = periods.get(rent_out.id_rent_out, -1) + 1
+            start = datetime(2023, 1, 1, 10) + timedelta(days=3 * k)
+            rentals.append({'status': rng.choice(RENT_IN_STATUSES), 'date_rent_start': start,
+                            'date_rent_finish': start + timedelta(days=2), 'note': text(rng, 5),
+                            'id_user': rng.choice(user_ids), 'id_rent_out': rent_out.id_rent_out})
+        if rentals:
+            db.session.execute(insert(RentIn), rentals)
+        bags = {(rng.choice(user_ids), rng.choice(rent_outs).id_rent_out) for _ in range(args.bags)}
+        if bags:
+            db.session.execute(insert(Bag), [{'id_user': u, 'id_rent_out': r} for u, r in sorted(bags)])
+        rent_in_ids = db.session.execute(select(RentIn.id_rent_in, RentIn.id_user)).all()
+        if rent_in_ids and args.complaints:
+            db.session.execute(insert(Complaint), [
+                {'id_rent_in': a.id_rent_in, 'id_user': a.id_user, 'description': text(rng, 10),
+                 'status': rng.choice(COMPLAINT_STATUSES)} for a in rng.choices(rent_in_ids, k=args.complaints)])
+        db.session.commit()
+        # Индекс рекомендаций по заполненной БД строится до замера, а не в фоне во время него
+        recommendations.refresh()
+        owned = {}
+        for a in rent_outs:
+            if a.status == "активно":
+                owned.setdefault(a.id_user, []).append(a.id_rent_out)
+        return user_ids, owned
+
+
+# Браузер: HTTP-клиент и клиент socket.io одного пользователя
+class Browser:
+    def __init__(self, id_user, email):
+        self.id_user = id_user
+        self.http = login(email)
+        self.socket = socketio.test_client(app, flask_test_client=self.http)
+
+
+def last_id(column, *criteria):
+    with app.app_context():
+        return db.session.scalar(select(func.max(column)).where(*criteria))
+
+
+class Suite:
+    def __init__(self, browsers, owned, rng):
+        self.browsers = browsers
+        self.owned = owned
+        self.rng = rng
+        # Операция -> задержки (с) и число запросов к БД каждого выполнения
+        self.samples = {}
+        # Заявки создаются на неделю вперёд каждая, чтобы периоды не пересекались между собой и с данными seed
+        self.day = datetime(2031, 1, 1, 10)
+
+    def measure(self, name, action):
+        statements[0] = 0
+        start = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - start
+        self.samples.setdefault(name, ([], []))
+        self.samples[name][0].append(elapsed)
+        self.samples[name][1].append(statements[0])
+
+    def http(self, name, browser, path):
+        def get():
+            response = browser.http.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+        self.measure(name, get)
+
+    def socket(self, name, browser, *args):
+        self.measure(name, lambda: browser.socket.emit(name, *args))
+
+    # Одна итерация: страницы и списки случайных пользователей, избранное и полный цикл заявки
+    def iteration(self):
+        rng = self.rng
+        browser = rng.choice(self.browsers)
+        owner = rng.choice([b for b in self.browsers if b.id_user in self.owned and b is not browser])
+        id_rent_out = rng.choice(self.owned[owner.id_user])
+
+        self.http('GET /', browser, "/")
+        self.http('GET /catalog', browser, "/catalog")
+        self.http('GET /bag', browser, "/bag")
+        self.http('GET /incoming', owner, "/incoming")
+        self.socket('catalog_page', browser, json.dumps({'category': rng.choice(CATEGORIES), 'sort': "price_asc"}))
+        self.socket('search', browser, json.dumps({'query': rng.choice(WORDS)}))
+        self.socket('availability', browser, id_rent_out)
+        self.socket('similar', browser, id_rent_out)
+        self.socket('recommend', browser)
+        self.socket('reload_bag', browser)
+        self.socket('reload_my_rent_out', owner)
+
+        self.socket('add_bag', browser, id_rent_out)
+        self.socket('del_bag', browser, last_id(Bag.id_bag, Bag.id_user == browser.id_user))
+
+        self.day += timedelta(days=7)
+        self.socket('add_rent_in', browser, json.dumps({
+            'date_rent_start': self.day.isoformat(timespec='minutes'),
+            'date_rent_finish': (self.day + timedelta(days=2)).isoformat(timespec='minutes'),
+            'note': "", 'id_rent_out': id_rent_out}))
+        id_rent_in = last_id(RentIn.id_rent_in)
+        self.socket('reload_outgoing', browser)
+        self.socket('reload_incoming', owner)
+        self.socket('approve', owner, id_rent_in, id_rent_out)
+        self.socket('rent_start', owner, id_rent_in)
+        self.socket('reload_notirent', owner)
+        self.socket('rent_finish', owner, id_rent_in, id_rent_out)
+        self.socket('reload_irent_history', browser)
+
+        # Уведомления остальным клиентам не проверяются
+        for b in self.browsers:
+            b.socket.get_received()
+
+    def results(self):
+        results = {}
+        for name, (latencies, queries) in self.samples.items():
+            latencies = sorted(latencies)
+            results[name] = {
+                'ops': len(latencies),
+                'ops_per_s': round(len(latencies) / sum(latencies), 1),
+                'p50_ms': round(statistics.median(latencies) * 1000, 3),
+                'p99_ms': round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 3),
+                'queries': round(statistics.mean(queries), 2),
+            }
+        return results
+
+
+# Параметры заполнения БД и замера
+def parameters(args):
+    return {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')}
+
+
+# Заполнение БД, вход клиентов и разогрев
+def prepare(args):
+    user_ids, owned = seed(args)
+    rng = random.Random(args.seed)
+    users = user_ids[:args.clients]
+    browsers = [Browser(id_user, "user%d@example.com" % (id_user - user_ids[0])) for id_user in users]
+    owned = {id_user: ids for id_user, ids in owned.items() if id_user in users}
+    if len(owned) < 2:
+        sys.exit("Слишком мало владельцев объявлений среди клиентов: увеличьте --items или --clients")
+    suite = Suite(browsers, owned, rng)
+    for _ in range(args.warmup):
+        suite.iteration()
+    return suite
+
+
+# Замер: repeats прогонов по iterations итераций. Задержки операции — медианы p50 и p99 прогонов, чтобы один
+# медленный прогон (фоновая нагрузка на машине) не менял результат
+def run(suite, args):
+    rounds = []
+    elapsed = 0
+    for _ in range(args.repeats):
+        suite.samples.clear()
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            suite.iteration()
+        elapsed += time.perf_counter() - start
+        rounds.append(suite.results())
+    operations = {}
+    for name in rounds[0]:
+        measured = [r[name] for r in rounds]
+        operations[name] = {
+            'ops': sum(m['ops'] for m in measured),
+            'ops_per_s': round(statistics.median(m['ops_per_s'] for m in measured), 1),
+            'p50_ms': round(statistics.median(m['p50_ms'] for m in measured), 3),
+            'p99_ms': round(statistics.median(m['p99_ms'] for m in measured), 3),
+            'queries': round(statistics.mean(m['queries'] for m in measured), 2),
+        }
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    return {
+        'parameters': parameters(args),
+        'database': dialect,
+        'python': platform.python_version(),
+        'iterations_per_s': round(args.iterations * args.repeats / elapsed, 1),
+        'operations': operations,
+    }
+
+
+# Операции, ставшие медленнее базовых больше чем на tolerance или выполняющие больше запросов к БД:
+# словарь операция -> описания регрессий
+def regressions(results, baseline, tolerance):
+    found = {}
+    for name, base in baseline['operations'].items():
+        current = results['operations'].get(name)
+        if current is None:
+            continue
+        if current['queries'] > base['queries']:
+            found.setdefault(name, []).append('%s: запросов к БД %.2f, было %.2f' % (
+                name, current['queries'], base['queries']))
+        growth = current['p50_ms'] - base['p50_ms']
+        if growth > base['p50_ms'] * tolerance and growth > MIN_REGRESSION_MS:
+            found.setdefault(name, []).append('%s: p50 %.3f мс, было %.3f мс' % (
+                name, current['p50_ms'], base['p50_ms']))
+    return found
+
+
+def report(results, baseline=None):
+    print('%-20s %6s %10s %10s %10s %8s %10s' % ('operation', 'ops', 'ops/s', 'p50 ms', 'p99 ms', 'queries',
+                                                 'base p50'))
+    for name, r in results['operations'].items():
+        base = (baseline or {}).get('operations', {}).get(name)
+        print('%-20s %6d %10.1f %10.3f %10.3f %8.2f %10s' % (name, r['ops'], r['ops_per_s'], r['p50_ms'],
+                                                           r['p99_ms'], r['queries'],
+                                                           '%.3f' % base['p50_ms'] if base else '-'))
+    print('iterations/s: %.1f (%s)' % (results['iterations_per_s'], results['database']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--rentals', type=int, default=5000)
+    parser.add_argument('--bags', type=int, default=2000)
+    parser.add_argument('--complaints', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=20, help='число моделируемых браузеров')
+    parser.add_argument('--iterations', type=int, default=100, help='итераций в одном прогоне')
+    parser.add_argument('--repeats', type=int, default=3, help='число прогонов замера')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл JSON для результатов')
+    parser.add_argument('--baseline', help='файл JSON с результатами для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимый рост p50, доля')
+    args = parser.parse_args()
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        dialect = db.engine.dialect.name
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        # Среднее число запросов зависит от данных и числа итераций, поэтому сравниваются только одинаковые замеры
+        if baseline['parameters'] != parameters(args) or baseline['database'] != dialect:
+            sys.exit("Базовый замер выполнен с другими параметрами или СУБД: %s, %s" % (
+                baseline['database'], baseline['parameters']))
+    suite = prepare(args)
+    results = run(suite, args)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    found = regressions(results, baseline, args.tolerance) if baseline else {}
+    if found:
+        # Регрессией считается только рост, повторившийся при повторном замере
+        print('Повторный замер: %s' % ', '.join(found))
+        again = regressions(run(suite, args), baseline, args.tolerance)
+        found = {name: again[name] for name in found if name in again}
+    for browser in suite.browsers:
+        browser.socket.disconnect()
+    for lines in found.values():
+        for line in lines:
+            print('РЕГРЕССИЯ ' + line)
+    if found:
+        sys.exit(1)
@@ -0,0 +1,69 @@
+# Замер записи объявлений: число запросов к БД и время импорта CSV и массового удаления и восстановления
+# Запуск: python benchmarks/write_path.py 100 1000
+import json
+import sys
+import time
+from io import BytesIO
+
+from common import app, db, create_user, login, connect
+from sqlalchemy import event
+from app import RentOut, Bag
+
+statements = [0]
+
+
+def count_statement(*args):
+    statements[0] += 1
+
+
+def seed():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        create_user("owner@example.com")
+        create_user("admin@example.com", role="администратор")
+
+
+def items_csv(n):
+    lines = ["name;category;description;rent_price"]
+    lines += ["Предмет %d;Инструменты;Описание предмета %d;%d" % (i, i, i) for i in range(n)]
+    return "\n".join(lines).encode()
+
+
+# Число запросов и время выполнения действия
+def measure(action):
+    statements[0] = 0
+    start = time.perf_counter()
+    action()
+    return statements[0], (time.perf_counter() - start) * 1000
+
+
+def run(n):
+    seed()
+    owner = login("owner@example.com")
+    admin = connect("admin@example.com")
+    results = {}
+    results['import'] = measure(lambda: owner.post("/import_rent_out",
+                                                   data={'file': (BytesIO(items_csv(n)), 'items.csv')}))
+    with app.app_context():
+        ids = [a.id_rent_out for a in RentOut.query.all()]
+        db.session.add_all([Bag(id_user=1, id_rent_out=id_rent_out) for id_rent_out in ids])
+        db.session.commit()
+    assert len(ids) == n
+    results['remove'] = measure(lambda: admin.emit('del_rent_out_many', json.dumps(ids)))
+    results['restore'] = measure(lambda: admin.emit('restore_rent_out_many', json.dumps(ids)))
+    with app.app_context():
+        assert Bag.query.count() == 0
+        assert RentOut.query.filter(RentOut.status == "активно").count() == n
+    admin.disconnect()
+    return results
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+    print('%8s %-10s %10s %10s' % ('rows', 'operation', 'statements', 'ms'))
+    for n in sizes:
+        for operation, (n_statements, ms) in run(n).items():
+            print('%8d %-10s %10d %10.1f' % (n, operation, n_statements, ms))
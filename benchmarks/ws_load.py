@@ -0,0 +1,83 @@
+# Нагрузочный тест: число одновременных сессий websocket на одно ядро процессора сервера
+# Клиент socket.io для asyncio работает на aiohttp из requirements.txt
+# Запуск: python benchmarks/ws_load.py --url http://127.0.0.1:8000 --sessions 1000 --server-pid <pid>
+# Идентификаторы процессов gunicorn можно передать через запятую
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import socketio
+
+
+# Процессорное время процессов сервера в секундах (по /proc, только Linux)
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf('SC_CLK_TCK')
+
+
+# Одна сессия: подключение и периодический запрос каталога с замером времени ответа
+async def session(url, duration, interval, latencies, connected):
+    client = socketio.AsyncClient(reconnection=False)
+    reply = asyncio.Event()
+    client.on('catalog_page', lambda data: reply.set())
+    try:
+        await client.connect(url, transports=['websocket'])
+    except socketio.exceptions.ConnectionError:
+        return
+    connected.append(client)
+    finish = time.monotonic() + duration
+    while time.monotonic() < finish:
+        reply.clear()
+        start = time.monotonic()
+        await client.emit('catalog_page', '{}')
+        try:
+            await asyncio.wait_for(reply.wait(), timeout=10)
+            latencies.append(time.monotonic() - start)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(interval)
+    await client.disconnect()
+
+
+async def main(args):
+    pids = [int(pid) for pid in args.server_pid.split(',')] if args.server_pid else []
+    latencies = []
+    connected = []
+    cpu_start = cpu_seconds(pids) if pids else 0
+    wall_start = time.monotonic()
+    tasks = []
+    # Сессии открываются постепенно, чтобы не создавать пик подключений
+    for _ in range(args.sessions):
+        tasks.append(asyncio.create_task(session(args.url, args.duration, args.interval, latencies, connected)))
+        await asyncio.sleep(args.ramp / args.sessions)
+    await asyncio.gather(*tasks)
+    wall = time.monotonic() - wall_start
+
+    print('sessions connected: %d of %d' % (len(connected), args.sessions))
+    if latencies:
+        latencies.sort()
+        print('requests: %d, %.1f/s' % (len(latencies), len(latencies) / wall))
+        print('latency p50: %.1f ms, p99: %.1f ms' % (statistics.median(latencies) * 1000,
+                                                      latencies[int(len(latencies) * 0.99) - 1] * 1000))
+    if pids:
+        cores = (cpu_seconds(pids) - cpu_start) / wall
+        print('server cpu: %.2f cores' % cores)
+        if cores:
+            print('sessions per core: %.0f' % (len(connected) / cores))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30, help='длительность сессии, с')
+    parser.add_argument('--interval', type=float, default=5, help='пауза между запросами каталога, с')
+    parser.add_argument('--ramp', type=float, default=10, help='время открытия всех сессий, с')
+    parser.add_argument('--server-pid', default='', help='pid процессов сервера через запятую')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,57 @@
+# Вычислительные задачи, выполняемые в пуле процессов: хеширование паролей и обработка изображений.
+# Модуль не импортирует приложение, поэтому рабочие процессы запускаются быстро и не подключаются к БД
+import hashlib
+import os
+from io import BytesIO
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+IMAGE_FORMATS = ("JPEG", "PNG", "WEBP", "GIF", "BMP")
+# Изображения с большим числом пикселей отклоняются как возможная «бомба»
+MAX_IMAGE_PIXELS = 40000000
+
+
+# Pillow импортируется первой задачей с изображением: процессы, только хеширующие пароли, его не загружают
+def pillow():
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    return Image, ImageOps
+
+
+# Хеш пароля методом method (например, pbkdf2:sha256:600000 или scrypt:32768:8:1)
+def hash_password(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def check_password(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+# Проверка загруженного файла: возвращает хеш содержимого или вызывает исключение
+def validate_image(data):
+    Image, _ = pillow()
+    with Image.open(BytesIO(data)) as image:
+        if image.format not in IMAGE_FORMATS:
+            raise ValueError("Неподдерживаемый формат изображения")
+        image.verify()
+    return hashlib.sha256(data).hexdigest()
+
+
+# Создание вариантов изображения в каталоге directory без метаданных (EXIF и др.) с учётом ориентации снимка.
+# variants — максимальные ширина и высота каждого варианта
+def process_image(directory, data, variants, quality):
+    if all(os.path.exists(os.path.join(directory, variant + ".webp")) for variant in variants):
+        return
+    os.makedirs(directory, exist_ok=True)
+    Image, ImageOps = pillow()
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for variant, size in variants.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            # Запись во временный файл и переименование, чтобы клиент не получил недописанный файл
+            path = os.path.join(directory, variant + ".webp")
+            resized.save(path + ".tmp", "WEBP", quality=quality, method=4)
+            os.replace(path + ".tmp", path)
+
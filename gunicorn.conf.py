@@ -0,0 +1,40 @@
+# Настройки gunicorn для промышленного запуска: gunicorn -c gunicorn.conf.py 'app:create_app()'
+# Все параметры задаются переменными окружения (в том числе через файл .env)
+import os
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+# Рабочие процессы с зелёными потоками; приложение выбирает тот же режим socket.io
+os.environ.setdefault('ASYNC_MODE', 'eventlet')
+if os.environ['ASYNC_MODE'] == 'gevent':
+    worker_class = 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+else:
+    worker_class = 'eventlet'
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+
+# Больше одного процесса требует очереди сообщений SOCKETIO_MESSAGE_QUEUE, через которую процессы рассылают события
+# и сбросы кэшей. С очередью по умолчанию запускается процесс на ядро. Балансировщик gunicorn не привязывает клиента
+# к процессу, а запросы long-polling одной сессии socket.io должны попадать в один процесс, поэтому при нескольких
+# процессах клиенты подключаются только по websocket (или SOCKETIO_TRANSPORTS задаётся явно при балансировщике
+# с привязкой клиента к процессу, sticky sessions)
+message_queue = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+workers = int(os.getenv('WEB_CONCURRENCY', os.cpu_count() if message_queue not in ('', 'memory://') else 1))
+if workers > 1:
+    os.environ.setdefault('SOCKETIO_TRANSPORTS', 'websocket')
+
+# Максимальное число одновременных соединений (зелёных потоков) на процесс
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+
+# Время на завершение текущих запросов при остановке (SIGTERM) и перезапуске процессов
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+timeout = int(os.getenv('WORKER_TIMEOUT', 60))
+keepalive = int(os.getenv('KEEPALIVE', 5))
+
+
+# Закрытие соединений с БД при завершении процесса
+def worker_exit(server, worker):
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose()
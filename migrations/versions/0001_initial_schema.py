@@ -0,0 +1,81 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2023-06-10 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('username', sa.String(length=20), nullable=True),
+                    sa.Column('dob', sa.Date(), nullable=True),
+                    sa.Column('role', sa.String(length=13), nullable=True),
+                    sa.Column('phone', sa.String(length=12), nullable=True),
+                    sa.Column('email', sa.String(length=50), nullable=True),
+                    sa.Column('hash_password', sa.String(length=500), nullable=True),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('email'))
+    op.create_table('item',
+                    sa.Column('id_item', sa.Integer(), nullable=False),
+                    sa.Column('name', sa.String(length=100), nullable=True),
+                    sa.Column('category', sa.String(length=100), nullable=True),
+                    sa.Column('description', sa.Text(), nullable=True),
+                    sa.Column('rent_price', sa.Numeric(), nullable=True),
+                    sa.Column('image_url', sa.String(length=100), nullable=True),
+                    sa.PrimaryKeyConstraint('id_item'))
+    op.create_table('rent_out',
+                    sa.Column('id_rent_out', sa.Integer(), nullable=False),
+                    sa.Column('status', sa.String(length=9), nullable=True),
+                    sa.Column('id_user', sa.Integer(), nullable=True),
+                    sa.Column('id_item', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['id_item'], ['item.id_item']),
+                    sa.ForeignKeyConstraint(['id_user'], ['user.id']),
+                    sa.PrimaryKeyConstraint('id_rent_out'))
+    op.create_table('rent_in',
+                    sa.Column('id_rent_in', sa.Integer(), nullable=False),
+                    sa.Column('status', sa.String(length=20), nullable=True),
+                    sa.Column('date_rent_start', sa.DateTime(), nullable=True),
+                    sa.Column('date_rent_finish', sa.DateTime(), nullable=True),
+                    sa.Column('note', sa.Text(), nullable=True),
+                    sa.Column('id_user', sa.Integer(), nullable=True),
+                    sa.Column('id_rent_out', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['id_rent_out'], ['rent_out.id_rent_out']),
+                    sa.ForeignKeyConstraint(['id_user'], ['user.id']),
+                    sa.PrimaryKeyConstraint('id_rent_in'))
+    op.create_table('bag',
+                    sa.Column('id_bag', sa.Integer(), nullable=False),
+                    sa.Column('id_user', sa.Integer(), nullable=True),
+                    sa.Column('id_rent_out', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['id_rent_out'], ['rent_out.id_rent_out']),
+                    sa.ForeignKeyConstraint(['id_user'], ['user.id']),
+                    sa.PrimaryKeyConstraint('id_bag'))
+    op.create_table('complaint',
+                    sa.Column('id_complaint', sa.Integer(), nullable=False),
+                    sa.Column('id_rent_in', sa.Integer(), nullable=True),
+                    sa.Column('id_user', sa.Integer(), nullable=True),
+                    sa.Column('description', sa.Text(), nullable=True),
+                    sa.Column('status', sa.String(length=20), nullable=True),
+                    sa.ForeignKeyConstraint(['id_rent_in'], ['rent_in.id_rent_in']),
+                    sa.ForeignKeyConstraint(['id_user'], ['user.id']),
+                    sa.PrimaryKeyConstraint('id_complaint'))
+
+
+def downgrade():
+    op.drop_table('complaint')
+    op.drop_table('bag')
+    op.drop_table('rent_in')
+    op.drop_table('rent_out')
+    op.drop_table('item')
+    op.drop_table('user')
@@ -0,0 +1,32 @@
+"""item full-text search vector
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2023-06-12 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+# Столбец нужен только в PostgreSQL, остальные СУБД используют индекс в памяти приложения
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("ALTER TABLE item ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+               "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+               "setweight(to_tsvector('russian', coalesce(description, '')), 'B')) STORED")
+    op.execute("CREATE INDEX ix_item_search_vector ON item USING GIN (search_vector)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_item_search_vector', table_name='item')
+    op.drop_column('item', 'search_vector')
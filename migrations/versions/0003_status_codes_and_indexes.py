@@ -0,0 +1,74 @@
+"""smallint status codes and indexes for hot filters
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2023-06-14 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+# Порядок статусов задаёт их номера в БД и совпадает с app.py
+STATUSES = {
+    'rent_out': (("активно", "неактивно", "удалено"), 9),
+    'rent_in': (("подана", "одобрена", "в аренде", "аренда завершена"), 20),
+    'complaint': (("рассматривается", "жалоба закрыта"), 20),
+}
+
+
+def case(values, to_code):
+    if to_code:
+        whens = " ".join("WHEN '%s' THEN %d" % (value, n) for n, value in enumerate(values, 1))
+    else:
+        whens = " ".join("WHEN %d THEN '%s'" % (n, value) for n, value in enumerate(values, 1))
+    return "CASE status %s END" % whens
+
+
+# Замена типа столбца status с переводом значений
+def convert(table, values, length, to_code):
+    old_type, new_type = sa.String(length=length), sa.SmallInteger()
+    if not to_code:
+        old_type, new_type = new_type, old_type
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column(table, 'status', type_=new_type, existing_type=old_type,
+                        postgresql_using=case(values, to_code))
+    else:
+        op.execute("UPDATE %s SET status = %s" % (table, case(values, to_code)))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('status', type_=new_type, existing_type=old_type)
+
+
+def upgrade():
+    for table, (values, length) in STATUSES.items():
+        convert(table, values, length, True)
+
+    op.create_index('ix_rent_out_active', 'rent_out', ['id_rent_out'],
+                    postgresql_where=sa.text("status = 1"), sqlite_where=sa.text("status = 1"))
+    op.create_index('ix_rent_out_user_status', 'rent_out', ['id_user', 'status'])
+    op.create_index('ix_rent_in_user_status', 'rent_in', ['id_user', 'status'])
+    op.create_index('ix_rent_in_rent_out_status', 'rent_in', ['id_rent_out', 'status'])
+    op.create_index('ix_bag_id_user', 'bag', ['id_user'])
+    op.create_index('ix_bag_id_rent_out', 'bag', ['id_rent_out'])
+    op.create_index('ix_complaint_id_user', 'complaint', ['id_user'])
+    op.create_index('ix_complaint_id_rent_in', 'complaint', ['id_rent_in'])
+
+
+def downgrade():
+    op.drop_index('ix_complaint_id_rent_in', table_name='complaint')
+    op.drop_index('ix_complaint_id_user', table_name='complaint')
+    op.drop_index('ix_bag_id_rent_out', table_name='bag')
+    op.drop_index('ix_bag_id_user', table_name='bag')
+    op.drop_index('ix_rent_in_rent_out_status', table_name='rent_in')
+    op.drop_index('ix_rent_in_user_status', table_name='rent_in')
+    op.drop_index('ix_rent_out_user_status', table_name='rent_out')
+    op.drop_index('ix_rent_out_active', table_name='rent_out')
+
+    for table, (values, length) in STATUSES.items():
+        convert(table, values, length, False)
@@ -0,0 +1,61 @@
+"""exclusion constraint against overlapping bookings
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2023-06-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+# Забронированные периоды (статусы 2 «одобрена» и 3 «в аренде») одного объявления не пересекаются.
+# Ограничение есть только в PostgreSQL, остальные СУБД проверяются календарём в памяти приложения.
+# Заявки без дат периода не занимают и в ограничение не входят. {0} — префикс столбцов (псевдоним таблицы)
+BOOKED = "{0}status IN (2, 3) AND {0}date_rent_start IS NOT NULL AND {0}date_rent_finish IS NOT NULL"
+
+
+# Забронированные заявки, из-за которых ограничение нельзя добавить: с началом позже окончания
+# и пересекающиеся периоды одного объявления
+def conflicts(bind):
+    lines = ["заявка %d: начало %s позже окончания %s" % tuple(row) for row in bind.execute(sa.text(
+        "SELECT a.id_rent_in, a.date_rent_start, a.date_rent_finish FROM rent_in a "
+        "WHERE %s AND a.date_rent_start > a.date_rent_finish ORDER BY a.id_rent_in" % BOOKED.format('a.')))]
+    if lines:
+        return lines
+    return ["объявление %d: заявки %d и %d" % tuple(row) for row in bind.execute(sa.text(
+        "SELECT a.id_rent_out, a.id_rent_in, b.id_rent_in FROM rent_in a "
+        "JOIN rent_in b ON b.id_rent_out = a.id_rent_out AND b.id_rent_in > a.id_rent_in "
+        "WHERE %s AND %s "
+        "AND tsrange(a.date_rent_start, a.date_rent_finish) && tsrange(b.date_rent_start, b.date_rent_finish) "
+        "ORDER BY a.id_rent_out, a.id_rent_in, b.id_rent_in" % (BOOKED.format('a.'), BOOKED.format('b.'))))]
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    # Пересекающиеся бронирования не исправляются автоматически: какую из одобренных аренд отменить, решает
+    # администратор, после чего миграция запускается снова
+    found = conflicts(bind)
+    if found:
+        raise RuntimeError("Нельзя добавить ограничение rent_in_no_overlap: забронированные периоды заявок "
+                           "пересекаются или неверны. Измените даты или статус заявок и повторите миграцию:\n"
+                           + "\n".join(found))
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    op.execute("ALTER TABLE rent_in ADD CONSTRAINT rent_in_no_overlap EXCLUDE USING gist "
+               "(id_rent_out WITH =, tsrange(date_rent_start, date_rent_finish) WITH &&) "
+               "WHERE (%s)" % BOOKED.format(''))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_constraint('rent_in_no_overlap', 'rent_in')
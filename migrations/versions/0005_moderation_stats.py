@@ -0,0 +1,82 @@
+"""summary tables for the moderation dashboard and complaint queue index
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2023-06-22 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+# Состоявшиеся аренды — заявки в статусах 2 «одобрена», 3 «в аренде», 4 «аренда завершена»;
+# открытые жалобы — статус 1 «рассматривается»
+COUNTED = "rent_in.status IN (2, 3, 4)"
+OPEN = "complaint.status = 1"
+
+
+def upgrade():
+    op.create_table('user_stat',
+                    sa.Column('id_user', sa.Integer(), nullable=False),
+                    sa.Column('open_complaints', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['id_user'], ['user.id'], ),
+                    sa.PrimaryKeyConstraint('id_user')
+                    )
+    op.create_index('ix_user_stat_open_complaints', 'user_stat', ['open_complaints'])
+    op.create_table('rent_out_stat',
+                    sa.Column('id_rent_out', sa.Integer(), nullable=False),
+                    sa.Column('rentals', sa.Integer(), nullable=False),
+                    sa.Column('complaints', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['id_rent_out'], ['rent_out.id_rent_out'], ),
+                    sa.PrimaryKeyConstraint('id_rent_out')
+                    )
+    op.create_index('ix_rent_out_stat_complaints', 'rent_out_stat', ['complaints'])
+    op.create_table('category_day_stat',
+                    sa.Column('day', sa.Date(), nullable=False),
+                    sa.Column('category', sa.String(length=100), nullable=False),
+                    sa.Column('rentals', sa.Integer(), nullable=False),
+                    sa.Column('revenue', sa.Numeric(precision=14, scale=2), nullable=False),
+                    sa.PrimaryKeyConstraint('day', 'category')
+                    )
+    op.create_index('ix_complaint_status', 'complaint', ['status', 'id_complaint'])
+
+    # Заполнение по существующим заявкам и жалобам, дальше сводные данные обновляет приложение
+    if op.get_bind().dialect.name == 'postgresql':
+        day = "CAST(rent_in.date_rent_start AS DATE)"
+        days = "EXTRACT(EPOCH FROM rent_in.date_rent_finish - rent_in.date_rent_start) / 86400"
+    else:
+        day = "date(rent_in.date_rent_start)"
+        days = "(julianday(rent_in.date_rent_finish) - julianday(rent_in.date_rent_start))"
+    op.execute("INSERT INTO rent_out_stat (id_rent_out, rentals, complaints) "
+               "SELECT rent_out.id_rent_out, "
+               "(SELECT count(*) FROM rent_in WHERE rent_in.id_rent_out = rent_out.id_rent_out AND %s), "
+               "(SELECT count(*) FROM complaint JOIN rent_in ON complaint.id_rent_in = rent_in.id_rent_in "
+               "WHERE rent_in.id_rent_out = rent_out.id_rent_out) "
+               "FROM rent_out WHERE EXISTS (SELECT 1 FROM rent_in WHERE rent_in.id_rent_out = rent_out.id_rent_out)"
+               % COUNTED)
+    op.execute("INSERT INTO user_stat (id_user, open_complaints) "
+               "SELECT rent_out.id_user, count(*) FROM complaint "
+               "JOIN rent_in ON complaint.id_rent_in = rent_in.id_rent_in "
+               "JOIN rent_out ON rent_in.id_rent_out = rent_out.id_rent_out "
+               "WHERE %s GROUP BY rent_out.id_user" % OPEN)
+    op.execute("INSERT INTO category_day_stat (day, category, rentals, revenue) "
+               "SELECT %s, coalesce(item.category, ''), count(*), "
+               "coalesce(sum(round(CAST(item.rent_price * %s AS NUMERIC), 2)), 0) FROM rent_in "
+               "JOIN rent_out ON rent_in.id_rent_out = rent_out.id_rent_out "
+               "JOIN item ON rent_out.id_item = item.id_item "
+               "WHERE %s GROUP BY %s, coalesce(item.category, '')" % (day, days, COUNTED, day))
+
+
+def downgrade():
+    op.drop_index('ix_complaint_status', table_name='complaint')
+    op.drop_table('category_day_stat')
+    op.drop_index('ix_rent_out_stat_complaints', table_name='rent_out_stat')
+    op.drop_table('rent_out_stat')
+    op.drop_index('ix_user_stat_open_complaints', table_name='user_stat')
+    op.drop_table('user_stat')
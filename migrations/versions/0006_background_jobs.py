@@ -0,0 +1,30 @@
+"""overdue flag and indexes for background jobs
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2023-06-26 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+# Статус 5 «заявка истекла» добавлен в конец списка статусов заявки и не требует изменения данных
+def upgrade():
+    op.add_column('rent_in', sa.Column('overdue', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.create_index('ix_rent_in_status_start', 'rent_in', ['status', 'date_rent_start'])
+    op.create_index('ix_rent_in_status_finish', 'rent_in', ['status', 'date_rent_finish'])
+
+
+def downgrade():
+    op.drop_index('ix_rent_in_status_finish', table_name='rent_in')
+    op.drop_index('ix_rent_in_status_start', table_name='rent_in')
+    with op.batch_alter_table('rent_in') as batch_op:
+        batch_op.drop_column('overdue')
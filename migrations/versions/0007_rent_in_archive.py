@@ -0,0 +1,50 @@
+"""archive table for finished rental history
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2023-06-29 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+# В PostgreSQL таблица секционирована по месяцам окончания аренды; секции создаёт задача archive_history.
+# Данные переносятся в архив задачей постепенно, пачками
+def upgrade():
+    op.create_table('rent_in_archive',
+                    sa.Column('id_rent_in', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('date_rent_finish', sa.DateTime(), nullable=False),
+                    sa.Column('status', sa.SmallInteger(), nullable=True),
+                    sa.Column('date_rent_start', sa.DateTime(), nullable=True),
+                    sa.Column('note', sa.Text(), nullable=True),
+                    sa.Column('overdue', sa.Boolean(), nullable=False, server_default=sa.false()),
+                    sa.Column('id_user', sa.Integer(), nullable=True),
+                    sa.Column('id_rent_out', sa.Integer(), nullable=True),
+                    sa.Column('id_owner', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['id_user'], ['user.id'], ),
+                    sa.ForeignKeyConstraint(['id_rent_out'], ['rent_out.id_rent_out'], ),
+                    sa.ForeignKeyConstraint(['id_owner'], ['user.id'], ),
+                    sa.PrimaryKeyConstraint('id_rent_in', 'date_rent_finish'),
+                    postgresql_partition_by='RANGE (date_rent_finish)'
+                    )
+    op.create_index('ix_rent_in_archive_user_finish', 'rent_in_archive', ['id_user', 'date_rent_finish', 'id_rent_in'])
+    op.create_index('ix_rent_in_archive_owner_finish', 'rent_in_archive',
+                    ['id_owner', 'date_rent_finish', 'id_rent_in'])
+
+
+# Архивные заявки возвращаются в rent_in
+def downgrade():
+    op.execute("INSERT INTO rent_in (id_rent_in, status, date_rent_start, date_rent_finish, note, overdue, id_user, "
+               "id_rent_out) SELECT id_rent_in, status, date_rent_start, date_rent_finish, note, overdue, id_user, "
+               "id_rent_out FROM rent_in_archive")
+    op.drop_index('ix_rent_in_archive_owner_finish', table_name='rent_in_archive')
+    op.drop_index('ix_rent_in_archive_user_finish', table_name='rent_in_archive')
+    op.drop_table('rent_in_archive')
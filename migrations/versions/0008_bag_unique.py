@@ -0,0 +1,29 @@
+"""unique favourite per user and listing
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2023-07-06 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+# Повторы объявления в избранном пользователя удаляются (остаётся первое добавление); уникальный индекс
+# (id_user, id_rent_out) заменяет индекс по id_user
+def upgrade():
+    op.execute("DELETE FROM bag WHERE id_bag NOT IN "
+               "(SELECT MIN(id_bag) FROM bag GROUP BY id_user, id_rent_out)")
+    op.create_index('uq_bag_user_rent_out', 'bag', ['id_user', 'id_rent_out'], unique=True)
+    op.drop_index('ix_bag_id_user', table_name='bag')
+
+
+def downgrade():
+    op.create_index('ix_bag_id_user', 'bag', ['id_user'])
+    op.drop_index('uq_bag_user_rent_out', table_name='bag')
@@ -0,0 +1,43 @@
+"""catalog sort and filter indexes on listings
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2023-07-08 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+ACTIVE = sa.text("status = 1")
+
+
+# Категория и цена предмета копируются в объявление, чтобы страницы каталога с фильтром по категории и сортировкой
+# по цене читались частичными индексами по активным объявлениям в порядке ключа страницы
+def upgrade():
+    op.add_column('rent_out', sa.Column('category', sa.String(length=100), nullable=True))
+    op.add_column('rent_out', sa.Column('rent_price', sa.Numeric(), nullable=True))
+    op.execute("UPDATE rent_out SET "
+               "category = (SELECT item.category FROM item WHERE item.id_item = rent_out.id_item), "
+               "rent_price = (SELECT item.rent_price FROM item WHERE item.id_item = rent_out.id_item)")
+    op.create_index('ix_rent_out_active_price', 'rent_out', ['rent_price', 'id_rent_out'],
+                    postgresql_where=ACTIVE, sqlite_where=ACTIVE)
+    op.create_index('ix_rent_out_active_category', 'rent_out', ['category', 'id_rent_out'],
+                    postgresql_where=ACTIVE, sqlite_where=ACTIVE)
+    op.create_index('ix_rent_out_active_category_price', 'rent_out', ['category', 'rent_price', 'id_rent_out'],
+                    postgresql_where=ACTIVE, sqlite_where=ACTIVE)
+
+
+def downgrade():
+    op.drop_index('ix_rent_out_active_category_price', table_name='rent_out')
+    op.drop_index('ix_rent_out_active_category', table_name='rent_out')
+    op.drop_index('ix_rent_out_active_price', table_name='rent_out')
+    with op.batch_alter_table('rent_out') as batch_op:
+        batch_op.drop_column('rent_price')
+        batch_op.drop_column('category')
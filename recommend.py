@@ -0,0 +1,194 @@
+# Рекомендации объявлений: похожие по тексту и категории (косинусная близость векторов TF-IDF) и «с этим
+# также арендуют» (косинусная близость множеств пользователей, арендовавших объявление или добавивших его в корзину).
+# Модуль не импортирует приложение: индекс строится в пуле процессов или командой flask --app app build-recommendations
+import os
+
+import numpy as np
+
+# Число соседей, хранимых для каждого объявления
+TOP_K = 20
+# Максимальное число элементов промежуточных матриц при поиске соседей блоками строк
+BLOCK_ELEMENTS = 2 ** 22
+# Столбцы, которые есть больше чем в DENSE_SHARE строк (не больше DENSE_COLUMNS самых частых),
+# перемножаются как плотные матрицы
+DENSE_COLUMNS = 256
+DENSE_SHARE = 0.01
+# Вес близости по тексту относительно близости по арендам в персональных рекомендациях
+TEXT_WEIGHT = 0.5
+# Массивы индекса в порядке сохранения в файл
+ARRAYS = ('listings', 'similar', 'similar_scores', 'also', 'also_scores', 'popular')
+
+
+# Разреженная матрица в формате CSR по парам (строка, столбец) с весами; повторы пар складываются
+def sparse(rows, columns, weights, n_rows, n_columns):
+    codes, inverse = np.unique(rows * n_columns + columns, return_inverse=True)
+    data = np.bincount(inverse, weights=weights).astype(np.float32)
+    indptr = np.zeros(n_rows + 1, np.int64)
+    np.cumsum(np.bincount(codes // n_columns, minlength=n_rows), out=indptr[1:])
+    return indptr, (codes % n_columns).astype(np.int64), data
+
+
+# Для каждой строки — k других строк с наибольшей косинусной близостью (-1, если близких строк меньше k);
+# normalized — строки уже нормированы. Произведение матрицы на себя транспонированную считается блоками строк:
+# частые столбцы (больше DENSE_SHARE строк) перемножаются как плотные матрицы, а для остальных ненулевых элементов
+# строки блока перебираются строки того же столбца
+def top_k_cosine(indptr, indices, data, n_columns, k, normalized=False):
+    n = len(indptr) - 1
+    neighbours = np.full((n, k), -1, np.int32)
+    scores = np.zeros((n, k), np.float32)
+    k = min(k, n - 1)
+    if k <= 0 or not len(data):
+        return neighbours, scores
+    row_of = np.repeat(np.arange(n), np.diff(indptr))
+    if not normalized:
+        norms = np.sqrt(np.bincount(row_of, weights=data.astype(np.float64) ** 2, minlength=n))
+        data = (data / norms[row_of]).astype(np.float32)
+
+    df = np.bincount(indices, minlength=n_columns)
+    frequent = np.argsort(-df, kind='stable')[:DENSE_COLUMNS]
+    frequent = frequent[df[frequent] > DENSE_SHARE * n]
+    dense_column = np.full(n_columns, -1, np.int64)
+    dense_column[frequent] = np.arange(len(frequent))
+    in_dense = dense_column[indices] >= 0
+    dense = np.zeros((n, len(frequent)), np.float32)
+    dense[row_of[in_dense], dense_column[indices[in_dense]]] = data[in_dense]
+
+    rows, columns, values = row_of[~in_dense], indices[~in_dense], data[~in_dense]
+    row_ptr = np.zeros(n + 1, np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=row_ptr[1:])
+    order = np.argsort(columns, kind='stable')
+    column_rows, column_values = rows[order], values[order]
+    column_ptr = np.zeros(n_columns + 1, np.int64)
+    np.cumsum(np.bincount(columns, minlength=n_columns), out=column_ptr[1:])
+    # Число произведений редких столбцов для строк до каждой строки включительно: по нему выбираются границы блоков
+    column_counts = np.diff(column_ptr)
+    cost = np.cumsum(np.bincount(rows, weights=column_counts[columns], minlength=n))
+
+    a = 0
+    while a < n:
+        limit = (cost[a - 1] if a else 0) + BLOCK_ELEMENTS
+        b = min(a + max(1, BLOCK_ELEMENTS // n), int(np.searchsorted(cost, limit, side='right')))
+        b = max(b, a + 1)
+        similarity = dense[a:b] @ dense.T
+        lo, hi = row_ptr[a], row_ptr[b]
+        counts = column_counts[columns[lo:hi]]
+        if counts.sum():
+            # Номера элементов столбцов для каждого ненулевого элемента строк блока
+            offsets = np.repeat(column_ptr[columns[lo:hi]] - np.cumsum(counts) + counts, counts) + \
+                np.arange(counts.sum())
+            similarity += np.bincount(
+                np.repeat(rows[lo:hi] - a, counts) * n + column_rows[offsets],
+                weights=np.repeat(values[lo:hi], counts) * column_values[offsets],
+                minlength=(b - a) * n).reshape(b - a, n).astype(np.float32)
+        similarity[np.arange(b - a), np.arange(a, b)] = 0
+        top = np.argpartition(similarity, n - k, axis=1)[:, n - k:]
+        top_scores = np.take_along_axis(similarity, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        empty = top_scores <= 0
+        top[empty] = -1
+        top_scores[empty] = 0
+        neighbours[a:b, :k] = top
+        scores[a:b, :k] = top_scores
+        a = b
+    return neighbours, scores
+
+
+# Матрица TF-IDF: строки — документы (списки слов), столбцы — слова, встречающиеся хотя бы в двух документах.
+# Слова одного документа не влияют на близость документов, но учитываются в длине вектора документа
+def tf_idf(documents):
+    vocabulary = {}
+    rows, columns = [], []
+    for n, tokens in enumerate(documents):
+        rows.extend([n] * len(tokens))
+        columns.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+    n_rows, n_columns = len(documents), max(len(vocabulary), 1)
+    rows, columns = np.array(rows, np.int64), np.array(columns, np.int64)
+    indptr, indices, counts = sparse(rows, columns, np.ones(len(rows)), n_rows, n_columns)
+    df = np.bincount(indices, minlength=n_columns)
+    weights = (1 + np.log(counts)) * (np.log((1 + n_rows) / (1 + df)) + 1)[indices]
+    row_of = np.repeat(np.arange(n_rows), np.diff(indptr))
+    norms = np.sqrt(np.bincount(row_of, weights=weights ** 2, minlength=n_rows))
+    shared = df[indices] > 1
+    # Веса нормируются по всем словам документа, в матрицу попадают только общие слова
+    weights = weights / norms[row_of]
+    return sparse(row_of[shared], indices[shared], weights[shared], n_rows, n_columns) + (n_columns,)
+
+
+# Построение индекса. listings — номера объявлений, documents — слова каждого объявления,
+# baskets — пары (пользователь, объявление) из аренд и корзин
+def build(listings, documents, baskets, k=TOP_K):
+    order = np.argsort(listings, kind='stable')
+    listings = np.asarray(listings, np.int64)[order]
+    documents = [documents[i] for i in order]
+    indptr, indices, data, n_columns = tf_idf(documents)
+    similar, similar_scores = top_k_cosine(indptr, indices, data, n_columns, k, normalized=True)
+
+    users = np.array([a[0] for a in baskets], np.int64)
+    rented = np.array([a[1] for a in baskets], np.int64)
+    positions = np.searchsorted(listings, rented)
+    # Аренды и корзины неактивных объявлений в индекс не попадают
+    known = positions < len(listings)
+    known[known] = listings[positions[known]] == rented[known]
+    users, positions = users[known], positions[known]
+    user_ids, users = np.unique(users, return_inverse=True)
+    n_users = max(len(user_ids), 1)
+    indptr, indices, data = sparse(positions, users, np.ones(len(users)), len(listings), n_users)
+    # Пользователь учитывается в объявлении один раз, сколько бы раз он его ни арендовал
+    data[:] = 1
+    also, also_scores = top_k_cosine(indptr, indices, data, n_users, k)
+
+    renters = np.diff(indptr)
+    popular = np.argsort(-renters, kind='stable')[:np.count_nonzero(renters)].astype(np.int32)
+    return {'listings': listings, 'similar': similar, 'similar_scores': similar_scores,
+            'also': also, 'also_scores': also_scores, 'popular': popular}
+
+
+# Индекс рекомендаций в памяти процесса; запросы к нему не обращаются к БД
+class Recommendations:
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.positions = {int(id_rent_out): n for n, id_rent_out in enumerate(self.listings)}
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in ARRAYS})
+
+    def save(self, path):
+        # Запись во временный файл и переименование, чтобы процессы приложения не прочитали недописанный индекс
+        with open(path + ".tmp", "wb") as file:
+            np.savez(file, **{name: getattr(self, name) for name in ARRAYS})
+        os.replace(path + ".tmp", path)
+
+    def neighbours(self, table, id_rent_out, k):
+        position = self.positions.get(id_rent_out)
+        if position is None:
+            return []
+        row = table[position, :k]
+        return self.listings[row[row >= 0]].tolist()
+
+    # Объявления, похожие на id_rent_out по тексту и категории
+    def similar_to(self, id_rent_out, k):
+        return self.neighbours(self.similar, id_rent_out, k)
+
+    # Объявления, которые арендуют те же пользователи, что и id_rent_out
+    def also_rented(self, id_rent_out, k):
+        return self.neighbours(self.also, id_rent_out, k)
+
+    # Персональные рекомендации по объявлениям history, которые пользователь арендовал или добавил в корзину:
+    # сумма близостей соседей этих объявлений; без истории — объявления с наибольшим числом арендаторов
+    def suggest(self, history, k):
+        seen = np.array([self.positions[a] for a in history if a in self.positions], np.int64)
+        candidates = np.concatenate((self.also[seen].ravel(), self.similar[seen].ravel()))
+        weights = np.concatenate((self.also_scores[seen].ravel(), TEXT_WEIGHT * self.similar_scores[seen].ravel()))
+        valid = (candidates >= 0) & ~np.isin(candidates, seen)
+        candidates, inverse = np.unique(candidates[valid], return_inverse=True)
+        scores = np.bincount(inverse, weights=weights[valid], minlength=len(candidates))
+        ranked = candidates[np.argsort(-scores, kind='stable')[:k]]
+        if len(ranked) < k:
+            popular = self.popular[~np.isin(self.popular, np.concatenate((seen, ranked)))]
+            ranked = np.concatenate((ranked, popular[:k - len(ranked)]))
+        return self.listings[ranked].tolist()
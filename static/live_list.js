@@ -0,0 +1,195 @@
+// Запуск обработчиков списка после разбора разметки: скрипты страниц выполняются до разметки списка
+function whenReady(start) {
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', start);
+    } else {
+        start();
+    }
+}
+
+// Список на странице, который сервер обновляет изменениями (событие 'delta') вместо пересылки всего списка.
+// view — название списка и события с полным списком, key — поле ключа строки, card — построение карточки строки,
+// initial — список, встроенный сервером в страницу: он показывается сразу, а после подключения сервер присылает
+// только изменения после его версии. Строки в списке упорядочены по убыванию ключа.
+function liveList(socket, view, key, card, initial) {
+    const container = () => document.querySelector('#items');
+    // Версия списка на странице; null, пока полный список не получен
+    let state = null;
+    // Изменения, пришедшие до полного списка
+    let pending = [];
+
+    // Запрос списка: с версией страницы сервер присылает только изменения после неё
+    function reload() {
+        if (state === null) {
+            socket.emit('reload_' + view);
+        } else {
+            socket.emit('reload_' + view, JSON.stringify(state));
+        }
+    }
+
+    function node(row) {
+        const element = card(row);
+        element.dataset.key = row[key];
+        return element;
+    }
+
+    // Добавление, замена или удаление одной карточки
+    function patch(change) {
+        const old = container().querySelector('[data-key="' + change.key + '"]');
+        if (change.op === 'removed') {
+            if (old) {
+                old.remove();
+            }
+            return;
+        }
+        const element = node(change.row);
+        if (old) {
+            old.replaceWith(element);
+            return;
+        }
+        const next = Array.from(container().children).find(child => Number(child.dataset.key) < change.key);
+        container().insertBefore(element, next || null);
+    }
+
+    function apply(changes) {
+        for (const change of changes) {
+            if (change.epoch !== state.epoch || change.version > state.version + 1) {
+                // Пропущены изменения или список построен другим процессом сервера: полная перезагрузка
+                state = null;
+                reload();
+                return;
+            }
+            if (change.version === state.version + 1) {
+                patch(change);
+                state.version = change.version;
+            }
+        }
+    }
+
+    function show(list) {
+        container().replaceChildren(...list.items.map(node));
+        state = {epoch: list.epoch, version: list.version};
+        const changes = pending;
+        pending = [];
+        apply(changes.filter(change => change.epoch !== state.epoch || change.version > state.version));
+    }
+
+    whenReady(function () {
+        if (initial) {
+            show(initial);
+        }
+        socket.on('connect', reload);
+        // Запрос списка мог быть отклонён ограничением частоты событий: список перечитывается позже
+        socket.on('rate_limited', () => setTimeout(reload, 1000));
+        socket.on(view, data => show(JSON.parse(data)));
+        socket.on('delta', function (data) {
+            const changes = JSON.parse(data).filter(change => change.view === view);
+            if (state === null) {
+                pending.push(...changes);
+            } else {
+                apply(changes);
+            }
+        });
+        if (socket.connected) {
+            reload();
+        }
+    });
+}
+
+// Список из страниц с курсором (история аренд): сервер присылает страницу в событии view
+// ({first, cursor, items, date_from, date_to}), следующую страницу клиент запрашивает с курсором из предыдущей.
+// Строки упорядочены по убыванию (order, key). Изменения ('delta') применяются к показанным строкам, новая строка
+// добавляется, если она попадает в фильтр и в уже загруженную часть списка.
+// filters — параметры запроса страницы (date_from, date_to — диапазон дат поля order включительно);
+// initial — первая страница без фильтров, встроенная сервером: после подключения запрашиваются изменения после неё
+function pagedList(socket, view, key, order, card, filters, initial) {
+    const container = () => document.querySelector('#items');
+    let params = {};
+    let cursor = null;
+    // Версия встроенной страницы до первого подключения
+    let since = initial ? {epoch: initial.epoch, version: initial.version} : null;
+
+    function node(row) {
+        const element = card(row);
+        element.dataset.key = row[key];
+        element.dataset.order = row[order];
+        return element;
+    }
+
+    // Строка a раньше строки b в порядке списка
+    function before(a, b) {
+        return a.order > b.order || (a.order === b.order && Number(a.key) > Number(b.key));
+    }
+
+    function matches(row) {
+        const day = row[order].slice(0, 10);
+        return (!params.date_from || day >= params.date_from) && (!params.date_to || day <= params.date_to);
+    }
+
+    function patch(change) {
+        const old = container().querySelector('[data-key="' + change.key + '"]');
+        if (change.op === 'removed' || !matches(change.row)) {
+            if (old) {
+                old.remove();
+            }
+            return;
+        }
+        const element = node(change.row);
+        if (old) {
+            old.replaceWith(element);
+            return;
+        }
+        const next = Array.from(container().children).find(child => before(element.dataset, child.dataset));
+        // Строка после последней загруженной придёт со следующими страницами
+        if (next || cursor === null) {
+            container().insertBefore(element, next || null);
+        }
+    }
+
+    // Загрузка первой страницы с текущими фильтрами
+    function reload() {
+        params = filters();
+        socket.emit('reload_' + view, JSON.stringify(params));
+    }
+
+    function next() {
+        socket.emit('reload_' + view, JSON.stringify(Object.assign({cursor: cursor}, params)));
+    }
+
+    function connected() {
+        if (since === null) {
+            reload();
+        } else {
+            socket.emit('reload_' + view, JSON.stringify(since));
+            since = null;
+        }
+    }
+
+    function show(page) {
+        if ((page.date_from || '') !== (params.date_from || '') || (page.date_to || '') !== (params.date_to || '')) {
+            return;
+        }
+        if (page.first) {
+            container().replaceChildren();
+        }
+        container().append(...page.items.map(node));
+        cursor = page.cursor;
+        document.querySelector('#more').hidden = cursor === null;
+    }
+
+    whenReady(function () {
+        if (initial) {
+            show(initial);
+        }
+        socket.on('connect', connected);
+        socket.on(view, data => show(JSON.parse(data)));
+        socket.on('delta', function (data) {
+            JSON.parse(data).filter(change => change.view === view).forEach(patch);
+        });
+        if (socket.connected) {
+            connected();
+        }
+    });
+
+    return {reload: reload, next: next};
+}